@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gAuth.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+#
+#   ClientLogin does not say when a token expires, so tokens are treated
+#   as good for lifetime seconds, refreshed in the background a little
+#   before that, and dropped early if the server rejects one.
+
+import sys
+import threading
+import time
+
+
+class TokenManager(object):
+    """
+    ClientLogin tokens of the Google services GNet talks to, one login
+    per service. Tokens are handed out to be passed with each request,
+    so no client object's credentials are ever swapped.
+    """
+
+    def __init__(self, email, password, lifetime=6 * 3600, margin=600):
+        """
+        Purpose: Create a manager holding no tokens yet
+        email: String account email address
+        password: String account password
+        lifetime: Float seconds a token is used for
+        margin: Float seconds before the end of its lifetime a token is
+                refreshed in the background
+        Returns: Nothing
+        """
+        self.email = email
+        self.password = password
+        self.lifetime = lifetime
+        self.margin = margin
+        self.factories = {}
+        self.tokens = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.logins = 0
+
+    def register(self, service, factory):
+        """
+        Purpose: Say how to log in to a service
+        service: String service name, e.g. 'wise' for spreadsheets
+        factory: Function returning a gdata service object to log in with
+        """
+        with self.lock:
+            self.factories[service] = factory
+            self.locks[service] = threading.Lock()
+
+    def get(self, service):
+        """
+        Purpose: Token for a service, logging in only if there is no
+                 valid one
+        service: String name passed to register
+        Returns: gdata.auth.ClientLoginToken
+        """
+        cached = self.tokens.get(service)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        with self.locks[service]:
+            # Another thread may have logged in meanwhile
+            cached = self.tokens.get(service)
+            if cached is not None and cached[1] > time.time():
+                return cached[0]
+            return self._login(service)
+
+    def invalidate(self, service, token=None):
+        """
+        Purpose: Drop a token the server rejected
+        service: String service name
+        token: The rejected token; a newer one is kept
+        """
+        with self.lock:
+            cached = self.tokens.get(service)
+            if cached is not None and (token is None or cached[0] is token):
+                del self.tokens[service]
+
+    def _login(self, service):
+        """
+        Purpose: Log in to a service and cache its token
+        Returns: gdata.auth.ClientLoginToken
+        """
+        client = self.factories[service]()
+        client.ClientLogin(self.email, self.password, source='google-docs-fs')
+        token = client.current_token
+        with self.lock:
+            self.tokens[service] = (token, time.time() + self.lifetime)
+            self.logins += 1
+        return token
+
+    def start(self):
+        """
+        Purpose: Refresh tokens in the background before they run out
+        """
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, name='gdfs-auth')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """
+        Purpose: Stop the background refresh thread
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        """
+        Purpose: Log in again to every service whose token is about to
+                 run out
+        """
+        while not self.stopping.wait(min(self.margin / 2.0, 60)):
+            now = time.time()
+            with self.lock:
+                due = [s for s, (token, expires) in self.tokens.items()
+                       if expires - now < self.margin]
+            for service in due:
+                try:
+                    with self.locks[service]:
+                        self._login(service)
+                except Exception as e:
+                    sys.stderr.write('refreshing %s token failed: %s\n' % (service, e))
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gBitmap.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import binascii
+import struct
+from array import array
+from bisect import bisect_left
+
+# Roaring layout: ids are split on their high 16 bits into chunks of
+# 65536 values. A chunk holding at most ARRAY_MAX values is a sorted
+# array of its low 16 bits, a fuller chunk is a 65536-bit bitset.
+ARRAY_MAX = 4096
+CHUNK_BITS = 65536
+CHUNK_BYTES = CHUNK_BITS // 8
+
+# Serialised container header: high 16 bits, cardinality, kind
+_HEADER = struct.Struct('<IIB')
+
+# Positions of the set bits of every byte value
+_BYTE_BITS = [tuple(b for b in range(8) if v & (1 << b)) for v in range(256)]
+
+
+def array_bytes(values):
+    """
+    Purpose: Raw bytes of an array ('tostring' before Python 3.2)
+    Returns: Bytes
+    """
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
+def byte_view(buf, offset, size):
+    """
+    Purpose: Slice buf without copying it. Python 2 mmaps cannot back a
+             memoryview, so they are sliced with buffer instead.
+    buf: Bytes-like object, e.g. an mmap
+    offset: Int start of the slice
+    size: Int length of the slice
+    Returns: memoryview or buffer
+    """
+    try:
+        return memoryview(buf)[offset:offset + size]
+    except TypeError:
+        return buffer(buf, offset, size)
+
+
+def array_from(typecode, data):
+    """
+    Purpose: Build an array from raw bytes written by array_bytes
+    typecode: String array type code
+    data: Bytes, memoryview or buffer
+    Returns: array
+    """
+    values = array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data.tobytes() if isinstance(data, memoryview) else data)
+    return values
+
+
+def _popcount(x):
+    """
+    Purpose: Count the set bits of a non-negative integer
+    Returns: Int number of set bits
+    """
+    if hasattr(x, 'bit_count'):
+        return x.bit_count()
+    return bin(x).count('1')
+
+
+def _bytes_to_int(data):
+    """
+    Purpose: Read a little-endian bitset as one integer so set algebra
+             runs word by word inside the interpreter
+    data: bytearray of CHUNK_BYTES bytes
+    Returns: Int (long) holding the same bits
+    """
+    return int(binascii.hexlify(bytes(data[::-1])), 16)
+
+
+def _int_to_bytes(x):
+    """
+    Purpose: Inverse of _bytes_to_int
+    x: Int (long) holding at most CHUNK_BITS bits
+    Returns: bytearray of CHUNK_BYTES bytes
+    """
+    data = bytearray(binascii.unhexlify('%0*x' % (CHUNK_BYTES * 2, x)))
+    data.reverse()
+    return data
+
+
+class _ArrayContainer(object):
+    """
+    Sparse chunk: sorted low 16 bits of its ids
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, values=None):
+        self.values = array('H', values or [])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __contains__(self, low):
+        i = bisect_left(self.values, low)
+        return i < len(self.values) and self.values[i] == low
+
+    def add(self, low):
+        """
+        Purpose: Insert low
+        Returns: True if low was not present before
+        """
+        i = bisect_left(self.values, low)
+        if i < len(self.values) and self.values[i] == low:
+            return False
+        self.values.insert(i, low)
+        return True
+
+    def discard(self, low):
+        """
+        Purpose: Remove low
+        Returns: True if low was present
+        """
+        i = bisect_left(self.values, low)
+        if i < len(self.values) and self.values[i] == low:
+            del self.values[i]
+            return True
+        return False
+
+    def as_int(self):
+        x = 0
+        for low in self.values:
+            x |= 1 << low
+        return x
+
+
+class _BitmapContainer(object):
+    """
+    Dense chunk: one bit per possible low 16 bits
+    """
+    __slots__ = ('bits', 'card')
+
+    def __init__(self, bits=None, card=0):
+        self.bits = bits if bits is not None else bytearray(CHUNK_BYTES)
+        self.card = card
+
+    def __len__(self):
+        return self.card
+
+    def __iter__(self):
+        for i, byte in enumerate(self.bits):
+            if byte:
+                base = i << 3
+                for b in _BYTE_BITS[byte]:
+                    yield base + b
+
+    def __contains__(self, low):
+        return bool(self.bits[low >> 3] & (1 << (low & 7)))
+
+    def add(self, low):
+        mask = 1 << (low & 7)
+        if self.bits[low >> 3] & mask:
+            return False
+        self.bits[low >> 3] |= mask
+        self.card += 1
+        return True
+
+    def discard(self, low):
+        mask = 1 << (low & 7)
+        if not self.bits[low >> 3] & mask:
+            return False
+        self.bits[low >> 3] &= ~mask & 0xFF
+        self.card -= 1
+        return True
+
+    def as_int(self):
+        return _bytes_to_int(self.bits)
+
+
+def _from_int(x):
+    """
+    Purpose: Build the right kind of container for the bits of x
+    Returns: A container, or None if x is empty
+    """
+    card = _popcount(x)
+    if card == 0:
+        return None
+    container = _BitmapContainer(_int_to_bytes(x), card)
+    if card <= ARRAY_MAX:
+        return _ArrayContainer(list(container))
+    return container
+
+
+def _from_values(values):
+    """
+    Purpose: Build the right kind of container for sorted low values
+    Returns: A container, or None if values is empty
+    """
+    if not values:
+        return None
+    if len(values) <= ARRAY_MAX:
+        return _ArrayContainer(values)
+    container = _BitmapContainer()
+    for low in values:
+        container.add(low)
+    return container
+
+
+class RoaringBitmap(object):
+    """
+    Compressed set of non-negative integer ids with fast AND/OR/ANDNOT
+    """
+
+    def __init__(self, values=None):
+        """
+        Purpose: Create a bitmap, optionally filled from an iterable of ids
+        values: Iterable of ints
+        Returns: Nothing
+        """
+        self.containers = {}
+        self.card = 0
+        if values is not None:
+            chunk = []
+            high = None
+            for v in sorted(set(values)):
+                if v >> 16 != high:
+                    self._put(high, _from_values(chunk))
+                    high, chunk = v >> 16, []
+                chunk.append(v & 0xFFFF)
+            self._put(high, _from_values(chunk))
+
+    @classmethod
+    def from_range(cls, start, stop):
+        """
+        Purpose: Build the bitmap of every id in [start, stop)
+        Returns: A RoaringBitmap
+        """
+        bitmap = cls()
+        v = start
+        while v < stop:
+            high = v >> 16
+            end = min(stop, (high + 1) << 16)
+            lo, hi = v & 0xFFFF, ((end - 1) & 0xFFFF) + 1
+            bitmap._put(high, _from_int(((1 << (hi - lo)) - 1) << lo))
+            v = end
+        return bitmap
+
+    def _put(self, high, container):
+        """
+        Purpose: Store container under high, dropping empty containers
+        """
+        if container is not None and len(container):
+            self.containers[high] = container
+            self.card += len(container)
+
+    def __len__(self):
+        return self.card
+
+    def __bool__(self):
+        return self.card > 0
+
+    __nonzero__ = __bool__
+
+    def __contains__(self, v):
+        container = self.containers.get(v >> 16)
+        return container is not None and (v & 0xFFFF) in container
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            base = high << 16
+            for low in self.containers[high]:
+                yield base + low
+
+    def iter_from(self, start):
+        """
+        Purpose: Stream the ids >= start in ascending order. Each chunk
+                 is copied before it is walked, so the bitmap may change
+                 between chunks without breaking the iteration.
+        start: Int first id of interest
+        Returns: Generator of ints
+        """
+        high = start >> 16
+        while True:
+            highs = [h for h in list(self.containers) if h >= high]
+            if not highs:
+                return
+            high = min(highs)
+            container = self.containers.get(high)
+            values = list(container) if container is not None else []
+            base = high << 16
+            for low in values:
+                if base + low >= start:
+                    yield base + low
+            high += 1
+
+    def __repr__(self):
+        return 'RoaringBitmap(%d ids)' % self.card
+
+    def add(self, v):
+        """
+        Purpose: Insert id v, promoting its chunk to a bitset once full
+        """
+        high, low = v >> 16, v & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            container = self.containers[high] = _ArrayContainer()
+        if container.add(low):
+            self.card += 1
+            if isinstance(container, _ArrayContainer) and len(container) > ARRAY_MAX:
+                self.containers[high] = _from_int(container.as_int())
+
+    def discard(self, v):
+        """
+        Purpose: Remove id v if present
+        """
+        high = v >> 16
+        container = self.containers.get(high)
+        if container is not None and container.discard(v & 0xFFFF):
+            self.card -= 1
+            if not len(container):
+                del self.containers[high]
+            elif isinstance(container, _BitmapContainer) and len(container) <= ARRAY_MAX // 2:
+                self.containers[high] = _ArrayContainer(list(container))
+
+    def copy(self):
+        """
+        Purpose: Independent copy of this bitmap
+        Returns: A RoaringBitmap
+        """
+        result = RoaringBitmap()
+        for high, container in self.containers.items():
+            if isinstance(container, _ArrayContainer):
+                result._put(high, _ArrayContainer(container.values))
+            else:
+                result._put(high, _BitmapContainer(bytearray(container.bits), container.card))
+        return result
+
+    def __and__(self, other):
+        result = RoaringBitmap()
+        if len(other.containers) < len(self.containers):
+            self, other = other, self
+        for high, a in self.containers.items():
+            b = other.containers.get(high)
+            if b is None:
+                continue
+            if isinstance(a, _BitmapContainer) and isinstance(b, _BitmapContainer):
+                result._put(high, _from_int(a.as_int() & b.as_int()))
+            else:
+                if isinstance(a, _BitmapContainer):
+                    a, b = b, a
+                result._put(high, _from_values([low for low in a.values if low in b]))
+        return result
+
+    def __or__(self, other):
+        result = self.copy()
+        for high, b in other.containers.items():
+            a = result.containers.get(high)
+            if a is None:
+                result._put(high, _from_int(b.as_int()) if isinstance(b, _BitmapContainer)
+                            else _ArrayContainer(b.values))
+                continue
+            result.card -= len(a)
+            del result.containers[high]
+            if isinstance(a, _ArrayContainer) and isinstance(b, _ArrayContainer) \
+                    and len(a) + len(b) <= ARRAY_MAX:
+                result._put(high, _from_values(sorted(set(a.values).union(b.values))))
+            else:
+                result._put(high, _from_int(a.as_int() | b.as_int()))
+        return result
+
+    def __sub__(self, other):
+        result = RoaringBitmap()
+        for high, a in self.containers.items():
+            b = other.containers.get(high)
+            if b is None:
+                result._put(high, _ArrayContainer(a.values) if isinstance(a, _ArrayContainer)
+                            else _BitmapContainer(bytearray(a.bits), a.card))
+            elif isinstance(a, _ArrayContainer):
+                result._put(high, _from_values([low for low in a.values if low not in b]))
+            else:
+                result._put(high, _from_int(a.as_int() & ~b.as_int()))
+        return result
+
+    def dump(self):
+        """
+        Purpose: Serialise the bitmap. Array chunks are stored as their
+                 native 16 bit values and bitset chunks as raw bytes, so
+                 load only has to copy them back.
+        Returns: Bytes
+        """
+        parts = [struct.pack('<I', len(self.containers))]
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            if isinstance(container, _ArrayContainer):
+                parts.append(_HEADER.pack(high, len(container), 0))
+                parts.append(array_bytes(container.values))
+            else:
+                parts.append(_HEADER.pack(high, container.card, 1))
+                parts.append(bytes(container.bits))
+        return b''.join(parts)
+
+    @classmethod
+    def load(cls, buf, offset=0):
+        """
+        Purpose: Rebuild a bitmap written by dump
+        buf: Bytes-like object (e.g. an mmap) holding the dump
+        offset: Int position of the dump in buf
+        Returns: Tuple (RoaringBitmap, Int offset just past the dump)
+        """
+        bitmap = cls()
+        n, = struct.unpack_from('<I', buf, offset)
+        offset += 4
+        for _ in range(n):
+            high, card, kind = _HEADER.unpack_from(buf, offset)
+            offset += _HEADER.size
+            if kind == 0:
+                values = array_from('H', byte_view(buf, offset, 2 * card))
+                offset += 2 * card
+                container = _ArrayContainer()
+                container.values = values
+            else:
+                container = _BitmapContainer(bytearray(byte_view(buf, offset, CHUNK_BYTES)), card)
+                offset += CHUNK_BYTES
+            bitmap.containers[high] = container
+            bitmap.card += card
+        return bitmap, offset
+
+    def intersection_len(self, other):
+        """
+        Purpose: Size of self & other without building the result
+        Returns: Int number of common ids
+        """
+        n = 0
+        if len(other.containers) < len(self.containers):
+            self, other = other, self
+        for high, a in self.containers.items():
+            b = other.containers.get(high)
+            if b is None:
+                continue
+            if isinstance(a, _BitmapContainer) and isinstance(b, _BitmapContainer):
+                n += _popcount(a.as_int() & b.as_int())
+            else:
+                if isinstance(a, _BitmapContainer):
+                    a, b = b, a
+                n += sum(1 for low in a.values if low in b)
+        return n
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gBloom.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import hashlib
+import threading
+from array import array
+
+# Counters per filter, counters per block and probes per key. All probes
+# of a key land in one 64 byte block, so a lookup touches one cache line.
+DEFAULT_SIZE = 2048
+BLOCK = 32
+PROBES = 4
+
+# Counters saturate instead of wrapping; a saturated counter is never
+# decremented again, so it can only cause false positives
+SATURATED = 0xFFFF
+
+_positions = {}
+_positions_lock = threading.Lock()
+
+
+def positions(key, size=DEFAULT_SIZE):
+    """
+    Purpose: Counter positions of key in a filter of size counters
+    key: String key (label)
+    size: Int number of counters, a multiple of BLOCK
+    Returns: Tuple of PROBES Int positions, all in the same block
+    """
+    cached = _positions.get((key, size))
+    if cached is not None:
+        return cached
+    data = key.encode('utf-8') if isinstance(key, type(u'')) else key
+    h = int(hashlib.md5(data).hexdigest(), 16)
+    base = (h % (size // BLOCK)) * BLOCK
+    h //= size // BLOCK
+    result = []
+    for _ in range(PROBES):
+        result.append(base + h % BLOCK)
+        h //= BLOCK
+    result = tuple(result)
+    with _positions_lock:
+        if len(_positions) > 65536:
+            _positions.clear()
+        _positions[(key, size)] = result
+    return result
+
+
+class CountingBloom(object):
+    """
+    Blocked counting Bloom filter over a multiset of Strings. Counting
+    lets keys be removed again and whole filters be added to or taken
+    away from each other when a subtree moves.
+    """
+    __slots__ = ('counts',)
+
+    def __init__(self, size=DEFAULT_SIZE):
+        """
+        Purpose: Create an empty filter
+        size: Int number of counters, a multiple of BLOCK
+        Returns: Nothing
+        """
+        self.counts = array('H', [0]) * size
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, key):
+        """
+        Purpose: Count one more occurrence of key
+        """
+        counts = self.counts
+        for i in positions(key, len(counts)):
+            if counts[i] < SATURATED:
+                counts[i] += 1
+
+    def discard(self, key):
+        """
+        Purpose: Count one occurrence of key less
+        """
+        counts = self.counts
+        for i in positions(key, len(counts)):
+            if 0 < counts[i] < SATURATED:
+                counts[i] -= 1
+
+    def __contains__(self, key):
+        """
+        Purpose: Test whether key may have been added
+        Returns: False if key is certainly absent, True if it may be present
+        """
+        counts = self.counts
+        for i in positions(key, len(counts)):
+            if not counts[i]:
+                return False
+        return True
+
+    def merge(self, other):
+        """
+        Purpose: Add every occurrence counted in other
+        other: CountingBloom of the same size
+        """
+        counts = self.counts
+        for i, c in enumerate(other.counts):
+            if c:
+                counts[i] = min(SATURATED, counts[i] + c)
+
+    def subtract(self, other):
+        """
+        Purpose: Remove every occurrence counted in other
+        other: CountingBloom of the same size
+        """
+        counts = self.counts
+        for i, c in enumerate(other.counts):
+            if c and counts[i] < SATURATED:
+                counts[i] = max(0, counts[i] - c)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gCache.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import threading
+import time
+
+from collections import OrderedDict
+
+from gIndex import normalise_labels
+
+
+def query_key(kind, path, labels=None, min_time=None, max_time=None):
+    """
+    Purpose: Normalise a query so equivalent calls share a cache entry
+    kind: String naming the query method
+    path: String directory the query is scoped to
+    labels: Labels every match must carry (list, String or None)
+    min_time: Lower mtime bound or None
+    max_time: Upper mtime bound or None
+    Returns: A hashable Tuple
+    """
+    return (kind, path, frozenset(normalise_labels(labels)),
+            None if min_time is None else float(min_time),
+            None if max_time is None else float(max_time))
+
+
+def _could_match(key, path, labels, mtime):
+    """
+    Purpose: Decide whether a file could appear in the result of key
+    key: Tuple from query_key
+    path: String path of the file
+    labels: Tuple of the file's labels
+    mtime: Float mtime of the file or None
+    Returns: Boolean
+    """
+    kind, scope, wanted, min_time, max_time = key
+    if scope != '/' and not path.startswith(scope + '/'):
+        return False
+    if not wanted.issubset(labels):
+        return False
+    if min_time is not None or max_time is not None:
+        if mtime is None:
+            return False
+        if min_time is not None and mtime < min_time:
+            return False
+        if max_time is not None and mtime > max_time:
+            return False
+    return True
+
+
+class QueryCache(object):
+    """
+    Bounded LRU cache of query results. Entries are filed under one of
+    their labels, so a changed file only has to be checked against the
+    queries filed under its own labels (and the label-less ones).
+
+    Results are listings, Dicts mapping a directory to a Dict of paths
+    and GStats. The cache keeps its own copy and hands out a fresh one
+    on every hit, so callers may change what they get back.
+    """
+
+    def __init__(self, capacity=256):
+        """
+        Purpose: Create an empty cache
+        capacity: Int maximum number of cached results
+        Returns: Nothing
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _bucket(key):
+        """
+        Purpose: Pick the bucket key is filed under
+        Returns: One of the query's labels, or None if it has none
+        """
+        wanted = key[2]
+        return min(wanted) if wanted else None
+
+    def get(self, key):
+        """
+        Purpose: Look up a cached result, marking it recently used
+        key: Tuple from query_key
+        Returns: The cached result or None
+        """
+        with self.lock:
+            result = self.entries.pop(key, None)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries[key] = result
+            self.hits += 1
+            return _copy(result)
+
+    def put(self, key, result):
+        """
+        Purpose: Cache result under key, evicting the least recently used
+        key: Tuple from query_key
+        result: Result to hand back on later hits
+        """
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+            else:
+                self.buckets.setdefault(self._bucket(key), set()).add(key)
+            self.entries[key] = _copy(result)
+            while len(self.entries) > self.capacity:
+                old, _ = self.entries.popitem(last=False)
+                self._unfile(old)
+
+    def _unfile(self, key):
+        """
+        Purpose: Remove key from its bucket
+        """
+        bucket = self._bucket(key)
+        keys = self.buckets.get(bucket)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.buckets[bucket]
+
+    def invalidate(self, path, labels, mtime):
+        """
+        Purpose: Evict every cached query a file in the given state
+                 could match. Call it with both the old and the new
+                 state of a file that changes.
+        path: String path of the file
+        labels: Tuple of the file's labels
+        mtime: Float mtime of the file or None
+        Returns: Int number of entries evicted
+        """
+        n = 0
+        with self.lock:
+            for bucket in set(labels) | set([None]):
+                for key in list(self.buckets.get(bucket, ())):
+                    if _could_match(key, path, labels, mtime):
+                        del self.entries[key]
+                        self._unfile(key)
+                        n += 1
+        return n
+
+    def clear(self):
+        """
+        Purpose: Drop every cached result
+        """
+        with self.lock:
+            self.entries.clear()
+            self.buckets.clear()
+
+
+class NegativeCache(object):
+    """
+    Bounded cache of paths known not to exist, each remembered for ttl
+    seconds. Anything that creates a path must discard it.
+    """
+
+    def __init__(self, ttl=5.0, capacity=4096):
+        """
+        Purpose: Create an empty cache
+        ttl: Float seconds a miss is remembered for
+        capacity: Int maximum number of remembered misses
+        Returns: Nothing
+        """
+        self.ttl = ttl
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        """
+        Purpose: Tell whether path was recently found not to exist
+        Returns: Boolean
+        """
+        with self.lock:
+            expires = self.entries.get(path)
+            if expires is None:
+                return False
+            if expires < time.time():
+                del self.entries[path]
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, path):
+        """
+        Purpose: Remember that path does not exist
+        """
+        with self.lock:
+            self.entries.pop(path, None)
+            self.entries[path] = time.time() + self.ttl
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def discard(self, path, subtree=False):
+        """
+        Purpose: Forget the miss of path
+        path: String path that now exists
+        subtree: Boolean, also forget the misses below path
+        """
+        with self.lock:
+            self.entries.pop(path, None)
+            if subtree:
+                prefix = path.rstrip('/') + '/'
+                for p in [p for p in self.entries if p.startswith(prefix)]:
+                    del self.entries[p]
+
+    def clear(self):
+        """
+        Purpose: Forget every miss
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+def _copy(result):
+    """
+    Purpose: Copy a listing down to the GStats it holds
+    result: Dict mapping directory to a Dict of paths and GStats
+    Returns: Dict
+    """
+    return dict((path, dict(files)) for path, files in result.items())
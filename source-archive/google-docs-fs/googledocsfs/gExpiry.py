@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gExpiry.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+
+class ExpiryEngine(object):
+    """
+    Priority queue of expiry deadlines drained by a background thread.
+    Rescheduling and cancelling are lazy: stale heap entries are skipped
+    when they reach the top, so every operation is O(log n).
+    """
+
+    def __init__(self, callback):
+        """
+        Purpose: Create a stopped engine
+        callback: Function called with the key of every expired entry
+        Returns: Nothing
+        """
+        self.callback = callback
+        self.heap = []
+        self.deadlines = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def schedule(self, key, expires_at):
+        """
+        Purpose: Expire key at expires_at, replacing any earlier deadline
+        key: Hashable key passed back to the callback
+        expires_at: Float UNIX time
+        """
+        with self.cond:
+            self.deadlines[key] = expires_at
+            heapq.heappush(self.heap, (expires_at, next(self.counter), key))
+            # Drop stale entries once they outnumber the live ones
+            if len(self.heap) > 2 * len(self.deadlines) + 1024:
+                self.heap = [(t, next(self.counter), k) for k, t in self.deadlines.items()]
+                heapq.heapify(self.heap)
+            if self.heap[0][2] == key:
+                self.cond.notify()
+
+    def schedule_many(self, deadlines):
+        """
+        Purpose: Schedule a batch of (key, expires_at) pairs in O(n)
+        deadlines: Iterable of (key, expires_at) Tuples
+        """
+        with self.cond:
+            for key, expires_at in deadlines:
+                self.deadlines[key] = expires_at
+                self.heap.append((expires_at, next(self.counter), key))
+            heapq.heapify(self.heap)
+            self.cond.notify()
+
+    def cancel(self, key):
+        """
+        Purpose: Stop key from expiring
+        key: Key given to schedule
+        """
+        with self.cond:
+            self.deadlines.pop(key, None)
+
+    def _pop_due(self, now):
+        """
+        Purpose: Take the next entry due at or before now off the heap
+        Returns: The key, or None if nothing is due yet
+        """
+        while self.heap:
+            expires_at, seq, key = self.heap[0]
+            if self.deadlines.get(key) != expires_at:
+                heapq.heappop(self.heap)
+            elif expires_at <= now:
+                heapq.heappop(self.heap)
+                del self.deadlines[key]
+                return key
+            else:
+                return None
+        return None
+
+    def expire_due(self, now=None):
+        """
+        Purpose: Expire every entry whose deadline has passed
+        now: Float UNIX time, defaults to the current time
+        Returns: Int number of entries expired
+        """
+        if now is None:
+            now = time.time()
+        n = 0
+        while True:
+            with self.cond:
+                key = self._pop_due(now)
+            if key is None:
+                return n
+            self._expire(key)
+            n += 1
+
+    def _expire(self, key):
+        """
+        Purpose: Run the callback, keeping the thread alive on errors
+        """
+        try:
+            self.callback(key)
+        except Exception as e:
+            sys.stderr.write('expiry of %r failed: %s\n' % (key, e))
+
+    def _run(self):
+        """
+        Purpose: Sleep until the earliest deadline and expire what is due
+        """
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                key = self._pop_due(time.time())
+                if key is None:
+                    timeout = self.heap[0][0] - time.time() if self.heap else None
+                    self.cond.wait(timeout)
+                    continue
+            self._expire(key)
+
+    def start(self):
+        """
+        Purpose: Start the background expiry thread
+        """
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='gdfs-expiry')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """
+        Purpose: Stop the background expiry thread and wait for it
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
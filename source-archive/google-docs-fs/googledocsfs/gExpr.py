@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gExpr.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+#
+#   Boolean label expressions such as
+#
+#       (temp OR humidity) AND siteA AND NOT calibration
+#
+#   AND binds tighter than OR, NOT tighter than both. The keywords are
+#   upper case only; a label that clashes with a keyword or contains
+#   spaces or parentheses can be written in double quotes.
+
+import re
+
+from gBitmap import RoaringBitmap
+
+KEYWORDS = ('AND', 'OR', 'NOT')
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+
+def tokenize(text):
+    """
+    Purpose: Split an expression into parentheses, keywords and labels
+    text: String expression
+    Returns: A List of (kind, value) Tuples, kind being '(', ')',
+             'AND', 'OR', 'NOT' or 'label'
+    """
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if m is None:
+            raise ValueError('bad label expression at %r' % text[pos:])
+        lparen, rparen, quoted, word = m.groups()
+        if lparen:
+            tokens.append(('(', lparen))
+        elif rparen:
+            tokens.append((')', rparen))
+        elif quoted is not None:
+            tokens.append(('label', re.sub(r'\\(.)', r'\1', quoted)))
+        elif word in KEYWORDS:
+            tokens.append((word, word))
+        else:
+            tokens.append(('label', word))
+        pos = m.end()
+    return tokens
+
+
+class Label(object):
+    """
+    Leaf: the files carrying one label
+    """
+
+    def __init__(self, label):
+        self.label = label
+
+    def __repr__(self):
+        return 'Label(%r)' % (self.label,)
+
+    def estimate(self, index):
+        """
+        Purpose: Size of the result, read off the posting list
+        index: LabelIndex to answer from
+        Returns: Int
+        """
+        return index.cardinality(self.label)
+
+    def evaluate(self, index):
+        """
+        Purpose: Fetch the posting of the label
+        index: LabelIndex to answer from
+        Returns: A RoaringBitmap (shared, do not modify)
+        """
+        posting = index.postings.get(self.label)
+        if posting is None:
+            return RoaringBitmap()
+        return posting
+
+
+class Not(object):
+    """
+    Complement of an expression among all indexed files
+    """
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def __repr__(self):
+        return 'Not(%r)' % (self.operand,)
+
+    def estimate(self, index):
+        return max(0, len(index.all) - self.operand.estimate(index))
+
+    def evaluate(self, index):
+        return index.all - self.operand.evaluate(index)
+
+
+class And(object):
+    """
+    Intersection of expressions. Positive operands are intersected
+    cheapest first, then negated ones are subtracted, stopping as soon
+    as the running result is empty.
+    """
+
+    def __init__(self, operands):
+        self.operands = operands
+
+    def __repr__(self):
+        return 'And(%r)' % (self.operands,)
+
+    def _split(self):
+        """
+        Purpose: Separate the negated operands from the positive ones
+        Returns: Tuple of two Lists: positive operands, negated operands
+        """
+        positive = [op for op in self.operands if not isinstance(op, Not)]
+        negative = [op.operand for op in self.operands if isinstance(op, Not)]
+        return positive, negative
+
+    def estimate(self, index):
+        positive, negative = self._split()
+        if not positive:
+            return len(index.all)
+        return min(op.estimate(index) for op in positive)
+
+    def evaluate(self, index):
+        positive, negative = self._split()
+        positive.sort(key=lambda op: op.estimate(index))
+        if positive:
+            result = positive[0].evaluate(index)
+            for op in positive[1:]:
+                if not result:
+                    return RoaringBitmap()
+                result = result & op.evaluate(index)
+        else:
+            result = index.all
+        negative.sort(key=lambda op: -op.estimate(index))
+        for op in negative:
+            if not result:
+                return RoaringBitmap()
+            result = result - op.evaluate(index)
+        return result
+
+
+class Or(object):
+    """
+    Union of expressions
+    """
+
+    def __init__(self, operands):
+        self.operands = operands
+
+    def __repr__(self):
+        return 'Or(%r)' % (self.operands,)
+
+    def estimate(self, index):
+        return min(len(index.all), sum(op.estimate(index) for op in self.operands))
+
+    def evaluate(self, index):
+        result = RoaringBitmap()
+        for op in self.operands:
+            result = result | op.evaluate(index)
+        return result
+
+
+class _Parser(object):
+    """
+    Recursive descent parser over the tokens of one expression
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][0]
+        return None
+
+    def take(self, kind):
+        if self.peek() != kind:
+            found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else 'end of expression'
+            raise ValueError('expected %s in label expression, found %r' % (kind, found))
+        value = self.tokens[self.pos][1]
+        self.pos += 1
+        return value
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError('unexpected %r in label expression' % (self.tokens[self.pos][1],))
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.take('OR')
+            operands.append(self.parse_and())
+        return _flatten(Or, operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek() == 'AND':
+            self.take('AND')
+            operands.append(self.parse_not())
+        return _flatten(And, operands)
+
+    def parse_not(self):
+        if self.peek() == 'NOT':
+            self.take('NOT')
+            operand = self.parse_not()
+            if isinstance(operand, Not):
+                return operand.operand
+            return Not(operand)
+        if self.peek() == '(':
+            self.take('(')
+            node = self.parse_or()
+            self.take(')')
+            return node
+        return Label(self.take('label'))
+
+
+def _flatten(cls, operands):
+    """
+    Purpose: Build an And/Or node, merging nested nodes of the same kind
+    Returns: The node, or the only operand if there is just one
+    """
+    if len(operands) == 1:
+        return operands[0]
+    flat = []
+    for op in operands:
+        if isinstance(op, cls):
+            flat.extend(op.operands)
+        else:
+            flat.append(op)
+    return cls(flat)
+
+
+def parse(text):
+    """
+    Purpose: Compile a label expression into a tree of posting list
+             operations
+    text: String expression, e.g. '(temp OR humidity) AND NOT calibration'
+    Returns: A Label, Not, And or Or node
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        raise ValueError('empty label expression')
+    return _Parser(tokens).parse()
+
+
+def evaluate(expr, index):
+    """
+    Purpose: Find the files matching a label expression
+    expr: String expression or a node returned by parse
+    index: LabelIndex to answer from
+    Returns: A new RoaringBitmap of file ids
+    """
+    if not hasattr(expr, 'evaluate'):
+        expr = parse(expr)
+    with index.lock:
+        result = expr.evaluate(index)
+        # A bare label evaluates to its posting list, which stays shared
+        if isinstance(expr, Label):
+            result = result.copy()
+        return result
+
+
+def required(expr):
+    """
+    Purpose: Labels every file matching expr has to carry, so filters
+             that only rule labels out can be asked first
+    expr: A node returned by parse
+    Returns: A frozenset of label Strings
+    """
+    if isinstance(expr, Label):
+        return frozenset([expr.label])
+    if isinstance(expr, And):
+        return frozenset().union(*[required(op) for op in expr.operands])
+    if isinstance(expr, Or):
+        return frozenset.intersection(*[required(op) for op in expr.operands])
+    return frozenset()
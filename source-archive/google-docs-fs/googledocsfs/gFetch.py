@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gFetch.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class Prefetcher(object):
+    """
+    Pool of worker threads downloading files into the local cache before
+    they are opened. Files of known size are fetched smallest first,
+    then the rest in the order given, and no more than limit files are
+    queued or being fetched at a time.
+    """
+
+    def __init__(self, fetch, workers=4, limit=None, progress=None):
+        """
+        Purpose: Create the pool and start its workers
+        fetch: Function called with a path to download it, returning the
+               Int bytes downloaded or None if there was nothing to do
+        workers: Int number of worker threads
+        limit: Int files that may be queued or in flight, None for no
+               limit
+        progress: Function called with a path and the result of its fetch
+                  (or the exception it raised) as each one finishes
+        Returns: Nothing
+        """
+        self.fetch = fetch
+        self.limit = limit
+        self.progress = progress
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()
+        self.active = {}
+        self.errors = {}
+        self.fetched = 0
+        self.fetched_bytes = 0
+        self.running = True
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run, name='gdfs-fetch-%d' % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def __len__(self):
+        with self.cond:
+            return len(self.pending) + len(self.active)
+
+    def submit(self, files):
+        """
+        Purpose: Queue files for download, smallest first, while there is
+                 room under the limit
+        files: List of (String path, Int size or None if unknown) Tuples
+        Returns: List of the paths queued
+        """
+        queued = []
+        with self.cond:
+            for path, size in sorted(files, key=_size_order):
+                if path in self.pending or path in self.active:
+                    continue
+                if self.limit is not None and len(self.pending) + len(self.active) >= self.limit:
+                    break
+                self.pending[path] = size
+                queued.append(path)
+            if queued:
+                self.pending = OrderedDict(sorted(self.pending.items(), key=_size_order))
+                self.cond.notify_all()
+        return queued
+
+    def claim(self, path):
+        """
+        Purpose: Make way for a caller about to download path itself:
+                 drop it from the queue, or wait if it is being fetched
+        path: String path about to be opened
+        Returns: True if a worker fetched it meanwhile
+        """
+        with self.cond:
+            if path in self.pending:
+                del self.pending[path]
+                return False
+            waited = path in self.active
+            while path in self.active:
+                self.cond.wait()
+            return waited
+
+    def _run(self):
+        """
+        Purpose: Worker loop
+        """
+        while True:
+            with self.cond:
+                while not self.pending:
+                    if not self.running:
+                        return
+                    self.cond.wait()
+                path, size = self.pending.popitem(last=False)
+                self.active[path] = size
+            try:
+                fetched = self.fetch(path)
+            except Exception as e:
+                sys.stderr.write('prefetching %s failed: %s\n' % (path, e))
+                fetched = e
+                with self.cond:
+                    self.errors[path] = e
+            else:
+                with self.cond:
+                    self.errors.pop(path, None)
+                    if fetched is not None:
+                        self.fetched += 1
+                        self.fetched_bytes += fetched
+            if self.progress is not None:
+                try:
+                    self.progress(path, fetched)
+                except Exception as e:
+                    sys.stderr.write('progress callback failed: %s\n' % (e,))
+            with self.cond:
+                del self.active[path]
+                self.cond.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Purpose: Wait until everything queued has been fetched
+        timeout: Float seconds to wait at most, None for no limit
+        Returns: True if nothing is left to fetch
+        """
+        with self.cond:
+            if timeout is None:
+                while self.pending or self.active:
+                    self.cond.wait()
+                return True
+            deadline = time.time() + timeout
+            while self.pending or self.active:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return True
+
+    def stop(self):
+        """
+        Purpose: Drop everything queued, let running fetches finish and
+                 stop the workers
+        """
+        with self.cond:
+            self.pending.clear()
+            self.running = False
+            self.cond.notify_all()
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join()
+
+
+def _size_order(item):
+    """
+    Purpose: Sort key putting files of known size first, smallest first
+    """
+    return (item[1] is None, item[1] or 0)
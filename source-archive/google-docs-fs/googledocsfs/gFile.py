@@ -29,12 +29,28 @@ import errno
 import time
 import fuse
 import gNet
+import gIndex
+import gTable
+import gTree
+import gExpiry
+import gCache
+import gQuery
+import gExpr
+import gSnapshot
+import gWal
+import gSync
+import gUpload
+import gFetch
 import getpass
 import datetime
 import random
 import string
 import statistics
 import csv
+import functools
+import uuid
+
+from collections import OrderedDict
 
 from subprocess import *
 
@@ -65,7 +81,8 @@ class GStat(fuse.Stat):
         self.receiveTime = self.st_atime
         self.service_type = "proc"
         self.freshness_per = 0.1
-        self.shelf_life = 1
+        self.shelf_life = 0
+        self.listener = None
 
     def set_file_attr(self, size, labels, service_type, freshness_per, shelf_life):
         """
@@ -81,6 +98,15 @@ class GStat(fuse.Stat):
         self.freshness_per = freshness_per
         self.shelf_life = shelf_life
 
+    def expires_at(self):
+        """
+        Purpose: Work out when this entry's shelf life runs out
+        Returns: Float UNIX time, or None if the entry never expires
+        """
+        if not stat.S_ISREG(self.st_mode) or not self.shelf_life or self.shelf_life <= 0:
+            return None
+        return self.receiveTime + self.shelf_life
+
     def set_access_times(self, mtime, ctime, atime=None):
         """
         Purpose: Set the access times of a file
@@ -92,6 +118,8 @@ class GStat(fuse.Stat):
         self.st_atime = ctime
         if atime is not None and atime > 0:
             self.st_atime = atime
+        if self.listener is not None:
+            self.listener(self)
 
 
 class GFile(fuse.Fuse):
@@ -106,14 +134,45 @@ class GFile(fuse.Fuse):
         em: User's email address
         pw: User's password
         *args: Args to pass to Fuse
-        **kw: Keywords to pass to Fuse
+        **kw: Keywords to pass to Fuse, plus columnar=True to keep
+              a NumPy column copy of the metadata for bulk scans and
+              snapshot=path of the metadata snapshot (None for the
+              default under the cache home, False for none) and
+              wal=path of the write-ahead log of metadata changes made
+              since the snapshot (None for the default next to the
+              snapshot, False for none) and sync_interval=seconds
+              between polls of the remote change feed (False to relist
+              remotely on every readdir instead) and negative_ttl=seconds
+              getattr remembers that a path does not exist for and
+              pool_size=number of kept-alive connections to Google,
+              upload_workers=number of background upload threads (0 to
+              upload in release itself), upload_queue=number of
+              queued uploads after which release blocks, upload_delay=
+              seconds a released file waits for further changes before
+              it is sent and upload_max_delay=seconds it waits at most,
+              readahead=number of threads downloading the files of a
+              listed directory before they are opened (0 for none) and
+              readahead_files=number of files they may have queued at
+              a time
         Returns: Nothing
         """
 
+        columnar = kw.pop('columnar', False)
+        snapshot = kw.pop('snapshot', None)
+        wal = kw.pop('wal', None)
+        sync_interval = kw.pop('sync_interval', 30)
+        negative_ttl = kw.pop('negative_ttl', 5.0)
+        pool_size = kw.pop('pool_size', 4)
+        upload_workers = kw.pop('upload_workers', 4)
+        upload_queue = kw.pop('upload_queue', 64)
+        upload_delay = kw.pop('upload_delay', 2.0)
+        upload_max_delay = kw.pop('upload_max_delay', 30.0)
+        readahead = kw.pop('readahead', 0)
+        readahead_files = kw.pop('readahead_files', 64)
         super(GFile, self).__init__(*args, **kw)
-        self.gn = gNet.GNet(em, pw)
+        self.gn = gNet.GNet(em, pw, pool_size)
         self.directories = {}
-        self.files = {}
+        self.files = gSnapshot.StatTable()
         self.written = {}
         self.time_accessed = {}
         self.release_lock = threading.RLock()
@@ -122,6 +181,38 @@ class GFile(fuse.Fuse):
         self.home = '%s' % (os.path.expanduser('~'),)
         self.labeled = {}
         self.timings = {}
+        self.ids = gIndex.FileIds()
+        self.label_index = gIndex.LabelIndex()
+        self.time_index = gIndex.TimeIndex()
+        self.planner = gIndex.QueryPlanner(self.label_index, self.time_index)
+        self.columns = gTable.ColumnTable() if columnar else None
+        self.tree = gTree.DirTree()
+        self.query_cache = gCache.QueryCache()
+        self.misses = gCache.NegativeCache(negative_ttl)
+        self.expiry = None
+        self.expire_remote = False
+        self.digests = gUpload.ContentDigests()
+        self.uploads = gUpload.UploadQueue(self._upload, upload_workers, upload_queue,
+                                           upload_delay, upload_max_delay)
+        self.readahead = None
+        if readahead:
+            self.readahead = gFetch.Prefetcher(self._fetch, readahead, readahead_files)
+        self.changes = None
+        if sync_interval is not False:
+            self.changes = gSync.ChangeFeed(self.gn.get_changes, self._entry_name, sync_interval,
+                                            tree=self.gn.tree)
+        self.snapshot = None
+        self.snapshot_path = snapshot
+        if snapshot is None:
+            self.snapshot_path = os.path.join(self.home, '.google-docs-fs.snapshot')
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            self.load_snapshot()
+        self.wal = None
+        self.wal_path = wal
+        if wal is None and self.snapshot_path:
+            self.wal_path = self.snapshot_path + '.wal'
+        if self.wal_path:
+            self.open_wal()
         if os.uname()[0] == 'Darwin':
             self.READ = 0
             self.WRITE = 1
@@ -160,6 +251,8 @@ class GFile(fuse.Fuse):
             st = self.files[path]
         elif filename[0] == '.':
             st = os.stat(('%s%s' % (self.home, path)).encode(self.codec))
+        elif path in self.misses:
+            return -errno.ENOENT
         else:
             f = self.gn.get_filename(path, 'true')
             if f is None:
@@ -168,6 +261,9 @@ class GFile(fuse.Fuse):
                 for fi in feed.entry:
                     if all(label in fi.labels for label in labels):
                         f.append(fi)
+                if not f:
+                    self.misses.add(path)
+                    return -errno.ENOENT
             self._setattr(path=path, entry=f)
             st = self.files[path]
 
@@ -183,6 +279,150 @@ class GFile(fuse.Fuse):
         dirents = ['.', '..']
         filename = os.path.basename(path)
 
+        if path == '/' or filename[0] != '.':  # Hidden - ignore
+            if self.changes is not None:
+                self.sync()
+            else:
+                self._relist(path)
+
+        for entry in self.directories.get(path, []):
+            dirents.append(entry)
+
+        if 'My folders' in dirents:
+            dirents.remove('My folders')
+
+        if self.readahead is not None and (path == '/' or filename[0] != '.'):
+            self._read_ahead(path)
+
+        # Display all hidden files in dirents
+        tmp_path = '%s%s' % (self.home, path)
+        try:
+            os.makedirs(tmp_path.encode(self.codec))
+        except OSError:
+            pass
+
+        if os.path.exists(tmp_path.encode(self.codec)):
+            for file in [f for f in os.listdir(tmp_path.encode(self.codec)) if f[0] == '.']:
+                dirents.append(file)
+                self._setattr(path=os.path.join(tmp_path, file))
+
+        for r in dirents:
+            yield fuse.Direntry(r.encode(self.codec))
+
+    def _read_ahead(self, path):
+        """
+        Purpose: Queue the files of a listed directory that are not cached
+                 yet for download, smallest first where Google Docs
+                 reports a size
+        path: String path of the directory
+        Returns: List of the paths queued
+        """
+        files = []
+        for name in self.directories.get(path, []):
+            fi = os.path.join(path, name)
+            if name[0] == '.' or fi in self.directories or fi not in self.files:
+                continue
+            if fi in self.to_upload or os.path.exists(('%s%s' % (self.home, fi)).encode(self.codec)):
+                continue
+            # st_size is a placeholder until the file is first opened
+            files.append((fi, self.gn.size(fi)))
+        return self.readahead.submit(files)
+
+    def _fetch(self, path):
+        """
+        Purpose: Download a file into the local cache ahead of open. It
+                 is exported to a staging file first, so open never sees
+                 a partial copy.
+        path: String path to file
+        Returns: Int bytes downloaded, or None if it was cached meanwhile
+                 or is not on Google Docs
+        """
+        tmp_path = '%s%s' % (self.home, path)
+        if os.path.exists(tmp_path.encode(self.codec)) or self.gn.get_filename(path) is None:
+            return None
+        staging = os.path.join(self.home, '.google-docs-fs.fetch')
+        try:
+            os.makedirs(staging)
+        except OSError:
+            pass  # Assume path exists
+        # Exports take their format from the extension
+        part = os.path.join(staging, uuid.uuid4().hex + os.path.splitext(path)[1])
+        try:
+            self.gn.get_file(path, part, 'rb').close()
+            digest = self.digests.digest(path, part)
+            size = os.path.getsize(part)
+            with self.release_lock:
+                if path not in self.files or os.path.exists(tmp_path.encode(self.codec)):
+                    return None
+                try:
+                    os.makedirs(os.path.dirname(tmp_path))
+                except OSError:
+                    pass  # Assume path exists
+                os.rename(part, tmp_path.encode(self.codec))
+                self._resize(path, size)
+                self.digests.record(path, digest, self.gn.revision(path))
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        return size
+
+    def sync(self, force=False):
+        """
+        Purpose: Apply what changed remotely since the last sync to the
+                 listings and attributes. The first sync lists everything.
+        force: Boolean, poll the change feed even if it was polled recently
+        Returns: Int number of changes applied
+        """
+        full, changes = self.changes.refresh(force)
+        if not changes and not full:
+            return 0
+        with self.release_lock:
+            if full:
+                listed = set(new for op, old, new, entry in changes if op == 'put')
+                self.directories = dict((p, []) for p in self.directories if p in listed)
+                self.directories['/'] = []
+            for op, old, new, entry in changes:
+                if op == 'del':
+                    if old is not None:
+                        self.gn.forget(old)
+                    if old is not None and old not in self.to_upload:
+                        self._forget(old)
+                        if old in self.directories:
+                            del self.directories[old]
+                            self.tree.remove_dir(old)
+                    continue
+                dir, name = os.path.split(new)
+                if dir not in self.directories:
+                    self.directories[dir] = []
+                if old is not None and old != new:
+                    self.gn.forget(old)
+                    if old in self.files or old in self.directories:
+                        self._move(old, new)
+                elif name not in self.directories[dir]:
+                    self.directories[dir].append(name)
+                if entry.GetDocumentType() == 'folder' and new not in self.directories:
+                    self.directories[new] = []
+                self._setattr(path=new, entry=entry)
+                self.gn.remember(new, entry)
+            if full:
+                # Anything neither listed nor waiting for upload is gone
+                for path in list(self.ids.ids):
+                    if path not in listed and path != '/' and path not in self.to_upload \
+                            and os.path.basename(path)[:1] != '.':
+                        self._forget(path)
+                for path in self.to_upload:
+                    dir, name = os.path.split(path)
+                    if name not in self.directories.setdefault(dir, []):
+                        self.directories[dir].append(name)
+        return len(changes)
+
+    def _relist(self, path):
+        """
+        Purpose: Rebuild the listing of path from a full remote query
+        path: String containing relative path to directory using mountpoint as /
+        """
+        filename = os.path.basename(path)
+
         if path == '/':  # Root
             excludes = []
             self.directories['/'] = []
@@ -206,9 +446,6 @@ class GFile(fuse.Fuse):
                     self.directories['/'].append(
                         "%s.%s" % (file.title.text.decode(self.codec), self._file_extension(file)))
 
-        elif filename[0] == '.':  # Hidden - ignore
-            pass
-
         else:  # Directory
             self.directories[path] = []
             feed = self.gn.get_docs(folder=filename)
@@ -220,33 +457,13 @@ class GFile(fuse.Fuse):
                     self.directories[path].append(
                         "%s.%s" % (file.title.text.decode(self.codec), self._file_extension(file)))
 
-        for entry in self.directories[path]:
-            dirents.append(entry)
-
-        if 'My folders' in dirents:
-            dirents.remove('My folders')
-
         # Set the appropriate attributes for use with getattr()
         for file in feed.entry:
             p = os.path.join(path, file.title.text.decode(self.codec))
             if file.GetDocumentType() != 'folder':
                 p = '%s.%s' % (p, self._file_extension(file))
             self._setattr(path=p, entry=file)
-
-        # Display all hidden files in dirents
-        tmp_path = '%s%s' % (self.home, path)
-        try:
-            os.makedirs(tmp_path.encode(self.codec))
-        except OSError:
-            pass
-
-        if os.path.exists(tmp_path.encode(self.codec)):
-            for file in [f for f in os.listdir(tmp_path.encode(self.codec)) if f[0] == '.']:
-                dirents.append(file)
-                self._setattr(path=os.path.join(tmp_path, file))
-
-        for r in dirents:
-            yield fuse.Direntry(r.encode(self.codec))
+            self.gn.remember(p, file)
 
     def readdir_labels(self, path, labels, offset):
         """
@@ -255,14 +472,18 @@ class GFile(fuse.Fuse):
         offset: Included for compatibility. Does nothing
         Returns: Directory listing for ls
         """
-        self.labeled = {}
+        key = gCache.query_key('labels', path, labels)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            self.labeled = cached
+            return cached
+        labeled = {}
         dirents = ['.', '..']
         filename = os.path.basename(path)
 
         if path == '/':  # Root
             excludes = []
-            self.directories['/'] = []
-            self.labeled['/'] = {}
+            labeled['/'] = {}
             # for dir in feed.entry:
             #     excludes.append('-' + dir.title.text.decode(self.codec))
             #     self.directories['%s%s' % (path, dir.title.text.decode(self.codec))] = []
@@ -287,17 +508,15 @@ class GFile(fuse.Fuse):
             #         #         "%s.%s" % (file.title.text.decode(self.codec), self._file_extension(file)))
             #         # else:
             #         feed = self.gn.get_docs(folder=filename)
-            for fi in self.files:
-                f = self.files[fi]
-                if all(label in f.labels for label in labels):
-                    self.labeled['/'][fi] = f
+            for fid in self.label_index.lookup(labels):
+                fi = self.ids.path(fid)
+                labeled['/'][fi] = self.files[fi]
 
         elif filename[0] == '.':  # Hidden - ignore
             pass
 
-        else:  # Directory
-            self.directories[path] = []
-            self.labeled[path] = {}
+        elif self.tree.might_contain(path, gIndex.normalise_labels(labels)):  # Directory
+            labeled[path] = {}
             # for file in feed.entry:
             #     if file.GetDocumentType() == 'folder':
             #         self.directories[os.path.join(path, file.title.text.decode(self.codec))] = []
@@ -308,11 +527,15 @@ class GFile(fuse.Fuse):
             #         #         "%s.%s" % (file.title.text.decode(self.codec), self._file_extension(file)))
             #         # else:
             #         feed = self.gn.get_docs(folder=filename)
-            for fi in self.files:
-                f = self.files[fi]
-                if all(label in labels for label in f.labels):
-                    self.labeled[path][fi] = f
-        return self.labeled
+            for fid in self.label_index.lookup(labels) & self.tree.subtree(path):
+                fi = self.ids.path(fid)
+                labeled[path][fi] = self.files[fi]
+
+        else:  # Directory the label filter rules out
+            labeled[path] = {}
+        self.labeled = labeled
+        self.query_cache.put(key, labeled)
+        return labeled
 
         # for entry in self.directories[path]:
         #     dirents.append(entry)
@@ -375,14 +598,18 @@ class GFile(fuse.Fuse):
         offset: Included for compatibility. Does nothing
         Returns: Directory listing for ls
         """
-        self.timings = {}
+        key = gCache.query_key('times', path, None, min_time, max_time)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            self.timings = cached
+            return cached
+        timings = {}
         dirents = ['.', '..']
         filename = os.path.basename(path)
 
         if path == '/':  # Root
             excludes = []
-            self.directories['/'] = []
-            self.timings['/'] = {}
+            timings['/'] = OrderedDict()
             # for dir in feed.entry:
             #     excludes.append('-' + dir.title.text.decode(self.codec))
             #     self.directories['%s%s' % (path, dir.title.text.decode(self.codec))] = []
@@ -407,17 +634,15 @@ class GFile(fuse.Fuse):
             #         #         "%s.%s" % (file.title.text.decode(self.codec), self._file_extension(file)))
             #         # else:
             #         feed = self.gn.get_docs(folder=filename)
-            for fi in self.files:
-                f = self.files[fi]
-                if min_time <= f.st_mtime <= max_time:
-                    self.timings['/'][fi] = f
+            for fid in self._select(None, min_time, max_time):
+                fi = self.ids.path(fid)
+                timings['/'][fi] = self.files[fi]
 
         elif filename[0] == '.':  # Hidden - ignore
             pass
 
         else:  # Directory
-            self.directories[path] = []
-            self.timings[path] = {}
+            timings[path] = OrderedDict()
             # for file in feed.entry:
             #     if file.GetDocumentType() == 'folder':
             #         self.directories[os.path.join(path, file.title.text.decode(self.codec))] = []
@@ -428,11 +653,12 @@ class GFile(fuse.Fuse):
             #         #         "%s.%s" % (file.title.text.decode(self.codec), self._file_extension(file)))
             #         # else:
             #         feed = self.gn.get_docs(folder=filename)
-            for fi in self.files:
-                f = self.files[fi]
-                if min_time <= f.st_mtime <= max_time:
-                    self.timings[path][fi] = f
-        return self.timings
+            for fid in self._select(None, min_time, max_time, self.tree.subtree(path)):
+                fi = self.ids.path(fid)
+                timings[path][fi] = self.files[fi]
+        self.timings = timings
+        self.query_cache.put(key, timings)
+        return timings
 
         # for entry in self.directories[path]:
         #     dirents.append(entry)
@@ -495,14 +721,18 @@ class GFile(fuse.Fuse):
         offset: Included for compatibility. Does nothing
         Returns: Directory listing for ls
         """
-        self.labeled_timings = {}
+        key = gCache.query_key('times_labels', path, labels, min_time, max_time)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            self.labeled_timings = cached
+            return cached
+        labeled_timings = {}
         dirents = ['.', '..']
         filename = os.path.basename(path)
 
         if path == '/':  # Root
             excludes = []
-            self.directories['/'] = []
-            self.labeled_timings['/'] = {}
+            labeled_timings['/'] = {}
             # for dir in feed.entry:
             #     excludes.append('-' + dir.title.text.decode(self.codec))
             #     self.directories['%s%s' % (path, dir.title.text.decode(self.codec))] = []
@@ -527,17 +757,15 @@ class GFile(fuse.Fuse):
             #         #         "%s.%s" % (file.title.text.decode(self.codec), self._file_extension(file)))
             #         # else:
             #         feed = self.gn.get_docs(folder=filename)
-            for fi in self.files:
-                f = self.files[fi]
-                if min_time <= f.st_mtime <= max_time and all(label in f.labels for label in labels):
-                        self.labeled_timings['/'][fi] = f
+            for fid in self._select(labels, min_time, max_time):
+                fi = self.ids.path(fid)
+                labeled_timings['/'][fi] = self.files[fi]
 
         elif filename[0] == '.':  # Hidden - ignore
             pass
 
         else:  # Directory
-            self.directories[path] = []
-            self.labeled_timings[path] = {}
+            labeled_timings[path] = {}
             # for file in feed.entry:
             #     if file.GetDocumentType() == 'folder':
             #         self.directories[os.path.join(path, file.title.text.decode(self.codec))] = []
@@ -548,11 +776,12 @@ class GFile(fuse.Fuse):
             #         #         "%s.%s" % (file.title.text.decode(self.codec), self._file_extension(file)))
             #         # else:
             #         feed = self.gn.get_docs(folder=filename)
-            for fi in self.files:
-                f = self.files[fi]
-                if min_time <= f.st_mtime <= max_time and all(label in f.labels for label in labels):
-                    self.labeled_timings[path][fi] = f
-        return self.labeled_timings
+            for fid in self._select(labels, min_time, max_time, self.tree.subtree(path)):
+                fi = self.ids.path(fid)
+                labeled_timings[path][fi] = self.files[fi]
+        self.labeled_timings = labeled_timings
+        self.query_cache.put(key, labeled_timings)
+        return labeled_timings
 
         # for entry in self.directories[path]:
         #     dirents.append(entry)
@@ -607,11 +836,155 @@ class GFile(fuse.Fuse):
         #     self._setattr(path=path, entry=f)
         #     st = self.files[path]
 
+    def find_labels(self, path, labels):
+        """
+        Purpose: Recursively search below path for files carrying every
+                 label in labels without the label index. Subtrees whose
+                 label filter rules out a label are skipped before any of
+                 their GStats is looked at.
+        path: String directory to search under ('/' for everything)
+        labels: List of labels (or a single label String)
+        Returns: Dict mapping path to a Dict of matching paths and GStats
+        """
+        labels = gIndex.normalise_labels(labels)
+        found = {}
+        for fid in self.tree.candidates(path, labels):
+            fi = self.ids.path(fid)
+            st = self.files.get(fi) if fi is not None else None
+            if st is not None and all(label in st.labels for label in labels):
+                found[fi] = st
+        return {path: found}
+
+    def readdir_expr(self, path, expr, offset):
+        """
+        Purpose: Give a listing of the files under path matching a boolean
+                 label expression, e.g. '(temp OR humidity) AND siteA AND
+                 NOT calibration'
+        path: String containing relative path to file using mountpoint as /
+        expr: String label expression (see gExpr)
+        offset: Included for compatibility. Does nothing
+        Returns: Dict mapping path to a Dict of matching paths and GStats
+        """
+        node = gExpr.parse(expr)
+        # Filed without labels, so any change under path evicts the entry
+        key = gCache.query_key(('expr', repr(node)), path)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            self.labeled = cached
+            return cached
+        labeled = {}
+        filename = os.path.basename(path)
 
-    def mknod(self, path, labels=None, service_type='proc', freshness_per=0.1, shelf_life=1, mode=None, dev=None):
+        if path != '/' and filename[0] == '.':  # Hidden - ignore
+            pass
+        else:
+            labeled[path] = {}
+            for fi, st in gQuery.Cursor(self, gQuery.Predicate(path, expr=node), 'id'):
+                labeled[path][fi] = st
+        self.labeled = labeled
+        self.query_cache.put(key, labeled)
+        return labeled
+
+    def query(self, path='/', labels=None, min_time=None, max_time=None, order='mtime', limit=None, offset=0, token=None, expr=None):
+        """
+        Purpose: Stream the files under path carrying every label in labels
+                 and modified between min_time and max_time, one page at a
+                 time, without building the whole result
+        path: String directory to search under ('/' for everything)
+        labels: Labels every match must carry (list, String or None)
+        min_time: Lower mtime bound or None
+        max_time: Upper mtime bound or None
+        order: 'mtime', '-mtime' (newest first) or 'id'
+        limit: Int page size, None for no limit
+        offset: Int number of matches to skip
+        token: String continuation token of the previous page
+        expr: String boolean label expression matches must also satisfy
+        Returns: gQuery.Cursor yielding (path, GStat) pairs; its token
+                 attribute resumes the query after the last one yielded
+        """
+        predicate = gQuery.Predicate(path, labels, min_time, max_time, expr)
+        return gQuery.Cursor(self, predicate, order, limit, offset, token)
+
+    def count(self, predicate):
+        """
+        Purpose: Count the files matching predicate without listing them
+        predicate: gQuery.Predicate to match
+        Returns: Int number of matches
+        """
+        return gQuery.count(self, predicate)
+
+    def top_k(self, predicate, k, order_by='-mtime'):
+        """
+        Purpose: Find the newest (or oldest) k files matching predicate
+        predicate: gQuery.Predicate to match
+        k: Int number of matches wanted
+        order_by: '-mtime' for the newest first, 'mtime' for the oldest first
+        Returns: A List of at most k (path, GStat) Tuples
+        """
+        return gQuery.top_k(self, predicate, k, order_by)
+
+    def fetch_matching(self, predicate, concurrency=4, progress=None):
+        """
+        Purpose: Download every file matching predicate that is not cached
+                 yet, several at a time, so that reading the matches later
+                 stays on local disk
+        predicate: gQuery.Predicate to match
+        concurrency: Int number of files downloaded at once
+        progress: Function called with the Int number of files done, the
+                  Int number to fetch and the String path just finished
+        Returns: Dict with the number of files matched, already cached
+                 and fetched, the bytes fetched, a Dict mapping the paths
+                 that failed to their exception and a List of the paths
+                 that were no longer on Google Docs
+        """
+        files = []
+        cached = 0
+        for fi, st in gQuery.Cursor(self, predicate, 'id'):
+            if os.path.basename(fi)[0] == '.' or fi in self.to_upload or \
+                    os.path.exists(('%s%s' % (self.home, fi)).encode(self.codec)):
+                cached += 1
+            else:
+                files.append((fi, self.gn.size(fi)))
+        result = {'matched': len(files) + cached, 'cached': cached, 'fetched': 0,
+                  'bytes': 0, 'failed': {}, 'missing': []}
+        if not files:
+            return result
+
+        lock = threading.Lock()
+        done = []
+
+        def finished(path, fetched):
+            with lock:
+                done.append(path)
+                if isinstance(fetched, Exception):
+                    result['failed'][path] = fetched
+                elif fetched is None:
+                    # Nothing was downloaded: either open got there first
+                    # or the file is gone
+                    if os.path.exists(('%s%s' % (self.home, path)).encode(self.codec)):
+                        result['cached'] += 1
+                    else:
+                        result['missing'].append(path)
+                n = len(done)
+            if progress is not None:
+                progress(n, len(files), path)
+
+        fetcher = gFetch.Prefetcher(self._fetch, min(concurrency, len(files)), progress=finished)
+        try:
+            fetcher.submit(files)
+            fetcher.wait()
+        finally:
+            fetcher.stop()
+        result['fetched'] = fetcher.fetched
+        result['bytes'] = fetcher.fetched_bytes
+        return result
+
+    def mknod(self, path, labels=None, service_type='proc', freshness_per=0.1, shelf_life=0, mode=None, dev=None):
         """
         Purpose: Create file nodes. Use mkdir to create directories
         path: Path of file to create
+        shelf_life: Seconds after it is received the file expires, 0 to
+                    keep it until it is removed
         mode: Ignored (for now)
         dev: Ignored (for now)
         Returns: 0 to indicate succes
@@ -623,21 +996,23 @@ class GFile(fuse.Fuse):
         tmp_path = '%s%s' % (self.home, path)
         tmp_dir = '%s%s' % (self.home, dir)
 
-        if filename[0] != '.':
-            self.to_upload[path] = True
-        else:
+        if filename[0] == '.':
             try:
                 os.makedirs(tmp_dir.encode(self.codec), 0o644)
             except OSError:
                 pass  # Assume that it already exists
             os.mknod(tmp_path.encode(self.codec), 0o644)
-        self._setattr(path=path, labels=labels, service_type=service_type, freshness_per=freshness_per,
-                      shelf_life=shelf_life)
-        self.files[path].set_file_attr(0, labels, service_type, freshness_per, shelf_life)
-        if self.directories.has_key(dir):
-            self.directories[dir].append(filename)
-        else:
-            self.directories[dir] = [filename]
+        with self.release_lock:
+            if filename[0] != '.':
+                self.to_upload[path] = True
+            self._setattr(path=path, labels=labels, service_type=service_type, freshness_per=freshness_per,
+                          shelf_life=shelf_life)
+            self._resize(path, 0)
+            if self.directories.has_key(dir):
+                self.directories[dir].append(filename)
+            else:
+                self.directories[dir] = [filename]
+            self._log('mknod', path, self._state(self.files[path]), path in self.to_upload)
         return 0
 
     def open(self, path, flags):
@@ -667,6 +1042,8 @@ class GFile(fuse.Fuse):
             f = flags
         else:
             f = 'a+'  # Just do something to make it work ;-)
+        if self.readahead is not None:
+            self.readahead.claim(path)
         if not os.path.exists(tmp_path):
             try:
                 os.makedirs(os.path.dirname(tmp_path))
@@ -674,12 +1051,16 @@ class GFile(fuse.Fuse):
                 pass  # Assume path exists
             if filename[0] != '.':
                 file = self.gn.get_file(path, tmp_path, f)
+                if f[0] != 'w':
+                    self.digests.record(path, self.digests.digest(path, tmp_path),
+                                        self.gn.revision(path))
             else:
                 file = open(tmp_path.encode(self.codec), f)
         else:
             file = open(tmp_path.encode(self.codec), f)
 
-        self.files[path].st_size = os.path.getsize(tmp_path.encode(self.codec))
+        with self.release_lock:
+            self._resize(path, os.path.getsize(tmp_path.encode(self.codec)))
         return file
 
     def write(self, path, buf, offset, fh=None):
@@ -698,9 +1079,11 @@ class GFile(fuse.Fuse):
             fh = open(tmp_path.encode(self.codec), 'wb')
         fh.seek(offset)
         fh.write(buf)
+        self.digests.write(path, offset, buf)
 
-        if filename[0] != '.':
+        if filename[0] != '.' and path not in self.written:
             self.written[path] = True
+            self._log_dirty(path)
         self.time_accessed[path] = time.time()
         return len(buf)
 
@@ -731,10 +1114,21 @@ class GFile(fuse.Fuse):
                 return -errno.ENOENT
         if path in self.directories:
             return -errno.EISDIR
-        try:
-            self.gn.erase(path)
-        except AttributeError as e:
-            return -errno.ENOENT
+        # A queued upload would bring the file back
+        self.uploads.cancel(path)
+        if path not in self.to_upload:
+            try:
+                self.gn.erase(path)
+            except AttributeError as e:
+                return -errno.ENOENT
+        with self.release_lock:
+            self.to_upload.pop(path, None)
+            self.written.pop(path, None)
+            self._forget(path)
+        tmp_path = '%s%s' % (self.home, path)
+        if os.path.isfile(tmp_path.encode(self.codec)):
+            os.remove(tmp_path.encode(self.codec))
+        return 0
 
     def read(self, path, size=-1, offset=0, fh=None):
         """
@@ -764,24 +1158,80 @@ class GFile(fuse.Fuse):
         fh: File Handle to be released
         """
 
-        self.release_lock.acquire()
-        filename = os.path.basename(path)
-        tmp_path = '%s%s' % (self.home, path)
-
-        if path in self.to_upload and path in self.written:
-            self.gn.upload_file(tmp_path)
-            del self.to_upload[path]
-
-        elif os.path.exists(tmp_path):
-            if path in self.written:
-                self.gn.update_file_contents(path, tmp_path)
-                del self.written[path]
+        if path in self.written:
+            # Returns once queued; blocks only while the queue is full.
+            # Releasing it again within upload_delay sends it only once.
+            self.uploads.submit(path)
 
+        self.release_lock.acquire()
         for t in self.time_accessed:
             if time.time() - self.time_accessed[t] > 300:
                 os.remove(t.encode(self.codec))
         self.release_lock.release()
 
+    def fsync(self, path, isfsyncfile, fh=None):
+        """
+        Purpose: Wait until the queued upload of a file has been sent
+        path: String containing path to file to sync
+        isfsyncfile: Ignored
+        fh: Ignored
+        """
+        self.flush_uploads(path)
+        if path in self.uploads.errors:
+            return -errno.EIO
+        return 0
+
+    def flush_uploads(self, path=None, timeout=None):
+        """
+        Purpose: Wait for queued uploads to reach Google Docs
+        path: String path to wait for, None for every queued upload
+        timeout: Float seconds to wait at most, None for no limit
+        Returns: True if nothing is left to wait for
+        """
+        return self.uploads.drain(path, timeout)
+
+    def _upload(self, path):
+        """
+        Purpose: Send a dirty file to Google Docs. Runs on an upload
+                 worker; uploads of one path never overlap.
+        path: String path to file
+        """
+        tmp_path = '%s%s' % (self.home, path)
+        with self.release_lock:
+            new = path in self.to_upload and path in self.written
+            if not new and not (path in self.written and os.path.exists(tmp_path)):
+                return  # Sent already, or removed meanwhile
+            # Writes made while uploading dirty the path again
+            del self.written[path]
+
+        try:
+            digest = self.digests.digest(path, tmp_path)
+            if not new and self.digests.unchanged(path, digest, self.gn.revision(path)):
+                # Same bytes as the remote copy, e.g. a touch or a save
+                # without edits
+                with self.release_lock:
+                    self._log_dirty(path)
+                return
+            if new:
+                self.gn.upload_file(tmp_path, path)
+            else:
+                self.gn.update_file_contents(path, tmp_path)
+        except Exception:
+            with self.release_lock:
+                if path in self.files:
+                    self.written[path] = True
+            raise
+
+        with self.release_lock:
+            if new:
+                self.to_upload.pop(path, None)
+            if path in self.written:
+                # Rewritten meanwhile; what was sent is not known
+                self.digests.discard(path)
+            else:
+                self.digests.record(path, digest, self.gn.revision(path))
+            self._log_dirty(path)
+
     def mkdir(self, path, mode):
         """
         Purpose: Make a directory
@@ -793,14 +1243,15 @@ class GFile(fuse.Fuse):
 
         if path in self.directories:
             return -errno.EEXIST
-        if dir in self.directories:
-            self.directories[os.path.dirname(path)].append(filename)
-        else:
+        if dir not in self.directories:
             return -errno.ENOENT
 
         self.gn.make_folder(path)
-        self.directories[path] = []
-        self._setattr(path, file=False)
+        with self.release_lock:
+            self.directories[dir].append(filename)
+            self.directories[path] = []
+            self._setattr(path, file=False)
+            self._log('mkdir', path)
         os.makedirs(tmp_path.encode(self.codec))
 
         return 0
@@ -816,9 +1267,9 @@ class GFile(fuse.Fuse):
         if path in self.directories:
             if len(self.directories[path]) == 0:  # Empty
                 self.gn.erase(path, folder=True)
-                self.directories[os.path.dirname(path)].remove(filename)
-                del self.files[path]
-                del self.directories[path]
+                with self.release_lock:
+                    self._remove_dir(path)
+                    self._log('rmdir', path)
                 os.removedirs(tmp_path.encode(self.codec))
             else:
                 return -errno.ENOTEMPTY
@@ -841,18 +1292,30 @@ class GFile(fuse.Fuse):
         elif os.path.dirname(pathfrom) == os.path.dirname(pathto):
             return -errno.ESAMEDIR
         else:  ## Move the file
-            if os.path.exists(tmp_path_from.encode(self.codec)):
-                os.rename(tmp_path_from, tmp_path_to)
-            if pathfrom in self.directories:
-                self.directories[pathto] = self.directories[pathfrom]
-                del self.directories[pathfrom]
-            self.files[pathto] = self.files[pathfrom]
-            del self.files[pathfrom]
-            if os.path.basename(pathfrom) in self.directories[os.path.dirname(pathfrom)]:
-                self.directories[os.path.dirname(pathfrom)].remove(os.path.basename(pathfrom))
-            self.directories[os.path.dirname(pathto)].append(os.path.basename(pathto))
-
-            self.gn.move_file(pathfrom, pathto)
+            # Queued uploads are sent again under the new path; one being
+            # sent already is waited for, so it lands under the old name
+            # and is moved with the rest
+            prefix = pathfrom + '/'
+            with self.release_lock:
+                queued = set(self.written)
+            queued.update(self.uploads.paths())
+            cancelled = [p for p in queued if (p == pathfrom or p.startswith(prefix)) and self.uploads.cancel(p)]
+            with self.release_lock:
+                for path in cancelled:
+                    if path in self.files and path not in self.written:
+                        self.written[path] = True
+                        self._log_dirty(path)
+                local = pathfrom in self.to_upload
+                if os.path.exists(tmp_path_from.encode(self.codec)):
+                    os.rename(tmp_path_from, tmp_path_to)
+                self._move(pathfrom, pathto)
+                self._log('move', pathfrom, pathto)
+                dirty = [p for p in self.written if p == pathto or p.startswith(pathto + '/')]
+
+            if not local:
+                self.gn.move_file(pathfrom, pathto)
+            for path in dirty:
+                self.uploads.submit(path)
 
         return 0
 
@@ -862,25 +1325,46 @@ class GFile(fuse.Fuse):
         fh = open(tmp_path.encode(self.codec), 'r+')
         fh.truncate(length)
         fh.close()
-        if filename[0] != '.':
+        self.digests.truncate(path, length)
+        if filename[0] != '.' and path not in self.written:
             self.written[path] = True
+            self._log_dirty(path)
         self.time_accessed[path] = time.time()
         return 0
 
-    def _setattr(self, path, entry=None, file=True, labels=None, service_type='proc', freshness_per=0.1, shelf_life=1):
+    def _setattr(self, path, entry=None, file=True, labels=None, service_type='proc', freshness_per=0.1, shelf_life=0):
         """
         Purpose: Set the getattr information for entry
         path: String path to file
         entry: DocumentListEntry object to extract data from
         file: Boolean set to false if setting attributes of a folder
+        labels: List of labels; None keeps those (and the shelf life and
+                service metadata) of a file refreshed from entry
         """
 
-        if labels is None:
-            labels = []
+        old = self.files.get(path)
+        if old is not None:
+            old.listener = None
         self.files[path] = GStat()
         if entry:
+            if old is not None:
+                # Listings do not carry it; keep it from when first seen
+                self.files[path].st_ctime = old.st_ctime
             if entry.GetDocumentType() != 'folder':
-                self.files[path].set_file_attr(len(path), labels, service_type, freshness_per, shelf_life)
+                size = gSync.entry_size(entry)
+                if old is not None and stat.S_ISREG(old.st_mode):
+                    if size is None:
+                        size = old.st_size
+                    if labels is None:
+                        # A fresh listing only brings size and times;
+                        # labels and the rest were set here
+                        labels, service_type = old.labels, old.service_type
+                        freshness_per, shelf_life = old.freshness_per, old.shelf_life
+                        self.files[path].receiveTime = old.receiveTime
+                self.files[path].set_file_attr(len(path) if size is None else size, labels or [],
+                                               service_type, freshness_per, shelf_life)
+            elif old is not None and not stat.S_ISREG(old.st_mode):
+                self.files[path].receiveTime = old.receiveTime
 
             # Set times
             if entry.lastViewed is None:
@@ -894,7 +1378,465 @@ class GFile(fuse.Fuse):
 
         else:
             if file:
-                self.files[path].set_file_attr(len(path), labels, service_type, freshness_per, shelf_life)
+                self.files[path].set_file_attr(len(path), labels or [], service_type, freshness_per, shelf_life)
+
+        self._index(path)
+        # Listings refresh every entry; only log what they changed
+        state = self._state(self.files[path])
+        if old is None or state != self._state(old):
+            self._log('put', path, state)
+
+    def _resize(self, path, size):
+        """
+        Purpose: Record a new size for path. Call with release_lock held.
+        path: String path to file
+        size: Int size in bytes
+        """
+        self.files[path].st_size = size
+        if self.columns is not None:
+            self.columns.set_size(self.ids.get(path), size)
+
+    def _index(self, path):
+        """
+        Purpose: Bring the lookup indexes up to date with self.files[path]
+        path: String path to file
+        """
+        st = self.files[path]
+        self.misses.discard(path)
+        fid = self.ids.assign(path)
+        self._invalidate(path, fid)
+        self.tree.remove_file(path, fid, self.label_index.labels(fid))
+        self.label_index.add(fid, st.labels)
+        self.time_index.add(fid, st.st_mtime)
+        self.tree.add_file(path, fid, self.label_index.labels(fid))
+        if self.columns is not None:
+            self.columns.put(fid, st, os.path.dirname(path))
+        st.listener = functools.partial(self._retime, fid)
+        self._invalidate(path, fid)
+        if self.expiry is not None:
+            expires_at = st.expires_at()
+            if expires_at is None:
+                self.expiry.cancel(fid)
+            else:
+                self.expiry.schedule(fid, expires_at)
+
+    def _retime(self, fid, st):
+        """
+        Purpose: Listener keeping the time index in step with set_access_times
+        fid: Int id of the file
+        st: GStat whose times changed
+        """
+        path = self.ids.path(fid)
+        self._invalidate(path, fid)
+        self.time_index.add(fid, st.st_mtime)
+        if self.columns is not None:
+            self.columns.set_times(fid, st)
+        self._invalidate(path, fid)
+        self._log('times', path, st.st_mtime, st.st_ctime, st.st_atime)
+
+    def _unindex(self, path):
+        """
+        Purpose: Remove path from the lookup indexes and release its id
+        path: String path to file
+        """
+        if path in self.files:
+            self.files[path].listener = None
+        fid = self.ids.get(path)
+        if fid is not None:
+            self._invalidate(path, fid)
+            self.ids.release(path)
+            if self.expiry is not None:
+                self.expiry.cancel(fid)
+            self.tree.remove_file(path, fid, self.label_index.labels(fid))
+            self.label_index.remove(fid)
+            self.time_index.remove(fid)
+            if self.columns is not None:
+                self.columns.remove(fid)
+
+    def load_snapshot(self):
+        """
+        Purpose: Map the metadata snapshot and take the table and indexes
+                 from it. GStats are only built when first looked up.
+        Returns: True if the snapshot was loaded
+        """
+        try:
+            snap = gSnapshot.Snapshot(self.snapshot_path)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            sys.stderr.write('ignoring metadata snapshot %s: %s\n' % (self.snapshot_path, e))
+            return False
+        with self.release_lock:
+            self.ids = snap.file_ids()
+            self.label_index = snap.label_index()
+            self.time_index = snap.time_index()
+            self.planner = gIndex.QueryPlanner(self.label_index, self.time_index)
+            self.tree = snap.tree()
+            self.directories = snap.directories()
+            self.files = gSnapshot.StatTable(snap, self.ids, GStat, self._attach)
+            if self.columns is not None:
+                self.columns = gTable.ColumnTable(max(1024, snap.size))
+                snap.fill_columns(self.columns)
+            self.query_cache.clear()
+            to_upload, written = snap.dirty()
+            self.to_upload = dict.fromkeys(to_upload, True)
+            self.written = dict.fromkeys(written, True)
+            old, self.snapshot = self.snapshot, snap
+        if old is not None:
+            old.close()
+        return True
+
+    def save_snapshot(self):
+        """
+        Purpose: Write the metadata table and indexes to the snapshot so
+                 the next mount can map them instead of starting empty
+        Returns: Int size of the snapshot in bytes
+        """
+        with self.release_lock:
+            # Some listings are also changed without the lock (readdir);
+            # save works on copies so it never iterates a changing dict
+            directories = dict((d, list(names)) for d, names in list(self.directories.items()))
+            dirty = (list(self.to_upload), list(self.written))
+            return gSnapshot.save(self.snapshot_path, self.ids, self.files, self.label_index,
+                                  self.time_index, self.tree, directories, dirty)
+
+    def open_wal(self):
+        """
+        Purpose: Replay the write-ahead log onto the loaded snapshot, then
+                 keep logging every metadata change to it
+        Returns: Int number of records replayed
+        """
+        wal = gWal.WriteAheadLog(self.wal_path, on_full=self.checkpoint)
+        replayed = 0
+        # Records of a checkpoint that never finished come first
+        for path in (wal.old_path, wal.path):
+            for record in gWal.read(path):
+                self._replay(record)
+                replayed += 1
+        self.wal = wal
+        if replayed:
+            self.checkpoint()
+        return replayed
+
+    def checkpoint(self):
+        """
+        Purpose: Fold the write-ahead log into a new snapshot and start an
+                 empty log. Changes keep being logged meanwhile; changes
+                 are applied before they are logged, so everything in the
+                 retired log is already in the snapshot.
+        """
+        if self.wal is not None:
+            self.wal.rotate()
+        if self.snapshot_path:
+            self.save_snapshot()
+            if self.wal is not None:
+                self.wal.retire()
+
+    def fsdestroy(self):
+        """
+        Purpose: Called on unmount. Stops expiry and saves the snapshot.
+        """
+        self.stop_expiry()
+        if self.readahead is not None:
+            self.readahead.stop()
+        self.uploads.stop()
+        if self.snapshot_path:
+            self.checkpoint()
+        if self.wal is not None:
+            self.wal.close()
+            self.wal = None
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def resume_uploads(self):
+        """
+        Purpose: Send the files that were still waiting to be uploaded
+                 when the filesystem last stopped
+        """
+        for path in list(set(self.to_upload) | set(self.written)):
+            self.release(path, None)
+
+    def _log(self, *record):
+        """
+        Purpose: Append a metadata change to the write-ahead log
+        record: Operation name followed by its JSON serialisable arguments
+        """
+        if self.wal is not None:
+            self.wal.append(record)
+
+    def _log_dirty(self, path):
+        """
+        Purpose: Log the pending upload state of path
+        path: String path to file
+        """
+        self._log('dirty', path, path in self.to_upload, path in self.written)
+
+    def _state(self, st):
+        """
+        Purpose: The fields of a GStat the write-ahead log keeps
+        st: GStat to describe
+        Returns: Dict of JSON serialisable values
+        """
+        return {'mode': st.st_mode, 'nlink': st.st_nlink, 'size': st.st_size,
+                'mtime': st.st_mtime, 'ctime': st.st_ctime, 'atime': st.st_atime,
+                'receive': st.receiveTime, 'labels': list(st.labels),
+                'service_type': st.service_type, 'freshness_per': st.freshness_per,
+                'shelf_life': st.shelf_life}
+
+    def _restore(self, path, state):
+        """
+        Purpose: Rebuild self.files[path] from a logged state and index it
+        path: String path to file
+        state: Dict returned by _state
+        """
+        if path in self.files:
+            self.files[path].listener = None
+        st = GStat()
+        st.st_mode = state['mode']
+        st.st_nlink = state['nlink']
+        st.st_size = state['size']
+        st.st_mtime = state['mtime']
+        st.st_ctime = state['ctime']
+        st.st_atime = state['atime']
+        st.receiveTime = state['receive']
+        st.labels = state['labels']
+        st.service_type = state['service_type']
+        st.freshness_per = state['freshness_per']
+        st.shelf_life = state['shelf_life']
+        self.files[path] = st
+        self._index(path)
+
+    def _replay(self, record):
+        """
+        Purpose: Apply one write-ahead log record. Records describe the
+                 resulting state, so replaying one twice is harmless.
+        record: List, operation name followed by its arguments
+        """
+        op, args = record[0], record[1:]
+        wal, self.wal = self.wal, None
+        try:
+            if op == 'put':
+                self._restore(*args)
+            elif op == 'mknod':
+                path, state, upload = args
+                self._restore(path, state)
+                dir, filename = os.path.split(path)
+                listing = self.directories.setdefault(dir, [])
+                if filename not in listing:
+                    listing.append(filename)
+                if upload:
+                    self.to_upload[path] = True
+            elif op == 'times':
+                path, mtime, ctime, atime = args
+                fid = self.ids.get(path)
+                if fid is not None and path in self.files:
+                    st = self.files[path]
+                    st.st_mtime, st.st_ctime, st.st_atime = mtime, ctime, atime
+                    self._retime(fid, st)
+            elif op == 'dirty':
+                path, upload, written = args
+                for table, flag in ((self.to_upload, upload), (self.written, written)):
+                    if flag:
+                        table[path] = True
+                    else:
+                        table.pop(path, None)
+            elif op == 'del':
+                self._forget(args[0])
+                self.to_upload.pop(args[0], None)
+                self.written.pop(args[0], None)
+            elif op == 'mkdir':
+                dir, filename = os.path.split(args[0])
+                listing = self.directories.setdefault(dir, [])
+                if filename not in listing:
+                    listing.append(filename)
+                self.directories.setdefault(args[0], [])
+            elif op == 'rmdir':
+                if args[0] in self.directories:
+                    self._remove_dir(args[0])
+            elif op == 'move':
+                if args[0] in self.files or args[0] in self.directories:
+                    self._move(*args)
+            else:
+                sys.stderr.write('ignoring unknown write-ahead log record %r\n' % (op,))
+        finally:
+            self.wal = wal
+
+    def _attach(self, path, fid, st):
+        """
+        Purpose: Hook a GStat read out of the snapshot up to the indexes
+        path: String path to file
+        fid: Int id of the file
+        st: GStat that was built
+        """
+        st.listener = functools.partial(self._retime, fid)
+
+    def start_expiry(self, remote=False):
+        """
+        Purpose: Start expiring files once their shelf life (in seconds
+                 after receiveTime) has run out
+        remote: Boolean, also erase expired files from Google Docs
+        """
+        if self.expiry is None:
+            self.expiry = gExpiry.ExpiryEngine(self._expire)
+            deadlines = []
+            for path, fid in list(self.ids.ids.items()):
+                expires_at = self.files[path].expires_at()
+                if expires_at is not None:
+                    deadlines.append((fid, expires_at))
+            self.expiry.schedule_many(deadlines)
+        self.expire_remote = remote
+        self.expiry.start()
+
+    def stop_expiry(self):
+        """
+        Purpose: Stop the background expiry thread
+        """
+        if self.expiry is not None:
+            self.expiry.stop()
+
+    def _expire(self, fid):
+        """
+        Purpose: Drop a file whose shelf life ran out: its cache file,
+                 optionally the remote copy, and its index entries
+        fid: Int id of the expired file
+        """
+        with self.release_lock:
+            path = self.ids.path(fid)
+            if path is None:
+                return
+            if path in self.to_upload or path in self.written or path in self.uploads:
+                # Changes not on Google Docs yet would be lost; try again
+                # once they have been sent
+                self.expiry.schedule(fid, time.time() + max(self.files[path].shelf_life, 1))
+                return
+            tmp_path = '%s%s' % (self.home, path)
+            if os.path.isfile(tmp_path.encode(self.codec)):
+                os.remove(tmp_path.encode(self.codec))
+            self.time_accessed.pop(path, None)
+            self._forget(path)
+        # Not under the lock, which every mknod, open and upload takes
+        if self.expire_remote:
+            try:
+                self.gn.erase(path)
+            except AttributeError:
+                pass  # Already gone remotely
+
+    def _invalidate(self, path, fid):
+        """
+        Purpose: Evict the cached query results the indexed state of fid
+                 could appear in. Called before and after every change.
+        path: String path the file is (or was) indexed under
+        fid: Int id of the file
+        """
+        if fid in self.label_index.assigned:
+            self.query_cache.invalidate(path, self.label_index.labels(fid), self.time_index.mtime(fid))
+
+    def _move_entry(self, pathfrom, pathto):
+        """
+        Purpose: Re-key one entry of self.files and the indexes to a new path
+        pathfrom: String old path
+        pathto: String new path
+        """
+        self.files[pathto] = self.files[pathfrom]
+        del self.files[pathfrom]
+        fid = self.ids.get(pathfrom)
+        if fid is None:
+            return
+        self._invalidate(pathfrom, fid)
+        self.ids.rename(pathfrom, pathto)
+        self._invalidate(pathto, fid)
+        labels = self.label_index.labels(fid)
+        self.tree.remove_file(pathfrom, fid, labels)
+        self.tree.add_file(pathto, fid, labels)
+        if self.columns is not None:
+            self.columns.set_parent(fid, os.path.dirname(pathto))
+
+    def _move_subtree(self, pathfrom, pathto):
+        """
+        Purpose: Re-key everything below directory pathfrom to pathto
+        pathfrom: String old directory path
+        pathto: String new directory path
+        """
+        prefix = pathfrom + '/'
+        for dir in [d for d in self.directories if d.startswith(prefix)]:
+            self.directories[pathto + dir[len(pathfrom):]] = self.directories.pop(dir)
+        self.directories[pathto] = self.directories.pop(pathfrom)
+
+        moved = [(fid, self.ids.path(fid)) for fid in self.tree.subtree(pathfrom)]
+        self.tree.move_dir(pathfrom, pathto)
+        for fid, path in moved:
+            self._invalidate(path, fid)
+            self.digests.discard(path)
+            for flags in (self.to_upload, self.written):
+                if path in flags:
+                    flags[pathto + path[len(pathfrom):]] = flags.pop(path)
+            self.files[pathto + path[len(pathfrom):]] = self.files.pop(path)
+            self.ids.rename(path, pathto + path[len(pathfrom):])
+            self._invalidate(pathto + path[len(pathfrom):], fid)
+            if self.columns is not None:
+                self.columns.set_parent(fid, pathto + os.path.dirname(path)[len(pathfrom):])
+
+    def _select(self, labels, min_time, max_time, scope=None):
+        """
+        Purpose: Find the files carrying every label in labels and
+                 modified between min_time and max_time
+        labels: List of labels, or None for no label predicate
+        min_time: Lower mtime bound or None
+        max_time: Upper mtime bound or None
+        scope: RoaringBitmap of the ids to search among, None for all
+        Returns: Iterable of file ids
+        """
+        if self.columns is not None:
+            ids = self.label_index.lookup(labels) if labels else None
+            if scope is not None:
+                ids = scope if ids is None else ids & scope
+            return self.columns.select(ids, min_time, max_time)
+        if not labels and scope is None:
+            return self.time_index.range(min_time, max_time)
+        return self.planner.execute(labels, min_time, max_time, scope)
+
+    def _forget(self, path):
+        """
+        Purpose: Drop a removed file from self.files, its parent listing
+                 and the lookup indexes
+        path: String path to file
+        """
+        self._unindex(path)
+        self.digests.discard(path)
+        if path in self.files:
+            del self.files[path]
+        dir, filename = os.path.split(path)
+        if dir in self.directories and filename in self.directories[dir]:
+            self.directories[dir].remove(filename)
+        self._log('del', path)
+
+    def _remove_dir(self, path):
+        """
+        Purpose: Drop an empty directory from the listings and indexes
+        path: String path to directory
+        """
+        self._forget(path)
+        del self.directories[path]
+        self.tree.remove_dir(path)
+
+    def _move(self, pathfrom, pathto):
+        """
+        Purpose: Move a file or directory to a new path in the listings
+                 and indexes
+        pathfrom: String old path
+        pathto: String new path
+        """
+        self.misses.discard(pathto, subtree=True)
+        self.digests.discard(pathfrom)
+        self.digests.discard(pathto)
+        for flags in (self.to_upload, self.written):
+            if pathfrom in flags:
+                flags[pathto] = flags.pop(pathfrom)
+        if pathfrom in self.directories:
+            self._move_subtree(pathfrom, pathto)
+        self._move_entry(pathfrom, pathto)
+        if os.path.basename(pathfrom) in self.directories[os.path.dirname(pathfrom)]:
+            self.directories[os.path.dirname(pathfrom)].remove(os.path.basename(pathfrom))
+        self.directories[os.path.dirname(pathto)].append(os.path.basename(pathto))
 
     def _time_convert(self, t):
         """
@@ -904,22 +1846,21 @@ class GFile(fuse.Fuse):
         """
         return int(time.mktime(tuple([int(x) for x in (t[:10].split('-')) + t[11:19].split(':')]) + (0, 0, 0)))
 
+    def _entry_name(self, entry):
+        """
+        Purpose: Name an entry is listed under in its folder
+        entry: DocumentListEntry object
+        Returns: String, the title plus an extension for files
+        """
+        return gSync.entry_name(entry, self.codec)
+
     def _file_extension(self, entry):
         """
         Purpose: Determine the file extension for the given entry
         entry: DocumentListEntry object to scan for filetype
         Returns: String of length 3 with file extension (Currently only Oasis filetypes)
         """
-
-        if entry.GetDocumentType() == 'document':
-            return 'doc'
-        elif entry.GetDocumentType() == 'spreadsheet':
-            return 'xls'
-        elif entry.GetDocumentType() == 'presentation':
-            return 'ppt'
-
-        # Should never reach this - used for debugging
-        return entry.GetDocumentType()
+        return gSync.extension(entry)
 
 
 def main():
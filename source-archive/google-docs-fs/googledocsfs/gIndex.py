@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gIndex.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from gBitmap import RoaringBitmap
+
+_MISSING = float('nan')
+
+
+def normalise_labels(labels):
+    """
+    Purpose: Turn the labels argument of a lookup into a list
+    labels: None, a single label String or an iterable of labels
+    Returns: A List of labels
+    """
+    if labels is None:
+        return []
+    if isinstance(labels, (str, type(u''))):
+        return [labels]
+    return list(labels)
+
+
+def intersect(bitmaps):
+    """
+    Purpose: AND a list of bitmaps together, smallest first, stopping
+             as soon as the running result is empty
+    bitmaps: List of RoaringBitmaps
+    Returns: A new RoaringBitmap
+    """
+    if not bitmaps:
+        return RoaringBitmap()
+    bitmaps = sorted(bitmaps, key=len)
+    result = bitmaps[0].copy()
+    for bitmap in bitmaps[1:]:
+        if not result:
+            break
+        result = result & bitmap
+    return result
+
+
+class FileIds(object):
+    """
+    Hands out dense integer ids to paths so the indexes can store
+    compact bitmaps of ids instead of sets of path strings
+    """
+
+    def __init__(self):
+        """
+        Purpose: Start with no ids assigned
+        Returns: Nothing
+        """
+        self.ids = {}
+        self.paths = []
+        self.free = []
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def assign(self, path):
+        """
+        Purpose: Get the id of path, allocating the lowest free one if new
+        path: String path of the file
+        Returns: Int id
+        """
+        with self.lock:
+            fid = self.ids.get(path)
+            if fid is None:
+                if self.free:
+                    fid = heapq.heappop(self.free)
+                    self.paths[fid] = path
+                else:
+                    fid = len(self.paths)
+                    self.paths.append(path)
+                self.ids[path] = fid
+            return fid
+
+    def release(self, path):
+        """
+        Purpose: Give the id of path back for reuse
+        path: String path of the file
+        Returns: Int id that was released or None
+        """
+        with self.lock:
+            fid = self.ids.pop(path, None)
+            if fid is not None:
+                self.paths[fid] = None
+                heapq.heappush(self.free, fid)
+            return fid
+
+    def rename(self, pathfrom, pathto):
+        """
+        Purpose: Keep the id of pathfrom for pathto
+        """
+        with self.lock:
+            fid = self.ids.pop(pathfrom, None)
+            if fid is not None:
+                self.ids[pathto] = fid
+                self.paths[fid] = pathto
+
+    def get(self, path):
+        """
+        Purpose: Look up the id of path
+        Returns: Int id or None
+        """
+        return self.ids.get(path)
+
+    def path(self, fid):
+        """
+        Purpose: Look up the path owning id fid
+        Returns: String path or None
+        """
+        if fid < len(self.paths):
+            return self.paths[fid]
+        return None
+
+
+class LabelIndex(object):
+    """
+    Inverted index mapping every label to a bitmap of the file ids
+    carrying it
+    """
+
+    def __init__(self):
+        """
+        Purpose: Start with an empty index
+        Returns: Nothing
+        """
+        self.postings = {}
+        self.assigned = {}
+        self.all = RoaringBitmap()
+        self.lock = threading.RLock()
+
+    def add(self, fid, labels):
+        """
+        Purpose: Index fid under each of its labels, replacing any
+                 labels it was indexed under before
+        fid: Int id of the file
+        labels: List of label Strings
+        """
+        with self.lock:
+            self.remove(fid)
+            labels = tuple(normalise_labels(labels))
+            self.assigned[fid] = labels
+            self.all.add(fid)
+            for label in labels:
+                posting = self.postings.get(label)
+                if posting is None:
+                    posting = self.postings[label] = RoaringBitmap()
+                posting.add(fid)
+
+    def remove(self, fid):
+        """
+        Purpose: Drop fid from every posting it appears in
+        fid: Int id of the file
+        """
+        with self.lock:
+            if fid not in self.assigned:
+                return
+            self.all.discard(fid)
+            for label in self.assigned.pop(fid):
+                posting = self.postings.get(label)
+                if posting is None:
+                    continue
+                posting.discard(fid)
+                if not posting:
+                    del self.postings[label]
+
+    def labels(self, fid):
+        """
+        Purpose: Labels fid is indexed under
+        Returns: Tuple of label Strings
+        """
+        return self.assigned.get(fid, ())
+
+    def cardinality(self, label):
+        """
+        Purpose: Number of files carrying label
+        label: String label
+        Returns: Int length of the posting list
+        """
+        posting = self.postings.get(label)
+        if posting is None:
+            return 0
+        return len(posting)
+
+    def sorted_postings(self, labels):
+        """
+        Purpose: Fetch the postings of labels, rarest first
+        labels: List of labels
+        Returns: A List of posting bitmaps, empty if any label is unknown
+        """
+        postings = []
+        with self.lock:
+            for label in set(normalise_labels(labels)):
+                posting = self.postings.get(label)
+                if not posting:
+                    return []
+                postings.append(posting)
+        postings.sort(key=len)
+        return postings
+
+    def lookup(self, labels):
+        """
+        Purpose: Find the files carrying every label in labels
+        labels: List of labels (or a single label String)
+        Returns: A RoaringBitmap of file ids
+
+        The postings are intersected starting from the rarest label so
+        the cost follows the smallest posting list, not the table size.
+        """
+        labels = normalise_labels(labels)
+        with self.lock:
+            if not labels:
+                return self.all.copy()
+            return intersect(self.sorted_postings(labels))
+
+
+class TimeIndex(object):
+    """
+    Modification times of all indexed files, kept sorted by (mtime, id)
+    so range queries cost O(log n + k)
+    """
+
+    def __init__(self):
+        """
+        Purpose: Start with an empty index
+        Returns: Nothing
+        """
+        self.times = array('d')
+        self.ids = array('l')
+        self.mtimes = array('d')
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, fid, mtime):
+        """
+        Purpose: Index fid at mtime, moving it if it was indexed before
+        fid: Int id of the file
+        mtime: Modified time, as a number or numeric String
+        """
+        mtime = float(mtime)
+        with self.lock:
+            if self.mtime(fid) == mtime:
+                return
+            self.remove(fid)
+            if fid >= len(self.mtimes):
+                self.mtimes.extend([_MISSING] * (fid + 1 - len(self.mtimes)))
+            self.mtimes[fid] = mtime
+            # Entries mostly arrive in time order, so this is usually an append
+            if not self.times or (self.times[-1], self.ids[-1]) < (mtime, fid):
+                self.times.append(mtime)
+                self.ids.append(fid)
+            else:
+                i = self._position(mtime, fid)
+                self.times.insert(i, mtime)
+                self.ids.insert(i, fid)
+
+    def remove(self, fid):
+        """
+        Purpose: Drop fid from the index
+        fid: Int id of the file
+        """
+        with self.lock:
+            mtime = self.mtime(fid)
+            if mtime is None:
+                return
+            self.mtimes[fid] = _MISSING
+            i = self._position(mtime, fid, False)
+            del self.times[i]
+            del self.ids[i]
+
+    def _position(self, mtime, fid, after=True):
+        """
+        Purpose: Locate (mtime, fid) in the (mtime, id) order. Files
+                 sharing an mtime are sorted by id, so the ids of that
+                 run are bisected too rather than walked.
+        after: Boolean, give the first position sorting after (mtime, fid)
+               rather than the first one not sorting before it
+        Returns: Int position
+        """
+        lo = bisect_left(self.times, mtime)
+        hi = bisect_right(self.times, mtime, lo)
+        if after:
+            return bisect_right(self.ids, fid, lo, hi)
+        return bisect_left(self.ids, fid, lo, hi)
+
+    def _bounds(self, min_time, max_time):
+        """
+        Purpose: Locate the slice of entries between min_time and max_time
+        Returns: Tuple of the first and one past the last position
+        """
+        lo = 0 if min_time is None else bisect_left(self.times, float(min_time))
+        hi = len(self.times) if max_time is None else bisect_right(self.times, float(max_time))
+        return lo, max(lo, hi)
+
+    def count(self, min_time, max_time):
+        """
+        Purpose: Count the files modified between min_time and max_time
+        Returns: Int number of matches, found in O(log n)
+        """
+        with self.lock:
+            lo, hi = self._bounds(min_time, max_time)
+            return hi - lo
+
+    def range(self, min_time, max_time):
+        """
+        Purpose: Find the files modified between min_time and max_time
+                 (both inclusive, None for unbounded)
+        Returns: An array of file ids in ascending mtime order
+        """
+        with self.lock:
+            lo, hi = self._bounds(min_time, max_time)
+            return self.ids[lo:hi]
+
+    def scan(self, min_time, max_time, after=None, reverse=False, chunk=256):
+        """
+        Purpose: Stream the entries between min_time and max_time without
+                 copying the whole range. The index is only locked while
+                 each chunk is copied, and the position is found again by
+                 bisection, so concurrent updates do not break the walk.
+        min_time: Lower mtime bound or None
+        max_time: Upper mtime bound or None
+        after: (mtime, fid) Tuple to resume after, or None to start at
+               the beginning (the end when reverse is True)
+        reverse: Boolean, walk in descending (mtime, id) order
+        chunk: Int number of entries copied per lock acquisition
+        Returns: Generator of (mtime, fid) Tuples
+        """
+        while True:
+            with self.lock:
+                lo, hi = self._bounds(min_time, max_time)
+                if not reverse:
+                    start = lo if after is None else max(lo, self._position(after[0], after[1]))
+                    end = min(hi, start + chunk)
+                    batch = list(zip(self.times[start:end], self.ids[start:end]))
+                else:
+                    end = hi if after is None else min(hi, self._position(after[0], after[1], False))
+                    start = max(lo, end - chunk)
+                    batch = list(zip(self.times[start:end], self.ids[start:end]))
+                    batch.reverse()
+            if not batch:
+                return
+            for entry in batch:
+                yield entry
+            after = batch[-1]
+
+    def mtime(self, fid):
+        """
+        Purpose: Look up the indexed modified time of fid
+        Returns: Float mtime or None if fid is not indexed
+        """
+        if fid < len(self.mtimes):
+            mtime = self.mtimes[fid]
+            if mtime == mtime:
+                return mtime
+        return None
+
+
+class QueryPlanner(object):
+    """
+    Picks the cheapest way to answer a combined label and time query
+    from the label and time indexes
+    """
+
+    # Relative cost of one candidate handled by interpreted Python code
+    # and of one id pushed through a bitmap operation
+    SCAN_COST = 1.0
+    SET_COST = 0.1
+
+    def __init__(self, label_index, time_index):
+        """
+        Purpose: Plan over the given indexes
+        label_index: LabelIndex to drive or filter label predicates
+        time_index: TimeIndex to drive or filter time predicates
+        Returns: Nothing
+        """
+        self.label_index = label_index
+        self.time_index = time_index
+
+    def candidates(self, labels, scope):
+        """
+        Purpose: Collect the bitmaps a match must belong to, rarest first
+        labels: List of labels
+        scope: RoaringBitmap restricting the matches, or None
+        Returns: A List of bitmaps, or None if no file can match
+        """
+        labels = normalise_labels(labels)
+        bitmaps = self.label_index.sorted_postings(labels) if labels else []
+        if labels and not bitmaps:
+            return None
+        if scope is not None:
+            if not scope:
+                return None
+            bitmaps.append(scope)
+            bitmaps.sort(key=len)
+        return bitmaps
+
+    def _plan(self, labels, min_time, max_time, scope):
+        """
+        Purpose: Pick a strategy
+        Returns: Tuple (strategy, costs, bitmaps)
+        """
+        bitmaps = self.candidates(labels, scope)
+        if bitmaps is None:
+            return 'empty', {}, []
+        if not bitmaps:
+            return 'times', {}, bitmaps
+        if min_time is None and max_time is None:
+            return 'labels', {}, bitmaps
+
+        n_label = len(bitmaps[0])
+        n_time = self.time_index.count(min_time, max_time)
+        total = max(1, len(self.time_index))
+        # Assume the predicates are independent to size the result
+        n_result = n_label * n_time / float(total)
+        costs = {
+            'labels': n_label * (self.SCAN_COST + self.SET_COST * len(bitmaps)),
+            'times': n_time * (self.SCAN_COST + self.SET_COST * len(bitmaps)),
+            'intersect': self.SET_COST * (n_time + n_label * len(bitmaps)) + self.SCAN_COST * n_result,
+        }
+        return min(costs, key=costs.get), costs, bitmaps
+
+    def plan(self, labels, min_time, max_time, scope=None):
+        """
+        Purpose: Estimate the cost of each strategy and pick the cheapest
+        labels: List of labels every match must carry
+        min_time: Lower mtime bound or None
+        max_time: Upper mtime bound or None
+        scope: RoaringBitmap of the ids a match must be among, or None
+        Returns: Tuple (strategy, costs) where strategy is one of 'labels',
+                 'times', 'intersect' or 'empty' and costs maps each
+                 strategy to its estimate
+        """
+        strategy, costs, bitmaps = self._plan(labels, min_time, max_time, scope)
+        return strategy, costs
+
+    def execute(self, labels, min_time, max_time, scope=None):
+        """
+        Purpose: Find the files carrying every label in labels, modified
+                 between min_time and max_time and inside scope
+        Returns: A List of matching file ids
+        """
+        strategy, costs, bitmaps = self._plan(labels, min_time, max_time, scope)
+        if strategy == 'empty':
+            return []
+        if strategy == 'times':
+            return [fid for fid in self.time_index.range(min_time, max_time)
+                    if all(fid in bitmap for bitmap in bitmaps)]
+
+        matches = intersect(bitmaps)
+        if strategy == 'labels' and min_time is None and max_time is None:
+            return list(matches)
+        if strategy == 'intersect':
+            return list(matches & RoaringBitmap(self.time_index.range(min_time, max_time)))
+
+        lo = float('-inf') if min_time is None else float(min_time)
+        hi = float('inf') if max_time is None else float(max_time)
+        result = []
+        mtime = self.time_index.mtime
+        for fid in matches:
+            t = mtime(fid)
+            if t is not None and lo <= t <= hi:
+                result.append(fid)
+        return result
+
+    def count(self, labels, min_time, max_time, scope=None):
+        """
+        Purpose: Count the matches of execute without collecting them
+        Returns: Int number of matching files
+
+        Label-only and time-only queries are answered from posting and
+        range cardinalities; only a combined query walks candidates.
+        """
+        if not normalise_labels(labels) and scope is None:
+            if min_time is None and max_time is None:
+                return len(self.label_index.all)
+            return self.time_index.count(min_time, max_time)
+        strategy, costs, bitmaps = self._plan(labels, min_time, max_time, scope)
+        if strategy == 'empty':
+            return 0
+        if strategy == 'times':
+            return sum(1 for fid in self.time_index.range(min_time, max_time)
+                       if all(fid in bitmap for bitmap in bitmaps))
+
+        if min_time is None and max_time is None:
+            if len(bitmaps) == 1:
+                return len(bitmaps[0])
+            return intersect(bitmaps[:-1]).intersection_len(bitmaps[-1])
+        if strategy == 'intersect':
+            return intersect(bitmaps).intersection_len(RoaringBitmap(self.time_index.range(min_time, max_time)))
+
+        lo = float('-inf') if min_time is None else float(min_time)
+        hi = float('inf') if max_time is None else float(max_time)
+        mtime = self.time_index.mtime
+        n = 0
+        for fid in intersect(bitmaps):
+            t = mtime(fid)
+            if t is not None and lo <= t <= hi:
+                n += 1
+        return n
@@ -19,8 +19,12 @@
 #   MA 02110-1301, USA.
 
 import os
+import threading
 import gdata.docs.service
 import gdata.docs
+import gSync
+import gPool
+import gAuth
 from gdata import MediaSource
 
 class GNet(object):
@@ -29,23 +33,43 @@ class GNet(object):
     as storing the user's session data
     """
 
-    def __init__(self, em, pw):
+    def __init__(self, em, pw, pool_size = 4):
         """
         Purpose: Login to Google Docs and store the session cookie
         em: A String containing the user's email address
         pw: A String containing the user's password
+        pool_size: Int number of kept-alive connections shared by all
+                   threads
         Returns: A GNet object for accessing the GData Docs
         """
 
+        self.pool = gPool.ConnectionPool(pool_size)
         self.gd_client = gdata.docs.service.DocsService()
+        self.gd_client.http_client = gPool.PooledHttpClient(self.pool)
         self.gd_client.email = em
         self.gd_client.password = pw
         self.gd_client.source = 'google-docs-fs'
         self.gd_client.ssl = True
         self.gd_client.ProgrammaticLogin()
         self.codec = 'utf-8'
+        self.tokens = gAuth.TokenManager(em, pw)
+        self.tokens.register('wise', self._spreadsheets_service)
+        self.tokens.start()
+        # Full path -> entry, saving get_filename its title query
+        self.entries = {}
+        self.entries_lock = threading.Lock()
+        # Every folder and document, once load_tree has run
+        self.tree = gSync.FolderTree(lambda entry: gSync.entry_name(entry, self.codec))
 
 
+    def connection_stats(self):
+        """
+        Purpose: Report how often connections (and TLS handshakes) were
+                 reused rather than opened
+        Returns: Dict, see gPool.ConnectionPool.stats
+        """
+        return self.pool.stats()
+
     def get_docs(self, filetypes = None, folder = None):
         """
         Purpose: Retrieve a list of all documents
@@ -61,6 +85,29 @@ class GNet(object):
 
         return self.gd_client.Query(query.ToUri())
 
+    def get_changes(self, since = None):
+        """
+        Purpose: Retrieve every document and folder, or only those updated
+                 since a given time, following the feed across pages
+        since: RFC 3339 time String, or None for the full listing
+        Returns: A List of gdata.docs.DocumentListEntry objects, including
+                 trashed ones when since is given
+        """
+        query = gdata.docs.service.DocumentQuery()
+        query['showfolders'] = 'true'
+        if since is not None:
+            query['updated-min'] = since
+            query['showdeleted'] = 'true'
+
+        feed = self.gd_client.Query(query.ToUri())
+        entries = list(feed.entry)
+        next = feed.GetNextLink()
+        while next is not None:
+            feed = self.gd_client.Query(next.href)
+            entries.extend(feed.entry)
+            next = feed.GetNextLink()
+        return entries
+
     def get_filename(self, path, showfolders = 'false', labels = None):
         """
         Purpose: Retrieves the file referred to by path from Google
@@ -71,6 +118,86 @@ class GNet(object):
 
         TODO: HERE is where label- AND hash-based lookup
         """
+        entry = self.entries.get(path)
+        if entry is None and self.tree.loaded:
+            entry = self.tree.lookup(path)
+        if entry is not None and (showfolders == 'true' or entry.GetDocumentType() != 'folder'):
+            return entry
+        entry = self._find_filename(path, showfolders)
+        if entry is not None:
+            self.remember(path, entry)
+        return entry
+
+    def load_tree(self):
+        """
+        Purpose: Fetch every folder and document in one paged listing and
+                 resolve paths by walking it from then on
+        Returns: Int number of entries in the tree
+        """
+        self.tree.load(self.get_changes())
+        return len(self.tree)
+
+    def remember(self, path, entry):
+        """
+        Purpose: Cache the entry found at path
+        path: String full path of the entry, using mountpoint as /
+        entry: gdata List Entry object
+        """
+        if path.startswith('/'):
+            with self.entries_lock:
+                self.entries[path] = entry
+
+    def revision(self, path):
+        """
+        Purpose: Remote revision of the cached entry at path, without
+                 asking Google
+        path: String full path of the file
+        Returns: String update time of the entry, or None if unknown
+        """
+        entry = self._cached(path)
+        if entry is None or entry.updated is None:
+            return None
+        return entry.updated.text
+
+    def size(self, path):
+        """
+        Purpose: Size Google Docs reports for the cached entry at path,
+                 without asking Google
+        path: String full path of the file
+        Returns: Int bytes, or None if unknown (always for native
+                 documents, whose exports have no size until made)
+        """
+        entry = self._cached(path)
+        if entry is None:
+            return None
+        return gSync.entry_size(entry)
+
+    def _cached(self, path):
+        """
+        Purpose: Entry at path from the path cache or the folder tree
+        Returns: gdata List Entry object, or None
+        """
+        entry = self.entries.get(path)
+        if entry is None and self.tree.loaded:
+            entry = self.tree.lookup(path)
+        return entry
+
+    def forget(self, path):
+        """
+        Purpose: Drop the cached entries of path and of anything below it
+        path: String full path that was renamed or removed
+        """
+        prefix = path.rstrip('/') + '/'
+        with self.entries_lock:
+            self.entries.pop(path, None)
+            for p in [p for p in self.entries if p.startswith(prefix)]:
+                del self.entries[p]
+
+    def _find_filename(self, path, showfolders):
+        """
+        Purpose: Query Google for the entry at path, see get_filename
+        Returns: The gdata List Entry object or None if none exists
+        """
         name = os.path.basename(path)
         title = os.path.splitext(name)[0]
         pe = path.split('/')
@@ -117,16 +244,20 @@ class GNet(object):
         else:
             file = self.get_filename(path)
         self.gd_client.Delete(file.GetEditLink().href)
+        self.forget(path)
+        self.tree.discard(path)
 
-    def upload_file(self, path):
+    def upload_file(self, path, remote_path=None):
         """
         Purpose: Uploads a file to Google Docs
         path: String containing path of the file to be uploaded
+        remote_path: String path the new entry is cached under, using
+                     mountpoint as /
         """
         mime = gdata.docs.service.SUPPORTED_FILETYPES[path[-3:].upper()]
         filename = os.path.basename(path)
         title = filename[:-4]
-        dir = os.path.dirname(path)
+        dir = os.path.dirname(path if remote_path is None else remote_path)
         
         media = MediaSource(file_path = path.encode(self.codec), content_type = mime)
 
@@ -139,14 +270,22 @@ class GNet(object):
 
         if dir != '/':
             type = entry.GetDocumentType()
-            entry_to = self.get_filename(os.path.basename(dir), showfolders = 'true')
+            if remote_path is None:
+                entry_to = self.get_filename(os.path.basename(dir), showfolders = 'true')
+            else:
+                entry_to = self.get_filename(dir, showfolders = 'true')
 
             if type == 'document':
-                self.gd_client.MoveDocumentIntoFolder(entry, entry_to)
+                entry = self.gd_client.MoveDocumentIntoFolder(entry, entry_to)
             elif type == 'spreadsheet':
-                self.gd_client.MoveSpreadsheetIntoFolder(entry, entry_to)
+                entry = self.gd_client.MoveSpreadsheetIntoFolder(entry, entry_to)
             elif type == 'presentation':
-                self.gd_client.MovePresentationIntoFolder(entry, entry_to)
+                entry = self.gd_client.MovePresentationIntoFolder(entry, entry_to)
+
+        if entry is not None and remote_path is not None:
+            self.remember(remote_path, entry)
+            if self.tree.loaded:
+                self.tree.put(entry)
 
     def create_dir(self, path):
         """
@@ -185,15 +324,8 @@ class GNet(object):
 
         filetype = doc.GetDocumentType()
         if filetype == 'spreadsheet':
-            import gdata.spreadsheet.service
-
-            spreadsheets_client = gdata.spreadsheet.service.SpreadsheetsService()
-            spreadsheets_client.ClientLogin(self.gd_client.email, self.gd_client.password)
-            # substitute the spreadsheets token into our gd_client
-            docs_auth_token = self.gd_client.GetClientLoginToken()
-            self.gd_client.SetClientLoginToken(spreadsheets_client.GetClientLoginToken())
-            self.gd_client.Export(doc.resourceId.text, tmp_path.encode(self.codec))
-            self.gd_client.SetClientLoginToken(docs_auth_token)
+            # Spreadsheets take a token of their own, passed with the request
+            self._export(doc.resourceId.text, tmp_path, 'wise')
 
         else:
 
@@ -203,6 +335,54 @@ class GNet(object):
 
         return open(tmp_path.encode(self.codec), flags)
 
+    def _spreadsheets_service(self):
+        """
+        Purpose: Client to log in to the spreadsheets service with
+        Returns: A gdata.spreadsheet.service.SpreadsheetsService
+        """
+        import gdata.spreadsheet.service
+
+        client = gdata.spreadsheet.service.SpreadsheetsService()
+        client.http_client = self.gd_client.http_client
+        return client
+
+    def _export(self, resource_id, tmp_path, service):
+        """
+        Purpose: Download a document in the format given by the extension
+                 of tmp_path, authorised with the cached token of service
+        resource_id: String resource id of the document
+        tmp_path: String path to save the file to
+        service: String name of the service the token is for
+        """
+        url = self.gd_client._MakeContentLinkFromId(resource_id)
+        ext = os.path.splitext(tmp_path)[1][1:]
+        if len(ext) >= 3:
+            url += '&exportFormat=%s' % ext
+
+        for attempt in range(2):
+            token = self.tokens.get(service)
+            response = token.perform_request(self.gd_client.http_client, 'GET', url)
+            body = response.read()
+            redirects = 5
+            while response.status == 302 and redirects > 0:
+                response = token.perform_request(self.gd_client.http_client, 'GET',
+                                                 response.getheader('Location'))
+                body = response.read()
+                redirects -= 1
+            if response.status in (401, 403) and attempt == 0:
+                # Logged out early; log in again once
+                self.tokens.invalidate(service, token)
+                continue
+            break
+
+        if response.status != 200:
+            raise gdata.service.RequestError({'status': response.status,
+                                              'reason': response.reason,
+                                              'body': body})
+        f = open(tmp_path.encode(self.codec), 'wb')
+        f.write(body)
+        f.close()
+
     def update_file_contents(self, path, tmp_path):
         """
         Purpose: Update the contents of the file specified by path
@@ -211,7 +391,9 @@ class GNet(object):
         mime = gdata.docs.service.SUPPORTED_FILETYPES[path[-3:].upper()]
         ms = gdata.MediaSource(file_path = tmp_path.encode(self.codec), content_type = mime)
         entry = self.get_filename(path)
-        self.gd_client.Put(data = entry, uri = entry.GetEditMediaLink().href, media_source = ms)
+        entry = self.gd_client.Put(data = entry, uri = entry.GetEditMediaLink().href, media_source = ms)
+        if entry is not None:
+            self.remember(path, entry)
 
     def make_folder(self, path):
         """
@@ -219,10 +401,14 @@ class GNet(object):
         path: String containing path to folder to create
         """
         if os.path.dirname(path) == '/':
-            self.gd_client.CreateFolder(os.path.basename(path).encode(self.codec))
+            entry = self.gd_client.CreateFolder(os.path.basename(path).encode(self.codec))
         else:
             parent_dir = self.get_filename(os.path.dirname(path), showfolders = 'true')
-            self.gd_client.CreateFolder(os.path.basename(path).encode(self.codec), parent_dir)
+            entry = self.gd_client.CreateFolder(os.path.basename(path).encode(self.codec), parent_dir)
+        if entry is not None:
+            self.remember(path, entry)
+            if self.tree.loaded:
+                self.tree.put(entry)
             
     def move_file(self, pathfrom, pathto):
         """
@@ -241,6 +427,7 @@ class GNet(object):
                 if entry.title.text == namefrom[:-4]:
                     entry_from = entry
             self.gd_client.MoveOutOfFolder(entry_from)
+            self.forget(pathfrom)
         
         entry_from = self.get_filename(pathfrom, showfolders = 'true')
             
@@ -257,7 +444,11 @@ class GNet(object):
         
         if os.path.basename(pathfrom) != os.path.basename(pathto):
             entry_from = self.rename_file(entry_from, os.path.basename(pathto))
-        
+
+        # The edit links of a moved entry and its contents change
+        self.forget(pathfrom)
+        self.forget(pathto)
+        self.tree.discard(pathfrom)
         return 0
     
     def rename_file(self, entry, name_to):
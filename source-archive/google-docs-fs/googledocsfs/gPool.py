@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gPool.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+#
+#   atom.http opens a new connection, and so a new TLS handshake, for
+#   every request. PooledHttpClient hands out kept-alive connections
+#   instead and takes them back once their response has been read.
+
+import os
+import socket
+import threading
+import time
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+import atom.http
+
+
+class PooledConnection(object):
+    """
+    A pooled HTTP(S) connection. atom.http drives it like a plain
+    connection; the response it returns gives the connection back to
+    the pool once it has been read to the end.
+    """
+
+    def __init__(self, pool, key, conn):
+        self.__dict__.update(pool=pool, key=key, conn=conn, uses=0,
+                             created=time.time(), released=True, checkout=0)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            setattr(self.conn, name, value)
+
+    def getresponse(self):
+        """
+        Purpose: Read the response status and headers
+        Returns: A response that releases the connection when finished
+        """
+        checkout = self.checkout
+        try:
+            response = self.conn.getresponse()
+        except Exception:
+            self.pool.release(self, False, checkout)
+            raise
+        self.__dict__['uses'] += 1
+        return _Response(response, self, checkout)
+
+
+class _Response(object):
+    """
+    Response wrapper returning its connection to the pool once the body
+    has been read or the response is closed. It does so only once, and
+    only for the checkout it was read on.
+    """
+
+    def __init__(self, response, connection, checkout):
+        self.response = response
+        self.connection = connection
+        self.checkout = checkout
+        self.finished = False
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def read(self, amt=None):
+        try:
+            data = self.response.read() if amt is None else self.response.read(amt)
+        except Exception:
+            self._release(False)
+            raise
+        if amt is None or not data or self.response.isclosed():
+            self._finish()
+        return data
+
+    def close(self):
+        self.response.close()
+        self._finish()
+
+    def _finish(self):
+        finished = self.response.isclosed() or self.response.length == 0
+        self._release(finished and not self.response.will_close)
+
+    def _release(self, reusable):
+        if self.finished:
+            return
+        self.finished = True
+        self.connection.pool.release(self.connection, reusable, self.checkout)
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive connections shared by every thread, at most size of them
+    open at once. Threads asking for more wait for one to be released.
+    """
+
+    def __init__(self, size=4, idle_timeout=60.0):
+        """
+        Purpose: Create an empty pool
+        size: Int maximum number of connections in use or idle
+        idle_timeout: Float seconds after which an idle connection is
+                      closed rather than reused
+        Returns: Nothing
+        """
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.live = set()
+        self.created = 0
+        self.reused = 0
+        self.retired = 0
+
+    def checkout(self, key, factory):
+        """
+        Purpose: Take an idle connection to key, or open a new one
+        key: Hashable (protocol, host, port) Tuple
+        factory: Function opening a new connection to key
+        Returns: PooledConnection
+        """
+        self.slots.acquire()
+        try:
+            now = time.time()
+            with self.lock:
+                idle = self.idle.get(key)
+                while idle:
+                    pc, since = idle.pop()
+                    if now - since < self.idle_timeout:
+                        pc.released = False
+                        pc.checkout += 1
+                        self.reused += 1
+                        return pc
+                    self._close(pc)
+                # Make room by closing an idle connection to another host
+                if len(self.live) >= self.size:
+                    for other in self.idle.values():
+                        if other:
+                            self._close(other.pop(0)[0])
+                            break
+            pc = PooledConnection(self, key, factory())
+            pc.released = False
+            pc.checkout = 1
+            with self.lock:
+                self.live.add(pc)
+                self.created += 1
+            return pc
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, pc, reusable=True, checkout=None):
+        """
+        Purpose: Give a connection back, keeping it open if it can be
+                 reused
+        pc: PooledConnection from checkout
+        reusable: Boolean, False if the connection is in an unknown state
+        checkout: Int pc.checkout when it was handed out, so a late
+                  release cannot give back a later checkout; None for
+                  the current one
+        """
+        with self.lock:
+            if pc.released or checkout is not None and checkout != pc.checkout:
+                return
+            pc.released = True
+            if reusable:
+                self.idle.setdefault(pc.key, []).append((pc, time.time()))
+            else:
+                self._close(pc)
+        self.slots.release()
+
+    def _close(self, pc):
+        """
+        Purpose: Close a connection for good. Call with lock held.
+        """
+        self.live.discard(pc)
+        self.retired += 1
+        try:
+            pc.conn.close()
+        except Exception:
+            pass
+
+    def clear(self):
+        """
+        Purpose: Close every idle connection
+        """
+        with self.lock:
+            for idle in self.idle.values():
+                for pc, since in idle:
+                    self._close(pc)
+            self.idle.clear()
+
+    def stats(self):
+        """
+        Purpose: Report how well connections are being reused
+        Returns: Dict with the number of connections created, reused and
+                 closed, and a List of (key, requests served) per open
+                 connection
+        """
+        with self.lock:
+            return {'created': self.created, 'reused': self.reused, 'retired': self.retired,
+                    'connections': sorted((pc.key, pc.uses) for pc in self.live)}
+
+
+class PooledHttpClient(atom.http.ProxiedHttpClient):
+    """
+    atom.http client drawing its connections from a ConnectionPool.
+    Requests through a proxy keep using a connection of their own.
+    """
+
+    def __init__(self, pool, headers=None):
+        atom.http.ProxiedHttpClient.__init__(self, headers)
+        self.pool = pool
+        self.local = threading.local()
+
+    def _prepare_connection(self, url, headers):
+        proxied = atom.http.ProxiedHttpClient._prepare_connection
+        if url.protocol == 'https' and 'https_proxy' in _proxies() or \
+                url.protocol == 'http' and 'http_proxy' in _proxies():
+            self.local.connection = None
+            return proxied(self, url, headers)
+        key = (url.protocol, url.host, url.port)
+        pc = self.pool.checkout(key, lambda: proxied(self, url, headers))
+        self.local.connection = pc
+        self.local.checkout = pc.checkout
+        return pc
+
+    def request(self, operation, url, data=None, headers=None):
+        """
+        Purpose: Send a request, retrying once on a fresh connection if a
+                 kept-alive one turns out to have been closed by the server
+        """
+        try:
+            return atom.http.ProxiedHttpClient.request(self, operation, url, data, headers)
+        except (httplib.HTTPException, socket.error):
+            pc = getattr(self.local, 'connection', None)
+            if pc is None:
+                raise
+            self.pool.release(pc, False, self.local.checkout)
+            # Only a reused connection can be stale, and a stream body
+            # cannot be sent twice
+            if pc.uses == 0 or not (data is None or isinstance(data, (bytes, type(u'')))):
+                raise
+            return atom.http.ProxiedHttpClient.request(self, operation, url, data, headers)
+
+
+def _proxies():
+    """
+    Purpose: Names of the proxy variables set in the environment
+    """
+    return set(k.lower() for k in os.environ if k.lower() in ('http_proxy', 'https_proxy'))
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gQuery.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import heapq
+
+import gExpr
+from gBitmap import RoaringBitmap
+from gIndex import intersect, normalise_labels
+
+# Sort orders a Cursor can stream in
+ORDERS = ('mtime', '-mtime', 'id')
+
+# A label-driven stream sorts its candidates in memory only while the
+# smallest candidate bitmap is at most this large
+MATERIALIZE_MAX = 65536
+
+
+class Predicate(object):
+    """
+    Label and time predicate restricted to a directory subtree
+    """
+
+    def __init__(self, path='/', labels=None, min_time=None, max_time=None, expr=None):
+        """
+        Purpose: Describe a query
+        path: String directory the matches must be under ('/' for all)
+        labels: Labels every match must carry (list, String or None)
+        min_time: Lower mtime bound or None
+        max_time: Upper mtime bound or None
+        expr: Boolean label expression (String, see gExpr) every match
+              must satisfy as well, or None
+        Returns: Nothing
+        """
+        self.path = path
+        self.labels = normalise_labels(labels)
+        self.min_time = None if min_time is None else float(min_time)
+        self.max_time = None if max_time is None else float(max_time)
+        self.expr = gExpr.parse(expr) if isinstance(expr, (str, type(u''))) else expr
+
+    def __repr__(self):
+        return 'Predicate(%r, %r, %r, %r, %r)' % (self.path, self.labels, self.min_time, self.max_time, self.expr)
+
+    def scope(self, fs):
+        """
+        Purpose: Bitmap of the ids allowed by the path and the label
+                 expression, before the labels and time bounds apply
+        fs: GFile whose indexes answer the query
+        Returns: A RoaringBitmap, or None if every id is allowed
+        """
+        wanted = set(self.labels)
+        if self.expr is not None:
+            wanted.update(gExpr.required(self.expr))
+        if wanted and not fs.tree.might_contain(self.path, sorted(wanted)):
+            # The directory's label filter rules out every file below it
+            return RoaringBitmap()
+        scope = None
+        if self.path != '/':
+            scope = fs.tree.subtree(self.path)
+        if self.expr is not None and (scope is None or scope):
+            matches = gExpr.evaluate(self.expr, fs.label_index)
+            scope = matches if scope is None else matches & scope
+        return scope
+
+    def timed(self):
+        """
+        Purpose: Whether the predicate bounds the mtime at all
+        Returns: Boolean
+        """
+        return self.min_time is not None or self.max_time is not None
+
+    def in_time(self, mtime):
+        """
+        Purpose: Test mtime against the time bounds
+        Returns: Boolean
+        """
+        if mtime is None:
+            return not self.timed()
+        if self.min_time is not None and mtime < self.min_time:
+            return False
+        if self.max_time is not None and mtime > self.max_time:
+            return False
+        return True
+
+
+def encode_token(order, mtime, fid):
+    """
+    Purpose: Build the continuation token for a position in a stream
+    Returns: String token
+    """
+    if order == 'id':
+        return 'id:%d' % fid
+    return '%s:%r:%d' % (order, mtime, fid)
+
+
+def decode_token(order, token):
+    """
+    Purpose: Parse a continuation token produced by encode_token
+    order: String sort order the token must belong to
+    token: String token
+    Returns: (mtime, fid) Tuple to resume after
+    """
+    parts = token.rsplit(':', 2) if order != 'id' else token.split(':', 1)
+    if parts[0] != order:
+        raise ValueError('token %r does not belong to a %r query' % (token, order))
+    if order == 'id':
+        return None, int(parts[1])
+    return float(parts[1]), int(parts[2])
+
+
+class Cursor(object):
+    """
+    Lazily evaluated, resumable stream of the files matching a Predicate.
+    Iterating yields (path, GStat) pairs; afterwards token holds the
+    continuation for the next page, or None once the stream is exhausted.
+    """
+
+    def __init__(self, fs, predicate, order='mtime', limit=None, offset=0, token=None):
+        """
+        Purpose: Prepare a query without running it
+        fs: GFile whose indexes answer the query
+        predicate: Predicate to match
+        order: 'mtime', '-mtime' or 'id'
+        limit: Int maximum number of matches to yield, None for all
+        offset: Int number of matches to skip first
+        token: String continuation token from a previous page
+        Returns: Nothing
+        """
+        if order not in ORDERS:
+            raise ValueError('order must be one of %s' % (ORDERS,))
+        self.fs = fs
+        self.predicate = predicate
+        self.order = order
+        self.limit = limit
+        self.offset = offset
+        self.after = None if token is None else decode_token(order, token)
+        self.token = token
+
+    def _bitmaps(self):
+        """
+        Purpose: Candidate bitmaps of the predicate, rarest first
+        Returns: A List of bitmaps, or None if nothing can match
+        """
+        scope = self.predicate.scope(self.fs)
+        return self.fs.planner.candidates(self.predicate.labels, scope)
+
+    def _entries(self, fids, reverse):
+        """
+        Purpose: Pair candidate ids with their mtime, dropping the ones
+                 outside the time bounds or before the resume position
+        fids: Iterable of candidate file ids
+        reverse: Boolean, the stream runs in descending order
+        Returns: Generator of (mtime, fid) Tuples
+        """
+        p = self.predicate
+        mtime = self.fs.time_index.mtime
+        for fid in fids:
+            entry = (mtime(fid), fid)
+            if entry[0] is None or not p.in_time(entry[0]):
+                continue
+            if self.after is not None and (entry <= self.after if not reverse else entry >= self.after):
+                continue
+            yield entry
+
+    def _by_time(self, bitmaps):
+        """
+        Purpose: Stream matches in (mtime, id) order
+        Returns: Generator of (mtime, fid) Tuples
+        """
+        p = self.predicate
+        reverse = self.order == '-mtime'
+        time_index = self.fs.time_index
+        if bitmaps and len(bitmaps[0]) <= MATERIALIZE_MAX \
+                and len(bitmaps[0]) < time_index.count(p.min_time, p.max_time):
+            # Few candidates: sorting them beats walking the time range
+            entries = self._entries(intersect(bitmaps), reverse)
+            if self.limit is not None:
+                # Only the first offset + limit matches are ever yielded,
+                # so keep them in a bounded heap instead of sorting all.
+                # One more is kept so a full page still leaves a token.
+                pick = heapq.nlargest if reverse else heapq.nsmallest
+                entries = pick(self.offset + self.limit + 1, entries)
+            else:
+                entries = sorted(entries, reverse=reverse)
+            for entry in entries:
+                yield entry
+        else:
+            for mtime, fid in time_index.scan(p.min_time, p.max_time, self.after, reverse):
+                if all(fid in bitmap for bitmap in bitmaps):
+                    yield mtime, fid
+
+    def _by_id(self, bitmaps):
+        """
+        Purpose: Stream matches in id order straight off the bitmaps
+        Returns: Generator of (mtime, fid) Tuples
+        """
+        drive = bitmaps[0] if bitmaps else self.fs.label_index.all
+        rest = bitmaps[1:]
+        start = 0 if self.after is None else self.after[1] + 1
+        mtime = self.fs.time_index.mtime
+        for fid in drive.iter_from(start):
+            if all(fid in bitmap for bitmap in rest):
+                t = mtime(fid)
+                if self.predicate.in_time(t):
+                    yield t, fid
+
+    def __iter__(self):
+        bitmaps = self._bitmaps()
+        if bitmaps is None:
+            self.token = None
+            return
+        stream = self._by_id(bitmaps) if self.order == 'id' else self._by_time(bitmaps)
+        skip = self.offset
+        n = 0
+        for mtime, fid in stream:
+            path = self.fs.ids.path(fid)
+            st = self.fs.files.get(path) if path is not None else None
+            if st is None:
+                continue
+            if skip > 0:
+                skip -= 1
+                continue
+            if self.limit is not None and n >= self.limit:
+                return
+            self.token = encode_token(self.order, mtime, fid)
+            yield path, st
+            n += 1
+        self.token = None
+
+    def fetch(self):
+        """
+        Purpose: Run the query and collect the page
+        Returns: A List of (path, GStat) Tuples
+        """
+        return list(self)
+
+
+def count(fs, predicate):
+    """
+    Purpose: Count the files matching predicate from index cardinalities,
+             without building a result set
+    fs: GFile whose indexes answer the query
+    predicate: Predicate to match
+    Returns: Int number of matches
+    """
+    scope = predicate.scope(fs)
+    return fs.planner.count(predicate.labels, predicate.min_time, predicate.max_time, scope)
+
+
+def top_k(fs, predicate, k, order_by='-mtime'):
+    """
+    Purpose: Find the k newest (or oldest) files matching predicate.
+             Wide predicates walk the time index from the right end and
+             stop after k matches; narrow ones keep a k-sized heap over
+             their candidates.
+    fs: GFile whose indexes answer the query
+    predicate: Predicate to match
+    k: Int number of matches wanted
+    order_by: '-mtime' for the newest first, 'mtime' for the oldest
+              first, as for Cursor
+    Returns: A List of at most k (path, GStat) Tuples
+    """
+    if order_by not in ('mtime', '-mtime'):
+        raise ValueError("order_by must be 'mtime' or '-mtime'")
+    if k <= 0:
+        return []
+    return Cursor(fs, predicate, order_by, limit=k).fetch()
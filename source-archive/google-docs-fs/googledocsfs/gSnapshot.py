@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gSnapshot.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+#
+#   Snapshot layout: an 8 byte magic, a small header and a table of
+#   (tag, offset, length) sections. Per-file metadata lives in the RECS
+#   section as fixed size records indexed by file id, so one record can
+#   be read straight out of the mapping when its GStat is first needed.
+#   Bitmaps, sorted arrays and Bloom counters are stored in their
+#   in-memory layout and only copied back on load. Names are joined with
+#   NUL bytes, which paths and labels cannot contain.
+
+import heapq
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from gBitmap import RoaringBitmap, array_bytes, array_from, byte_view
+from gIndex import FileIds, LabelIndex, TimeIndex
+from gTree import DirTree, DirNode
+
+MAGIC = b'GDFSSNP1'
+HEADER = struct.Struct('<BBHI')
+SECTION = struct.Struct('<4sQQ')
+
+# mtime, ctime, atime, receiveTime, freshness_per, shelf_life, size,
+# mode, nlink, service type code, parent code, label pool offset,
+# label count, live flag, padding
+RECORD = struct.Struct('<6dq2I2i4I')
+RECORD_DTYPE = [('mtime', '<f8'), ('ctime', '<f8'), ('atime', '<f8'), ('receive', '<f8'),
+                ('freshness_per', '<f8'), ('shelf_life', '<f8'), ('size', '<i8'),
+                ('mode', '<u4'), ('nlink', '<u4'), ('service_type', '<i4'), ('parent', '<i4'),
+                ('lab_off', '<u4'), ('lab_n', '<u4'), ('live', '<u4'), ('pad', '<u4')]
+
+_LITTLE = 1 if sys.byteorder == 'little' else 0
+
+
+def _encode(name):
+    return name.encode('utf-8') if isinstance(name, type(u'')) else name
+
+
+def _join(names):
+    """
+    Purpose: Serialise a list of Strings as a count and a NUL joined blob
+    Returns: Bytes
+    """
+    blob = b'\0'.join(_encode(name) for name in names)
+    return struct.pack('<IQ', len(names), len(blob)) + blob
+
+
+def _split(buf, offset):
+    """
+    Purpose: Inverse of _join
+    Returns: Tuple (List of Strings, Int offset just past them)
+    """
+    n, size = struct.unpack_from('<IQ', buf, offset)
+    offset += 12
+    if n == 0:
+        return [], offset
+    names = buf[offset:offset + size].decode('utf-8').split(u'\0')
+    return names, offset + size
+
+
+def _sized(data):
+    return struct.pack('<Q', len(data)) + data
+
+
+def _read_sized(buf, offset):
+    size, = struct.unpack_from('<Q', buf, offset)
+    offset += 8
+    return byte_view(buf, offset, size), offset + size
+
+
+def _read_name(buf, offset):
+    size, = struct.unpack_from('<Q', buf, offset)
+    offset += 8
+    return buf[offset:offset + size].decode('utf-8'), offset + size
+
+
+class _Codes(object):
+    """
+    Assigns dense codes to Strings while a snapshot is written
+    """
+
+    def __init__(self, names=()):
+        self.codes = {}
+        self.names = []
+        for name in names:
+            self.encode(name)
+
+    def encode(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+def save(path, ids, files, label_index, time_index, tree, directories, dirty=({}, {})):
+    """
+    Purpose: Write the metadata table and the indexes to a snapshot.
+             The file is written next to path and renamed over it, so a
+             reader mapping the old snapshot is not disturbed.
+    path: String file name of the snapshot
+    ids: FileIds
+    files: StatTable of GStats
+    label_index: LabelIndex
+    time_index: TimeIndex
+    tree: DirTree
+    directories: Dict of directory listings
+    dirty: Tuple of the paths waiting for their first upload and of
+           the paths with unsent changes
+    Returns: Int number of bytes written
+    """
+    with ids.lock, label_index.lock, time_index.lock, tree.lock:
+        labels = _Codes(sorted(label_index.postings))
+        services = _Codes()
+        parents = _Codes()
+        assigned = label_index.assigned
+        labels_of = assigned.peek if isinstance(assigned, _Backed) else assigned.get
+        records = bytearray(RECORD.size * len(ids.paths))
+        pool = array('I')
+        for fid, fpath in enumerate(ids.paths):
+            st = files.peek(fpath) if fpath is not None else None
+            if st is None:
+                continue
+            off = len(pool)
+            for label in labels_of(fid, ()):
+                pool.append(labels.encode(label))
+            RECORD.pack_into(records, fid * RECORD.size,
+                             float(st.st_mtime), float(st.st_ctime), float(st.st_atime),
+                             float(st.receiveTime), float(st.freshness_per), float(st.shelf_life),
+                             int(st.st_size), st.st_mode, st.st_nlink,
+                             services.encode(st.service_type),
+                             parents.encode(os.path.dirname(fpath)),
+                             off, len(pool) - off, 1, 0)
+
+        postings = [label_index.postings[label].dump() if label in label_index.postings
+                    else RoaringBitmap().dump() for label in labels.names]
+
+        nodes = sorted(tree.nodes.values(), key=lambda node: (node.path.count('/'), node.path))
+        tree_parts = [struct.pack('<II', len(nodes), tree.bloom_size)]
+        for node in nodes:
+            tree_parts.append(_sized(_encode(node.path)))
+            tree_parts.append(node.files.dump())
+            tree_parts.append(node.subtree.dump())
+            tree_parts.append(array_bytes(node.labels.counts))
+
+        dir_parts = [struct.pack('<I', len(directories))]
+        for dpath, names in directories.items():
+            dir_parts.append(_sized(_encode(dpath)))
+            dir_parts.append(_join(names))
+
+        sections = [
+            (b'PATH', _join([p if p is not None else u'' for p in ids.paths])),
+            (b'FREE', array_bytes(array('I', ids.free))),
+            (b'RECS', bytes(records)),
+            (b'LBLS', _join(labels.names)),
+            (b'SVCS', _join(services.names)),
+            (b'PRNT', _join(parents.names)),
+            (b'POOL', array_bytes(pool)),
+            (b'POST', b''.join(postings)),
+            (b'ALL ', label_index.all.dump()),
+            (b'TIME', _sized(array_bytes(time_index.times)) + _sized(array_bytes(time_index.ids))
+             + _sized(array_bytes(time_index.mtimes))),
+            (b'TREE', b''.join(tree_parts)),
+            (b'DIRS', b''.join(dir_parts)),
+            (b'DRTY', _join(list(dirty[0])) + _join(list(dirty[1]))),
+        ]
+
+    offset = len(MAGIC) + HEADER.size + SECTION.size * len(sections)
+    table = []
+    for tag, data in sections:
+        table.append(SECTION.pack(tag, offset, len(data)))
+        offset += len(data)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(MAGIC)
+        fh.write(HEADER.pack(_LITTLE, array('l').itemsize, 0, len(sections)))
+        for entry in table:
+            fh.write(entry)
+        for tag, data in sections:
+            fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.rename(tmp, path)
+    return offset
+
+
+class Snapshot(object):
+    """
+    Read-only view of a snapshot file through mmap
+    """
+
+    def __init__(self, path):
+        """
+        Purpose: Map a snapshot and read its section table
+        path: String file name of the snapshot
+        Returns: Nothing, raises ValueError if the file is not a usable
+                 snapshot for this machine
+        """
+        with open(path, 'rb') as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a metadata snapshot' % path)
+        little, long_size, _, n = HEADER.unpack_from(self.mm, len(MAGIC))
+        if little != _LITTLE or long_size != array('l').itemsize:
+            raise ValueError('%s was written on an incompatible machine' % path)
+        self.sections = {}
+        offset = len(MAGIC) + HEADER.size
+        for _ in range(n):
+            tag, start, size = SECTION.unpack_from(self.mm, offset)
+            self.sections[tag] = (start, size)
+            offset += SECTION.size
+        self.label_names, _ = _split(self.mm, self.sections[b'LBLS'][0])
+        self.service_names, _ = _split(self.mm, self.sections[b'SVCS'][0])
+        self.parent_names, _ = _split(self.mm, self.sections[b'PRNT'][0])
+        self.size = self.sections[b'RECS'][1] // RECORD.size
+
+    def close(self):
+        self.mm.close()
+
+    def _section(self, tag):
+        start, size = self.sections[tag]
+        return byte_view(self.mm, start, size)
+
+    def record(self, fid):
+        """
+        Purpose: Read the metadata record of fid
+        Returns: Tuple of the RECORD fields
+        """
+        return RECORD.unpack_from(self.mm, self.sections[b'RECS'][0] + fid * RECORD.size)
+
+    def live_flags(self):
+        """
+        Purpose: Read the live flag of every record in one strided copy
+        Returns: bytearray with a 1 for each id holding a file
+        """
+        start, size = self.sections[b'RECS']
+        return bytearray(self.mm[start + RECORD.size - 8:start + size:RECORD.size])
+
+    def labels(self, fid):
+        """
+        Purpose: Labels fid was indexed under
+        Returns: Tuple of label Strings
+        """
+        rec = self.record(fid)
+        off, n = rec[11], rec[12]
+        codes = struct.unpack_from('<%dI' % n, self.mm, self.sections[b'POOL'][0] + 4 * off)
+        return tuple(self.label_names[code] for code in codes)
+
+    def stat(self, fid, factory):
+        """
+        Purpose: Build the GStat of fid from its record
+        factory: Function returning a fresh GStat
+        Returns: The GStat
+        """
+        rec = self.record(fid)
+        st = factory()
+        st.st_mtime, st.st_ctime, st.st_atime, st.receiveTime = rec[0:4]
+        st.freshness_per, st.shelf_life, st.st_size, st.st_mode, st.st_nlink = rec[4:9]
+        st.service_type = self.service_names[rec[9]]
+        st.labels = list(self.labels(fid))
+        return st
+
+    def file_ids(self):
+        """
+        Purpose: Rebuild the path <-> id mapping
+        Returns: A FileIds
+        """
+        ids = FileIds()
+        paths, _ = _split(self.mm, self.sections[b'PATH'][0])
+        ids.free = list(array_from('I', self._section(b'FREE')))
+        heapq.heapify(ids.free)
+        for fid in ids.free:
+            paths[fid] = None
+        ids.paths = paths
+        ids.ids = dict(zip(paths, range(len(paths))))
+        ids.ids.pop(None, None)
+        return ids
+
+    def label_index(self):
+        """
+        Purpose: Rebuild the label index. Postings are copied out of the
+                 mapping; the labels of each file are only decoded when
+                 the file is next touched.
+        Returns: A LabelIndex
+        """
+        index = LabelIndex()
+        start = self.sections[b'POST'][0]
+        for label in self.label_names:
+            posting, start = RoaringBitmap.load(self.mm, start)
+            if posting:
+                index.postings[label] = posting
+        index.all, _ = RoaringBitmap.load(self.mm, self.sections[b'ALL '][0])
+        index.assigned = LazyLabels(self)
+        return index
+
+    def time_index(self):
+        """
+        Purpose: Rebuild the time index by copying its arrays
+        Returns: A TimeIndex
+        """
+        index = TimeIndex()
+        buf = self.mm
+        times, offset = _read_sized(buf, self.sections[b'TIME'][0])
+        fids, offset = _read_sized(buf, offset)
+        mtimes, offset = _read_sized(buf, offset)
+        index.times = array_from('d', times)
+        index.ids = array_from('l', fids)
+        index.mtimes = array_from('d', mtimes)
+        return index
+
+    def tree(self):
+        """
+        Purpose: Rebuild the directory tree with its bitmaps and filters
+        Returns: A DirTree
+        """
+        buf = self.mm
+        offset = self.sections[b'TREE'][0]
+        n, bloom_size = struct.unpack_from('<II', buf, offset)
+        offset += 8
+        tree = DirTree(bloom_size)
+        for _ in range(n):
+            path, offset = _read_name(buf, offset)
+            node = tree.nodes.get(path)
+            if node is None:
+                node = DirNode(path, tree.nodes[os.path.dirname(path)], bloom_size)
+                node.parent.children[os.path.basename(path)] = node
+                tree.nodes[path] = node
+            node.files, offset = RoaringBitmap.load(buf, offset)
+            node.subtree, offset = RoaringBitmap.load(buf, offset)
+            node.labels.counts = array_from('H', byte_view(buf, offset, 2 * bloom_size))
+            offset += 2 * bloom_size
+        return tree
+
+    def directories(self):
+        """
+        Purpose: Rebuild the directory listings
+        Returns: A Dict mapping directory paths to Lists of names
+        """
+        buf = self.mm
+        offset = self.sections[b'DIRS'][0]
+        n, = struct.unpack_from('<I', buf, offset)
+        offset += 4
+        directories = {}
+        for _ in range(n):
+            path, offset = _read_name(buf, offset)
+            directories[path], offset = _split(buf, offset)
+        return directories
+
+    def dirty(self):
+        """
+        Purpose: Read back the pending upload state
+        Returns: Tuple of two Lists of paths: waiting for their first
+                 upload, and with unsent changes
+        """
+        if b'DRTY' not in self.sections:
+            return [], []
+        to_upload, offset = _split(self.mm, self.sections[b'DRTY'][0])
+        written, offset = _split(self.mm, offset)
+        return to_upload, written
+
+    def fill_columns(self, table):
+        """
+        Purpose: Load the records into a ColumnTable in bulk
+        table: Empty gTable.ColumnTable
+        """
+        import numpy
+        records = numpy.frombuffer(self.mm, dtype=RECORD_DTYPE, count=self.size,
+                                   offset=self.sections[b'RECS'][0])
+        with table.lock:
+            table._reserve(max(0, self.size - 1))
+            for name in ('mtime', 'ctime', 'atime', 'size', 'mode', 'freshness_per',
+                         'shelf_life', 'service_type', 'parent'):
+                getattr(table, name)[:self.size] = records[name]
+            table.live[:self.size] = records['live'] != 0
+            for name in self.service_names:
+                table.service_types.encode(name)
+            for name in self.parent_names:
+                table.parents.encode(name)
+            table.size_hint = self.size
+
+
+class _Backed(dict):
+    """
+    Dict whose missing entries may still be waiting in a snapshot. They
+    are read out of it the first time they are looked up. Subclasses
+    map keys to slots with _slot(key) (Int slot or None) and back with
+    _key(slot), and read an entry with _fetch(slot).
+    """
+
+    def __init__(self, snapshot=None, pending=None):
+        """
+        Purpose: Start with every entry flagged in pending unloaded
+        snapshot: Snapshot holding the entries, or None
+        pending: bytearray with a 1 for every slot still in the snapshot
+        Returns: Nothing
+        """
+        dict.__init__(self)
+        self.snapshot = snapshot
+        self.pending = pending if pending is not None else bytearray()
+        self.remaining = self.pending.count(b'\x01')
+
+    def _pending_slot(self, key):
+        slot = self._slot(key)
+        if slot is not None and slot < len(self.pending) and self.pending[slot]:
+            return slot
+        return None
+
+    def _take(self, slot):
+        self.pending[slot] = 0
+        self.remaining -= 1
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._pending_slot(key) is not None
+
+    def __missing__(self, key):
+        slot = self._pending_slot(key)
+        if slot is None:
+            raise KeyError(key)
+        value = self._fetch(slot)
+        self._take(slot)
+        dict.__setitem__(self, key, value)
+        self._loaded(key, slot, value)
+        return value
+
+    def _loaded(self, key, slot, value):
+        """
+        Purpose: Hook run when an entry is read out of the snapshot
+        """
+        pass
+
+    def __setitem__(self, key, value):
+        slot = self._pending_slot(key)
+        if slot is not None:
+            self._take(slot)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if not dict.__contains__(self, key):
+            self[key]
+        dict.__delitem__(self, key)
+
+    def __len__(self):
+        return dict.__len__(self) + self.remaining
+
+    def __iter__(self):
+        self.load_all()
+        return dict.__iter__(self)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        if not dict.__contains__(self, key) and self._pending_slot(key) is not None:
+            self[key]
+        return dict.pop(self, key, *default)
+
+    def peek(self, key, default=None):
+        """
+        Purpose: Read an entry without keeping it loaded
+        Returns: The value or default
+        """
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        slot = self._pending_slot(key)
+        if slot is None:
+            return default
+        return self._fetch(slot)
+
+    def load_all(self):
+        """
+        Purpose: Read every entry still waiting in the snapshot
+        """
+        if self.remaining:
+            for slot in [i for i, flag in enumerate(self.pending) if flag]:
+                key = self._key(slot)
+                if key is not None and self._pending_slot(key) == slot:
+                    self[key]
+
+    def keys(self):
+        self.load_all()
+        return dict.keys(self)
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+
+class StatTable(_Backed):
+    """
+    Path -> GStat table that builds the GStats of a snapshot lazily, so
+    a mount answers queries before any of them has been deserialised
+    """
+
+    def __init__(self, snapshot=None, ids=None, factory=None, on_load=None):
+        """
+        Purpose: Wrap the records of snapshot
+        snapshot: Snapshot, or None for a plain table
+        ids: FileIds mapping paths to the record ids
+        factory: Function returning a fresh GStat
+        on_load: Function (path, fid, GStat) run for each GStat built
+        Returns: Nothing
+        """
+        _Backed.__init__(self, snapshot, snapshot.live_flags() if snapshot is not None else None)
+        self.ids = ids
+        self.factory = factory
+        self.on_load = on_load
+
+    def _slot(self, key):
+        if self.ids is None:
+            return None
+        return self.ids.get(key)
+
+    def _key(self, slot):
+        return self.ids.path(slot)
+
+    def _fetch(self, slot):
+        return self.snapshot.stat(slot, self.factory)
+
+    def _loaded(self, key, slot, value):
+        if self.on_load is not None:
+            self.on_load(key, slot, value)
+
+
+class LazyLabels(_Backed):
+    """
+    Id -> labels map of a LabelIndex, decoded from a snapshot on demand
+    """
+
+    def __init__(self, snapshot):
+        """
+        Purpose: Wrap the label pool of snapshot
+        snapshot: Snapshot
+        Returns: Nothing
+        """
+        _Backed.__init__(self, snapshot, snapshot.live_flags())
+
+    def _slot(self, key):
+        return key
+
+    def _key(self, slot):
+        return slot
+
+    def _fetch(self, slot):
+        return self.snapshot.labels(slot)
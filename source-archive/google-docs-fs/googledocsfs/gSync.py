@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gSync.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+#
+#   The document list is fetched in full once. After that only the
+#   entries updated since the newest 'updated' time seen so far are
+#   fetched (updated-min, with showdeleted so trashed entries come
+#   along). Entries erased for good never show up in that feed, so a
+#   full listing is still taken every full_every seconds to reconcile.
+#
+#   Entries point at their folder by resource id through a parent link
+#   (older feeds only name it in a folders category), so FolderTree
+#   resolves a path by walking down from the root one child at a time.
+
+import threading
+import time
+
+try:
+    from urllib import unquote
+except ImportError:
+    from urllib.parse import unquote
+
+FOLDERS_SCHEME = 'http://schemas.google.com/docs/2007/folders/'
+PARENT = 'http://schemas.google.com/docs/2007#parent'
+TRASHED = 'http://schemas.google.com/g/2005/labels#trashed'
+GD = 'http://schemas.google.com/g/2005'
+
+
+def is_removed(entry):
+    """
+    Purpose: Tell whether a changed entry was trashed or deleted
+    entry: DocumentListEntry from the change feed
+    Returns: Boolean
+    """
+    for c in entry.category:
+        if c.term == TRASHED:
+            return True
+    for e in getattr(entry, 'extension_elements', None) or ():
+        if e.tag == 'deleted':
+            return True
+    return False
+
+
+def parent_key(entry):
+    """
+    Purpose: Identify the folder an entry is filed in
+    entry: DocumentListEntry
+    Returns: ('id', resource id) from the parent link, ('label', folder
+             name) from the folders category, or None for the root
+    """
+    for link in getattr(entry, 'link', None) or ():
+        if link.rel == PARENT and link.href:
+            return ('id', unquote(link.href.rstrip('/').rsplit('/', 1)[-1]))
+    for c in entry.category:
+        if c.scheme and c.scheme.startswith(FOLDERS_SCHEME):
+            return ('label', c.label)
+    return None
+
+
+def extension(entry):
+    """
+    Purpose: Determine the file extension for the given entry
+    entry: DocumentListEntry object to scan for filetype
+    Returns: String of length 3 with file extension (Currently only Oasis filetypes)
+    """
+    if entry.GetDocumentType() == 'document':
+        return 'doc'
+    elif entry.GetDocumentType() == 'spreadsheet':
+        return 'xls'
+    elif entry.GetDocumentType() == 'presentation':
+        return 'ppt'
+
+    # Should never reach this - used for debugging
+    return entry.GetDocumentType()
+
+
+def entry_size(entry):
+    """
+    Purpose: Size an entry takes up on Google Docs, from its
+             gd:quotaBytesUsed element
+    entry: DocumentListEntry object
+    Returns: Int bytes, or None if the feed does not say (native Google
+             documents report 0)
+    """
+    find = getattr(entry, 'FindExtensions', None)
+    if find is None:
+        return None
+    for element in find('quotaBytesUsed', GD):
+        try:
+            size = int(element.text)
+        except (TypeError, ValueError):
+            continue
+        if size > 0:
+            return size
+    return None
+
+
+def entry_name(entry, codec='utf-8'):
+    """
+    Purpose: Name an entry is listed under in its folder
+    entry: DocumentListEntry object
+    codec: String encoding of the entry's title
+    Returns: String, the title plus an extension for files
+    """
+    title = entry.title.text.decode(codec)
+    if entry.GetDocumentType() == 'folder':
+        return title
+    return "%s.%s" % (title, extension(entry))
+
+
+class FolderTree(object):
+    """
+    In-memory parent/child graph of every folder and document, keyed by
+    resource id. Paths resolve exactly in O(depth) dict lookups.
+    """
+
+    def __init__(self, name_of=entry_name):
+        """
+        Purpose: Create an empty tree
+        name_of: Function giving the file name of an entry
+        Returns: Nothing
+        """
+        self.name_of = name_of
+        self.lock = threading.RLock()
+        # resource id -> (name, parent key, is folder)
+        self.nodes = {}
+        self.entries = {}
+        # parent key -> {name: resource id}
+        self.children = {}
+        # folder name -> resource id, for parents only named by category
+        self.names = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, rid):
+        return rid in self.nodes
+
+    def load(self, entries):
+        """
+        Purpose: Replace the tree with a full listing
+        entries: List of every DocumentListEntry
+        """
+        with self.lock:
+            self.nodes.clear()
+            self.entries.clear()
+            self.children.clear()
+            self.names.clear()
+            for e in entries:
+                if not is_removed(e):
+                    self.put(e)
+            self.loaded = True
+
+    def put(self, entry):
+        """
+        Purpose: Add an entry, or move it to where it is now filed
+        entry: DocumentListEntry
+        Returns: String resource id of the entry
+        """
+        rid = entry.resourceId.text
+        with self.lock:
+            old = self.nodes.get(rid)
+            self._unlink(rid)
+            name = self.name_of(entry)
+            parent = parent_key(entry)
+            folder = entry.GetDocumentType() == 'folder'
+            self.nodes[rid] = (name, parent, folder)
+            self.entries[rid] = entry
+            self.children.setdefault(parent, {})[name] = rid
+            if folder:
+                self.names[name] = rid
+                if old is not None and old[0] != name and ('label', old[0]) in self.children:
+                    # Children that only name their folder follow the rename
+                    kids = self.children.pop(('label', old[0]))
+                    self.children.setdefault(('label', name), {}).update(kids)
+                    for kid in kids.values():
+                        kname, kparent, kfolder = self.nodes[kid]
+                        self.nodes[kid] = (kname, ('label', name), kfolder)
+        return rid
+
+    def remove(self, rid):
+        """
+        Purpose: Drop an entry. Its children stay, but no path reaches
+                 them until it is put back.
+        rid: String resource id
+        """
+        with self.lock:
+            self._unlink(rid)
+            self.entries.pop(rid, None)
+
+    def discard(self, path):
+        """
+        Purpose: Drop the entry at path, if there is one
+        path: String path using mountpoint as /
+        """
+        with self.lock:
+            rid = self.resolve(path)
+            if rid is not None:
+                self.remove(rid)
+
+    def _unlink(self, rid):
+        """
+        Purpose: Take rid out of its parent's children
+        """
+        node = self.nodes.pop(rid, None)
+        if node is None:
+            return
+        name, parent, folder = node
+        siblings = self.children.get(parent)
+        if siblings is not None and siblings.get(name) == rid:
+            del siblings[name]
+            if not siblings:
+                del self.children[parent]
+        if folder and self.names.get(name) == rid:
+            del self.names[name]
+
+    def _parent(self, key):
+        """
+        Purpose: Resource id of the folder a parent key refers to
+        Returns: String resource id, None for the root, or False if the
+                 folder is not in the tree
+        """
+        if key is None:
+            return None
+        if key[0] == 'id':
+            return key[1] if key[1] in self.nodes else False
+        return self.names.get(key[1], False)
+
+    def path(self, rid):
+        """
+        Purpose: Work out the path of an entry by walking up its folders
+        rid: String resource id
+        Returns: String path, or None if it is not reachable from the root
+        """
+        parts = []
+        seen = set()
+        with self.lock:
+            while rid is not None:
+                if rid in seen or rid not in self.nodes:
+                    return None
+                seen.add(rid)
+                name, parent = self.nodes[rid][:2]
+                parts.append(name)
+                rid = self._parent(parent)
+                if rid is False:
+                    return None
+        return '/' + '/'.join(reversed(parts))
+
+    def resolve(self, path):
+        """
+        Purpose: Find the entry at path by walking down from the root
+        path: String path using mountpoint as /
+        Returns: String resource id, or None if nothing is there
+        """
+        rid = None
+        with self.lock:
+            for part in [p for p in path.split('/') if p]:
+                if rid is None:
+                    found = self.children.get(None, {}).get(part)
+                else:
+                    found = self.children.get(('id', rid), {}).get(part)
+                    if found is None:
+                        name = self.nodes[rid][0]
+                        if self.names.get(name) == rid:
+                            found = self.children.get(('label', name), {}).get(part)
+                if found is None:
+                    return None
+                rid = found
+        return rid
+
+    def lookup(self, path):
+        """
+        Purpose: Find the entry at path
+        path: String path using mountpoint as /
+        Returns: DocumentListEntry, or None if nothing is there
+        """
+        rid = self.resolve(path)
+        return self.entries.get(rid) if rid is not None else None
+
+
+class ChangeFeed(object):
+    """
+    Remote document list kept up to date from the change feed. refresh()
+    turns what changed remotely into (op, old path, new path, entry)
+    Tuples, op being 'put' for a new or changed entry (old path None
+    when it is new) and 'del' for a removed one. A full listing reports
+    every live entry, changed or not, as a 'put'.
+    """
+
+    def __init__(self, fetch, name_of, interval=30, full_every=3600, tree=None):
+        """
+        Purpose: Create an engine that has not listed anything yet
+        fetch: Function returning the List of entries updated at or after
+               an RFC 3339 time String, or of all entries when given None
+        name_of: Function giving the file name of an entry
+        interval: Float seconds between polls of the change feed
+        full_every: Float seconds between reconciling full listings
+        tree: FolderTree to keep up to date, e.g. the one GNet resolves
+              paths with
+        Returns: Nothing
+        """
+        self.fetch = fetch
+        self.interval = interval
+        self.full_every = full_every
+        self.tree = tree if tree is not None else FolderTree(name_of)
+        self.lock = threading.Lock()
+        self.cursor = None
+        self.last_poll = 0
+        self.last_full = 0
+        self.updated = {}
+        self.paths = {}
+
+    def refresh(self, force=False):
+        """
+        Purpose: Bring the remote listing up to date if it is due
+        force: Boolean, poll even if interval has not passed
+        Returns: Tuple (Boolean True if this was a full listing,
+                 List of changes)
+        """
+        with self.lock:
+            now = time.time()
+            if self.cursor is None or now - self.last_full >= self.full_every:
+                entries = self.fetch(None)
+                self.last_full = self.last_poll = now
+                return True, self._reconcile(entries, now)
+            if not force and now - self.last_poll < self.interval:
+                return False, []
+            entries = self.fetch(self.cursor)
+            self.last_poll = now
+            return False, self._apply(entries)
+
+    def path(self, rid):
+        """
+        Purpose: Current path of a resource id
+        Returns: String path, or None if it is not listed
+        """
+        return self.paths.get(rid)
+
+    def _advance(self, entries, started=None):
+        """
+        Purpose: Move the cursor to the newest update seen
+        started: Float UNIX time the fetch started, used when it was empty
+        """
+        times = [e.updated.text for e in entries if e.updated is not None]
+        if times:
+            newest = max(times)
+            if self.cursor is None or newest > self.cursor:
+                self.cursor = newest
+        elif self.cursor is None and started is not None:
+            self.cursor = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(started))
+
+    def _reconcile(self, entries, started):
+        """
+        Purpose: Replace the listing with a full one, reporting the
+                 difference from the previous listing
+        Returns: List of changes
+        """
+        live = set(e.resourceId.text for e in entries if not is_removed(e))
+        changes = []
+        with self.tree.lock:
+            for rid in [r for r in set(self.tree.nodes) | set(self.paths) if r not in live]:
+                changes.append(self._drop(rid))
+            changes.extend(self._apply(entries, True))
+            self.tree.loaded = True
+        self._advance(entries, started)
+        return changes
+
+    def _apply(self, entries, full=False):
+        """
+        Purpose: Fold changed entries into the listing
+        entries: List of DocumentListEntry objects
+        full: Boolean, report unchanged entries too
+        Returns: List of changes
+        """
+        changes = []
+        touched = []
+        with self.tree.lock:
+            for e in entries:
+                rid = e.resourceId.text
+                if is_removed(e):
+                    if rid in self.tree or rid in self.paths:
+                        changes.append(self._drop(rid))
+                    continue
+                updated = e.updated.text if e.updated is not None else None
+                # updated-min is inclusive, so the newest entries come back
+                if not full and rid in self.tree and updated is not None and \
+                        self.updated.get(rid) == updated:
+                    continue
+                self.tree.put(e)
+                self.updated[rid] = updated
+                touched.append((rid, e))
+            paths = []
+            for rid, e in touched:
+                new = self.tree.path(rid)
+                if new is not None:
+                    paths.append((new, rid, e))
+                elif rid in self.paths:
+                    # Filed in a folder that cannot be seen from the root
+                    changes.append(('del', self.paths.pop(rid), None, None))
+            # Parents before their children, so moved folders come first
+            paths.sort(key=lambda t: (not self.tree.nodes[t[1]][2], t[0].count('/')))
+            for new, rid, e in paths:
+                old = self.paths.get(rid)
+                if old is not None and old != new and self.tree.nodes[rid][2]:
+                    prefix = old + '/'
+                    for r, p in list(self.paths.items()):
+                        if p.startswith(prefix):
+                            self.paths[r] = new + p[len(old):]
+                self.paths[rid] = new
+                changes.append(('put', old, new, e))
+        self._advance(entries)
+        return changes
+
+    def _drop(self, rid):
+        """
+        Purpose: Forget a removed entry
+        Returns: The 'del' change for it
+        """
+        self.tree.remove(rid)
+        self.updated.pop(rid, None)
+        return ('del', self.paths.pop(rid, None), None, None)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gTable.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column name -> NumPy dtype. Rows are addressed by file id.
+COLUMNS = (
+    ('mtime', 'f8'),
+    ('ctime', 'f8'),
+    ('atime', 'f8'),
+    ('size', 'i8'),
+    ('mode', 'u4'),
+    ('freshness_per', 'f8'),
+    ('shelf_life', 'f8'),
+    ('service_type', 'i4'),
+    ('parent', 'i4'),
+    ('live', '?'),
+)
+
+
+class Codes(object):
+    """
+    Dictionary encoding of repeated Strings to small integer codes
+    """
+
+    def __init__(self):
+        """
+        Purpose: Start with no Strings encoded
+        Returns: Nothing
+        """
+        self.codes = {}
+        self.names = []
+
+    def encode(self, name):
+        """
+        Purpose: Code for name, allocating one if it is new
+        Returns: Int code
+        """
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def get(self, name):
+        """
+        Purpose: Code for name without allocating
+        Returns: Int code or -1 if name was never encoded
+        """
+        return self.codes.get(name, -1)
+
+    def decode(self, code):
+        """
+        Purpose: String encoded as code
+        Returns: The original String
+        """
+        return self.names[code]
+
+
+class ColumnTable(object):
+    """
+    Struct-of-arrays copy of the GStat metadata so bulk filters run as
+    vectorized NumPy masks instead of Python loops over GStat objects.
+    It only mirrors the GStats for select; getattr still reads those.
+    """
+
+    def __init__(self, capacity=1024):
+        """
+        Purpose: Allocate empty columns
+        capacity: Int number of rows to allocate up front
+        Returns: Nothing
+        """
+        if numpy is None:
+            raise ImportError('The columnar metadata backend needs NumPy')
+        self.capacity = capacity
+        for name, dtype in COLUMNS:
+            setattr(self, name, numpy.zeros(capacity, dtype=dtype))
+        self.size_hint = 0
+        self.service_types = Codes()
+        self.parents = Codes()
+        self.lock = threading.RLock()
+
+    def _reserve(self, fid):
+        """
+        Purpose: Grow every column (by doubling) until row fid exists
+        """
+        if fid < self.capacity:
+            return
+        capacity = self.capacity
+        while capacity <= fid:
+            capacity *= 2
+        for name, dtype in COLUMNS:
+            column = numpy.zeros(capacity, dtype=dtype)
+            column[:self.capacity] = getattr(self, name)
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def put(self, fid, st, parent):
+        """
+        Purpose: Store the attributes of st in row fid
+        fid: Int id of the file
+        st: GStat to copy from
+        parent: String path of the directory holding the file
+        """
+        with self.lock:
+            self._reserve(fid)
+            self.mtime[fid] = float(st.st_mtime)
+            self.ctime[fid] = float(st.st_ctime)
+            self.atime[fid] = float(st.st_atime)
+            self.size[fid] = st.st_size
+            self.mode[fid] = st.st_mode
+            self.freshness_per[fid] = st.freshness_per
+            self.shelf_life[fid] = st.shelf_life
+            self.service_type[fid] = self.service_types.encode(st.service_type)
+            self.parent[fid] = self.parents.encode(parent)
+            self.live[fid] = True
+            self.size_hint = max(self.size_hint, fid + 1)
+
+    def set_times(self, fid, st):
+        """
+        Purpose: Copy the access times of st into row fid
+        """
+        with self.lock:
+            self.mtime[fid] = float(st.st_mtime)
+            self.ctime[fid] = float(st.st_ctime)
+            self.atime[fid] = float(st.st_atime)
+
+    def set_size(self, fid, size):
+        """
+        Purpose: Record a new size for row fid
+        """
+        with self.lock:
+            self.size[fid] = size
+
+    def set_parent(self, fid, parent):
+        """
+        Purpose: Record that row fid moved to directory parent
+        """
+        with self.lock:
+            self.parent[fid] = self.parents.encode(parent)
+
+    def remove(self, fid):
+        """
+        Purpose: Mark row fid as free
+        """
+        with self.lock:
+            if fid < self.capacity:
+                self.live[fid] = False
+
+    def select(self, ids=None, min_time=None, max_time=None, service_type=None, parent=None):
+        """
+        Purpose: Filter rows with vectorized range and equality masks
+        ids: Optional iterable of candidate file ids (e.g. a label posting);
+             every live row is a candidate when None
+        min_time: Lower mtime bound or None
+        max_time: Upper mtime bound or None
+        service_type: String service type to match or None
+        parent: String path of the directory the files must sit in, or None
+        Returns: A NumPy array of matching file ids in ascending mtime order
+        """
+        with self.lock:
+            n = self.size_hint
+            if ids is None:
+                rows = numpy.arange(n)
+                mask = self.live[:n].copy()
+            else:
+                rows = numpy.fromiter(ids, dtype='i8')
+                rows = rows[rows < n]
+                mask = self.live[rows]
+            mtime = self.mtime[rows]
+            if min_time is not None:
+                mask &= mtime >= float(min_time)
+            if max_time is not None:
+                mask &= mtime <= float(max_time)
+            if service_type is not None:
+                mask &= self.service_type[rows] == self.service_types.get(service_type)
+            if parent is not None:
+                mask &= self.parent[rows] == self.parents.get(parent)
+            rows = rows[mask]
+            return rows[numpy.argsort(mtime[mask], kind='stable')]
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gTree.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import threading
+
+from gBitmap import RoaringBitmap
+from gBloom import CountingBloom, DEFAULT_SIZE
+
+
+class DirNode(object):
+    """
+    One directory of the dentry tree
+    """
+    __slots__ = ('path', 'parent', 'children', 'files', 'subtree', 'labels')
+
+    def __init__(self, path, parent, bloom_size=DEFAULT_SIZE):
+        """
+        Purpose: Create an empty directory node
+        path: String path of the directory
+        parent: DirNode holding this one, None for the root
+        bloom_size: Int number of counters of the label filter
+        Returns: Nothing
+        """
+        self.path = path
+        self.parent = parent
+        self.children = {}
+        self.files = RoaringBitmap()
+        self.subtree = RoaringBitmap()
+        self.labels = CountingBloom(bloom_size)
+
+    def ancestors(self):
+        """
+        Purpose: Walk from this node up to the root
+        Returns: Generator of DirNodes, starting with this one
+        """
+        node = self
+        while node is not None:
+            yield node
+            node = node.parent
+
+
+class DirTree(object):
+    """
+    Parent -> children tree of directories. Every node keeps the ids of
+    the files directly inside it and of all files below it, so a query
+    can be restricted to a subtree with one bitmap AND, and a Bloom
+    filter of the labels below it, so a label search can skip subtrees
+    that cannot hold a match.
+    """
+
+    def __init__(self, bloom_size=DEFAULT_SIZE):
+        """
+        Purpose: Start with just the root directory
+        bloom_size: Int number of counters of each directory's label filter
+        Returns: Nothing
+        """
+        self.bloom_size = bloom_size
+        self.root = DirNode('/', None, bloom_size)
+        self.nodes = {'/': self.root}
+        self.lock = threading.RLock()
+
+    def node(self, path, create=False):
+        """
+        Purpose: Find the node of directory path
+        path: String path of the directory
+        create: Boolean, create missing directories along the way
+        Returns: DirNode or None if it does not exist
+        """
+        node = self.nodes.get(path)
+        if node is not None or not create:
+            return node
+        with self.lock:
+            parent = self.node(os.path.dirname(path), create=True)
+            node = self.nodes.get(path)
+            if node is None:
+                node = DirNode(path, parent, self.bloom_size)
+                parent.children[os.path.basename(path)] = node
+                self.nodes[path] = node
+            return node
+
+    def add_file(self, path, fid, labels=()):
+        """
+        Purpose: Record that file fid lives at path, in O(depth)
+        path: String path of the file
+        fid: Int id of the file
+        labels: Labels of the file, counted in every ancestor's filter
+        """
+        with self.lock:
+            node = self.node(os.path.dirname(path), create=True)
+            if fid in node.files:
+                return
+            node.files.add(fid)
+            for n in node.ancestors():
+                n.subtree.add(fid)
+                for label in labels:
+                    n.labels.add(label)
+
+    def remove_file(self, path, fid, labels=()):
+        """
+        Purpose: Forget that file fid lives at path
+        path: String path of the file
+        fid: Int id of the file
+        labels: Labels the file was added with
+        """
+        with self.lock:
+            node = self.node(os.path.dirname(path))
+            if node is None or fid not in node.files:
+                return
+            node.files.discard(fid)
+            for n in node.ancestors():
+                n.subtree.discard(fid)
+                for label in labels:
+                    n.labels.discard(label)
+
+    def remove_dir(self, path):
+        """
+        Purpose: Drop the node of an empty directory
+        path: String path of the directory
+        """
+        with self.lock:
+            node = self.nodes.get(path)
+            if node is None or node is self.root or node.subtree or node.children:
+                return
+            del node.parent.children[os.path.basename(path)]
+            del self.nodes[path]
+
+    def move_dir(self, pathfrom, pathto):
+        """
+        Purpose: Move a directory and everything below it
+        pathfrom: String old path of the directory
+        pathto: String new path of the directory
+        """
+        with self.lock:
+            node = self.nodes.get(pathfrom)
+            if node is None or node is self.root:
+                return
+            for n in node.parent.ancestors():
+                n.subtree = n.subtree - node.subtree
+                n.labels.subtract(node.labels)
+            del node.parent.children[os.path.basename(pathfrom)]
+
+            parent = self.node(os.path.dirname(pathto), create=True)
+            parent.children[os.path.basename(pathto)] = node
+            node.parent = parent
+            for n in parent.ancestors():
+                n.subtree = n.subtree | node.subtree
+                n.labels.merge(node.labels)
+
+            stack = [(node, pathto)]
+            while stack:
+                n, path = stack.pop()
+                del self.nodes[n.path]
+                n.path = path
+                self.nodes[path] = n
+                for name, child in n.children.items():
+                    stack.append((child, os.path.join(path, name)))
+
+    def subtree(self, path):
+        """
+        Purpose: Ids of every file at or below directory path
+        path: String path of the directory
+        Returns: A RoaringBitmap (shared, do not modify)
+        """
+        node = self.nodes.get(path)
+        if node is None:
+            return RoaringBitmap()
+        return node.subtree
+
+    def might_contain(self, path, labels):
+        """
+        Purpose: Ask the label filter of directory path whether a file
+                 carrying every label in labels may lie below it
+        path: String path of the directory
+        labels: List of labels
+        Returns: False if no file below path can match, True otherwise
+        """
+        node = self.nodes.get(path)
+        if node is None:
+            return False
+        return all(label in node.labels for label in labels)
+
+    def candidates(self, path, labels):
+        """
+        Purpose: Walk the tree below path, skipping every subtree whose
+                 label filter rules out one of labels
+        path: String path of the directory to search
+        labels: List of labels every match must carry
+        Returns: A RoaringBitmap of the ids of the files in the visited
+                 directories. They still have to be checked against
+                 labels, the filters only rule files out.
+        """
+        result = RoaringBitmap()
+        with self.lock:
+            node = self.nodes.get(path)
+            stack = [node] if node is not None else []
+            while stack:
+                node = stack.pop()
+                if not all(label in node.labels for label in labels):
+                    continue
+                if node.files:
+                    result = result | node.files
+                stack.extend(node.children.values())
+        return result
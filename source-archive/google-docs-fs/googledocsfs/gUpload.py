@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gUpload.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import hashlib
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class ContentDigests(object):
+    """
+    Digests of cached files. Data written front to back is hashed as it
+    is written; other writes leave the digest to be read from the file
+    when asked for. Next to each path the digest and remote revision of
+    the content last sent or fetched are kept, so an upload that would
+    send the same bytes again can be skipped.
+    """
+
+    def __init__(self, chunk_size=1 << 20):
+        """
+        Purpose: Create an empty table
+        chunk_size: Int bytes read at a time when hashing a file
+        Returns: Nothing
+        """
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.running = {}
+        self.synced = {}
+        self.skipped = 0
+
+    def write(self, path, offset, data):
+        """
+        Purpose: Fold written data into the running digest of path
+        path: String path of the file
+        offset: Int offset data was written at
+        data: Bytes written
+        """
+        with self.lock:
+            state = self.running.get(path)
+            if offset == 0 and (state is None or len(data) >= state[1]):
+                state = self.running[path] = [hashlib.md5(), 0]
+            elif state is None or offset != state[1]:
+                # Not an append; hash the file when the digest is needed
+                self.running.pop(path, None)
+                return
+            state[0].update(data)
+            state[1] += len(data)
+
+    def truncate(self, path, length):
+        """
+        Purpose: Account for path being cut to length bytes
+        """
+        with self.lock:
+            if length == 0:
+                self.running[path] = [hashlib.md5(), 0]
+            else:
+                state = self.running.get(path)
+                if state is not None and state[1] != length:
+                    del self.running[path]
+
+    def digest(self, path, tmp_path):
+        """
+        Purpose: Digest of the cached file, from the running digest if it
+                 covers the whole file
+        path: String path of the file
+        tmp_path: String path of the cached copy
+        Returns: String hex digest
+        """
+        size = os.path.getsize(tmp_path)
+        with self.lock:
+            state = self.running.get(path)
+            if state is not None and state[1] == size:
+                return state[0].hexdigest()
+        h = hashlib.md5()
+        f = open(tmp_path, 'rb')
+        try:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                h.update(chunk)
+        finally:
+            f.close()
+        return h.hexdigest()
+
+    def record(self, path, digest, revision):
+        """
+        Purpose: Note the content the remote copy of path now has
+        digest: String hex digest of that content
+        revision: String remote revision (entry update time), or None
+        """
+        with self.lock:
+            self.synced[path] = (digest, revision)
+
+    def unchanged(self, path, digest, revision):
+        """
+        Purpose: Whether uploading content with this digest would send
+                 what the remote copy already has
+        Returns: Boolean, True to skip the upload
+        """
+        with self.lock:
+            same = self.synced.get(path) == (digest, revision)
+            if same:
+                self.skipped += 1
+            return same
+
+    def discard(self, path):
+        """
+        Purpose: Forget everything known about path
+        """
+        with self.lock:
+            self.running.pop(path, None)
+            self.synced.pop(path, None)
+
+
+class UploadQueue(object):
+    """
+    Bounded queue of paths to upload, drained by a pool of worker
+    threads. A path is queued at most once and is never uploaded by two
+    workers at a time, so uploads of one path happen in order and each
+    sends the content current when it starts.
+
+    A queued path waits delay seconds before it is sent, and every time
+    it is submitted again meanwhile the wait starts over, so a file that
+    keeps being rewritten is sent once with its latest content. No path
+    waits more than max_delay seconds after it was first queued.
+    """
+
+    def __init__(self, upload, workers=4, capacity=64, delay=0, max_delay=None):
+        """
+        Purpose: Create the queue and start its workers
+        upload: Function called with a path to upload it
+        workers: Int number of worker threads, 0 to upload in the
+                 submitting thread
+        capacity: Int number of queued paths after which submit blocks
+        delay: Float seconds a path waits for further changes
+        max_delay: Float seconds a path waits at most, None for delay
+        Returns: Nothing
+        """
+        self.upload = upload
+        self.capacity = capacity
+        self.delay = delay
+        self.max_delay = delay if max_delay is None else max(delay, max_delay)
+        self.coalesced = 0
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()
+        self.active = set()
+        self.errors = {}
+        self.running = True
+        self.submitted = 0
+        self.completed = 0
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run, name='gdfs-upload-%d' % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def __len__(self):
+        with self.cond:
+            return len(self.pending) + len(self.active)
+
+    def __contains__(self, path):
+        with self.cond:
+            return path in self.pending or path in self.active
+
+    def paths(self):
+        """
+        Purpose: List what is queued or being uploaded
+        Returns: List of String paths
+        """
+        with self.cond:
+            return list(self.pending) + list(self.active)
+
+    def submit(self, path):
+        """
+        Purpose: Queue path for upload, waiting while the queue is full
+        path: String path to upload
+        Returns: True if it was queued, False if it already was (its
+                 upload is then put off by another delay, within
+                 max_delay)
+        """
+        if not self.threads:
+            self._upload(path)
+            return True
+        with self.cond:
+            now = time.time()
+            if path in self.pending:
+                due, first = self.pending[path]
+                self.pending[path] = (max(due, min(now + self.delay, first + self.max_delay)), first)
+                self.coalesced += 1
+                return False
+            while len(self.pending) >= self.capacity and self.running:
+                self.cond.wait()
+            if path in self.pending:
+                return False
+            now = time.time()
+            self.pending[path] = (now + self.delay, now)
+            self.submitted += 1
+            self.cond.notify_all()
+        return True
+
+    def _next(self):
+        """
+        Purpose: Take the queued path that is due first and that no
+                 worker is uploading. Call with cond held.
+        Returns: Tuple (String path or None, Float seconds until the
+                 next path is due or None)
+        """
+        now = time.time()
+        best = None
+        for path, (due, first) in self.pending.items():
+            if path not in self.active and (best is None or due < best[1]):
+                best = (path, due)
+        if best is None:
+            return None, None
+        if best[1] > now:
+            return None, best[1] - now
+        del self.pending[best[0]]
+        self.active.add(best[0])
+        return best[0], None
+
+    def _run(self):
+        """
+        Purpose: Worker loop
+        """
+        while True:
+            with self.cond:
+                path, wait = self._next()
+                while path is None:
+                    if not self.running and not self.pending:
+                        return
+                    self.cond.wait(wait)
+                    path, wait = self._next()
+                # Room in the queue again
+                self.cond.notify_all()
+            try:
+                self._upload(path)
+            finally:
+                with self.cond:
+                    self.active.discard(path)
+                    self.cond.notify_all()
+
+    def _upload(self, path):
+        """
+        Purpose: Upload one path, recording rather than raising failures
+        """
+        try:
+            self.upload(path)
+        except Exception as e:
+            sys.stderr.write('uploading %s failed: %s\n' % (path, e))
+            with self.cond:
+                self.errors[path] = e
+        else:
+            with self.cond:
+                self.errors.pop(path, None)
+                self.completed += 1
+
+    def drain(self, path=None, timeout=None):
+        """
+        Purpose: Send path (or everything) queued so far without waiting
+                 out the delay, and wait until it is uploaded
+        path: String path to wait for, None for the whole queue
+        timeout: Float seconds to wait at most, None for no limit
+        Returns: True if nothing is left to wait for
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            now = time.time()
+            for p in ([path] if path is not None else list(self.pending)):
+                if p in self.pending:
+                    self.pending[p] = (now, self.pending[p][1])
+            self.cond.notify_all()
+            while True:
+                if path is None:
+                    busy = self.pending or self.active
+                else:
+                    busy = path in self.pending or path in self.active
+                if not busy:
+                    return True
+                if deadline is None:
+                    self.cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+
+    def cancel(self, path):
+        """
+        Purpose: Take path off the queue, waiting for its upload to finish
+                 if a worker is already sending it
+        path: String path about to be removed or renamed
+        Returns: True if a queued upload was dropped
+        """
+        with self.cond:
+            queued = self.pending.pop(path, None) is not None
+            if queued:
+                self.cond.notify_all()
+            while path in self.active:
+                self.cond.wait()
+            return queued
+
+    def stop(self):
+        """
+        Purpose: Upload everything queued, then stop the workers
+        """
+        self.drain()
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   gWal.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+#
+#   Every record is framed as (length, crc32) followed by a JSON list.
+#   Replay stops at the first short or corrupt frame, which is where a
+#   crash interrupted the last write.
+
+import json
+import os
+import struct
+import sys
+import threading
+import zlib
+
+FRAME = struct.Struct('<II')
+
+
+def _frame(record):
+    """
+    Purpose: Encode one record with its length and checksum
+    record: List or Tuple of JSON serialisable values
+    Returns: Bytes
+    """
+    data = json.dumps(record, separators=(',', ':')).encode('utf-8')
+    return FRAME.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+
+
+def _scan(path):
+    """
+    Purpose: Walk the intact records of a log file
+    path: String file name of the log
+    Returns: Generator of (List record, Int offset just past it) Tuples
+    """
+    try:
+        fh = open(path, 'rb')
+    except (IOError, OSError):
+        return
+    with fh:
+        end = 0
+        while True:
+            header = fh.read(FRAME.size)
+            if not header:
+                return
+            if len(header) < FRAME.size:
+                break
+            size, crc = FRAME.unpack(header)
+            data = fh.read(size)
+            if len(data) < size or zlib.crc32(data) & 0xffffffff != crc:
+                break
+            end += FRAME.size + size
+            yield json.loads(data.decode('utf-8')), end
+    sys.stderr.write('%s: dropping torn record at the end of the log\n' % path)
+
+
+def read(path):
+    """
+    Purpose: Read back the intact records of a log file
+    path: String file name of the log
+    Returns: Generator of Lists, in the order they were appended
+    """
+    for record, end in _scan(path):
+        yield record
+
+
+class WriteAheadLog(object):
+    """
+    Append-only log of metadata mutations. Appends only go to the OS
+    buffer; a background thread fsyncs them in batches every interval
+    seconds, and callers that need a record on disk wait for the next
+    batch (group commit).
+    """
+
+    def __init__(self, path, interval=0.05, compact_bytes=64 << 20, on_full=None):
+        """
+        Purpose: Open (or create) the log for appending
+        path: String file name of the log
+        interval: Float seconds between batched fsyncs
+        compact_bytes: Int log size that triggers on_full
+        on_full: Function called from the flusher thread once the log
+                 grows past compact_bytes, e.g. to checkpoint it
+        Returns: Nothing
+        """
+        self.path = path
+        self.interval = interval
+        self.compact_bytes = compact_bytes
+        self.on_full = on_full
+        self.cond = threading.Condition()
+        self.io_lock = threading.RLock()
+        self.stopping = threading.Event()
+        self.fh = open(path, 'ab')
+        self.size = self.fh.tell()
+        # New records must not land behind a torn one
+        intact = 0
+        for record, intact in _scan(path):
+            pass
+        if intact < self.size:
+            self.fh.truncate(intact)
+            self.size = intact
+        self.appended = 0
+        self.synced = 0
+        self.running = True
+        self.compacting = False
+        self.thread = threading.Thread(target=self._run, name='gdfs-wal')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def old_path(self):
+        """
+        Purpose: Name the log is moved to while a checkpoint runs
+        """
+        return self.path + '.old'
+
+    def append(self, record, durable=False):
+        """
+        Purpose: Add a record to the log
+        record: List or Tuple of JSON serialisable values
+        durable: Boolean, wait until the record has been fsynced
+        """
+        data = _frame(record)
+        with self.cond:
+            self.fh.write(data)
+            self.size += len(data)
+            self.appended += 1
+            seq = self.appended
+            self.cond.notify_all()
+            if durable:
+                while self.synced < seq and self.running:
+                    self.cond.wait()
+
+    def _flush(self):
+        """
+        Purpose: Flush and fsync everything appended so far
+        Returns: Int sequence number of the last durable record
+        """
+        with self.io_lock:
+            with self.cond:
+                seq = self.appended
+                if seq == self.synced:
+                    return seq
+                self.fh.flush()
+            # Appends carry on while the batch is being fsynced
+            os.fsync(self.fh.fileno())
+            with self.cond:
+                self.synced = max(self.synced, seq)
+                self.cond.notify_all()
+            return seq
+
+    def sync(self):
+        """
+        Purpose: Make every record appended so far durable now
+        """
+        self._flush()
+
+    def _run(self):
+        """
+        Purpose: fsync batches of records and trigger compaction
+        """
+        while True:
+            with self.cond:
+                while self.running and self.appended == self.synced:
+                    self.cond.wait()
+                if not self.running:
+                    return
+            self._flush()
+            full = False
+            with self.cond:
+                if self.on_full is not None and not self.compacting and self.size > self.compact_bytes:
+                    self.compacting = full = True
+            if full:
+                try:
+                    self.on_full()
+                except Exception as e:
+                    sys.stderr.write('write-ahead log compaction failed: %s\n' % e)
+                with self.cond:
+                    self.compacting = False
+            # Let the next batch build up
+            self.stopping.wait(self.interval)
+
+    def rotate(self):
+        """
+        Purpose: Start a fresh log, keeping the current one as old_path
+                 until the checkpoint that covers it is written
+        """
+        with self.io_lock:
+            self._flush()
+            with self.cond:
+                # Records appended since that flush belong to this log
+                self.fh.flush()
+                os.fsync(self.fh.fileno())
+                self.synced = self.appended
+                self.cond.notify_all()
+                self.fh.close()
+                if os.path.exists(self.old_path):
+                    # An earlier checkpoint failed; keep its records too
+                    with open(self.old_path, 'ab') as old:
+                        with open(self.path, 'rb') as fh:
+                            old.write(fh.read())
+                        old.flush()
+                        os.fsync(old.fileno())
+                    os.remove(self.path)
+                else:
+                    os.rename(self.path, self.old_path)
+                self.fh = open(self.path, 'ab')
+                self.size = 0
+
+    def retire(self):
+        """
+        Purpose: Delete the log retired by rotate once it is covered by
+                 a checkpoint
+        """
+        try:
+            os.remove(self.old_path)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Purpose: Sync the remaining records and stop the flusher thread
+        """
+        self._flush()
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.stopping.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.fh.close()
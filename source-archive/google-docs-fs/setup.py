@@ -13,7 +13,7 @@ setup(
     author_email='d38dm8nw81k1ng@gmail.com',
     license='GPLv2',
     url='http://code.google.com/p/google-docs-fs/',
-    py_modules=['googledocsfs.gFile','googledocsfs.gNet'],
+    py_modules=['googledocsfs.gFile','googledocsfs.gNet','googledocsfs.gIndex','googledocsfs.gBitmap','googledocsfs.gTable','googledocsfs.gTree','googledocsfs.gExpiry','googledocsfs.gCache','googledocsfs.gQuery','googledocsfs.gExpr','googledocsfs.gBloom','googledocsfs.gSnapshot','googledocsfs.gWal','googledocsfs.gSync','googledocsfs.gPool','googledocsfs.gAuth','googledocsfs.gUpload','googledocsfs.gFetch'],
     scripts=['gmount','gumount','gmount.py'],
     install_requires=['python-fuse>=0.2','python-gdata>=2.0.0']
     )
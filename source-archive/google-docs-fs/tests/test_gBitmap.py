@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   test_gBitmap.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'googledocsfs'))
+
+from gBitmap import ARRAY_MAX, RoaringBitmap
+
+
+def _sample(rng):
+    """
+    Purpose: Random id set mixing sparse chunks, dense chunks (stored as
+             bitsets) and empty ones
+    Returns: A set of ints
+    """
+    ids = set()
+    for high in rng.sample(range(6), 4):
+        base = high << 16
+        n = rng.choice([0, 1, 50, ARRAY_MAX, ARRAY_MAX + 1, 20000])
+        ids.update(base + rng.randrange(65536) for _ in range(n))
+    return ids
+
+
+class RoaringBitmapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(7)
+
+    def assertSame(self, bitmap, ids):
+        self.assertEqual(len(bitmap), len(ids))
+        self.assertEqual(list(bitmap), sorted(ids))
+        self.assertEqual(bool(bitmap), bool(ids))
+
+    def test_set_operations_match_python_sets(self):
+        for _ in range(30):
+            a, b = _sample(self.rng), _sample(self.rng)
+            ra, rb = RoaringBitmap(a), RoaringBitmap(b)
+            self.assertSame(ra, a)
+            self.assertSame(ra & rb, a & b)
+            self.assertSame(ra | rb, a | b)
+            self.assertSame(ra - rb, a - b)
+            self.assertSame(rb - ra, b - a)
+            self.assertEqual(ra.intersection_len(rb), len(a & b))
+            # Operands are left untouched
+            self.assertSame(ra, a)
+            self.assertSame(rb, b)
+
+    def test_membership(self):
+        ids = _sample(self.rng)
+        bitmap = RoaringBitmap(ids)
+        for v in list(ids)[:500] + [self.rng.randrange(6 << 16) for _ in range(500)]:
+            self.assertEqual(v in bitmap, v in ids)
+
+    def test_add_and_discard_cross_container_kinds(self):
+        ids = set()
+        bitmap = RoaringBitmap()
+        # Grow one chunk past ARRAY_MAX and shrink it back below
+        for v in self.rng.sample(range(65536), ARRAY_MAX + 100):
+            bitmap.add(v)
+            ids.add(v)
+        bitmap.add(v)
+        self.assertSame(bitmap, ids)
+        for v in self.rng.sample(sorted(ids), 300):
+            bitmap.discard(v)
+            ids.discard(v)
+        bitmap.discard(70000)
+        self.assertSame(bitmap, ids)
+        for v in list(ids):
+            bitmap.discard(v)
+        self.assertSame(bitmap, set())
+        self.assertEqual(bitmap.containers, {})
+
+    def test_copy_is_independent(self):
+        ids = _sample(self.rng)
+        bitmap = RoaringBitmap(ids)
+        copy = bitmap.copy()
+        copy.add(10 << 16)
+        for v in list(ids)[:100]:
+            copy.discard(v)
+        self.assertSame(bitmap, ids)
+
+    def test_from_range(self):
+        for start, stop in [(0, 0), (0, 1), (5, 70000), (65535, 65537), (131072, 131072 + 65536)]:
+            self.assertSame(RoaringBitmap.from_range(start, stop), set(range(start, stop)))
+
+    def test_iter_from(self):
+        ids = _sample(self.rng)
+        bitmap = RoaringBitmap(ids)
+        for start in [0, 1, 65535, 65536, 3 << 16, 7 << 16] + self.rng.sample(sorted(ids), 20):
+            self.assertEqual(list(bitmap.iter_from(start)), sorted(v for v in ids if v >= start))
+
+    def test_dump_load_round_trip(self):
+        bitmaps = [RoaringBitmap(_sample(self.rng)) for _ in range(5)] + [RoaringBitmap()]
+        blob = b'xx' + b''.join(bitmap.dump() for bitmap in bitmaps)
+        offset = 2
+        for bitmap in bitmaps:
+            loaded, offset = RoaringBitmap.load(blob, offset)
+            self.assertSame(loaded, set(bitmap))
+        self.assertEqual(offset, len(blob))
+
+
+if __name__ == '__main__':
+    unittest.main()
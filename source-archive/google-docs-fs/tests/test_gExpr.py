@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   test_gExpr.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'googledocsfs'))
+
+import gExpr
+from gIndex import LabelIndex
+
+LABELS = ['a', 'b', 'c', 'd', 'two words']
+
+
+def _random_expr(rng, depth=0):
+    """
+    Purpose: Build a random expression and its Python equivalent
+    Returns: Tuple (String gExpr expression, String Python expression
+             over a set named have)
+    """
+    kind = rng.choice(['label', 'label', 'not', 'and', 'or'] if depth < 3 else ['label'])
+    if kind == 'label':
+        label = rng.choice(LABELS + ['unknown'])
+        text = '"%s"' % label if ' ' in label else label
+        return text, '(%r in have)' % label
+    if kind == 'not':
+        text, py = _random_expr(rng, depth + 1)
+        return 'NOT %s' % text, '(not %s)' % py
+    parts = [_random_expr(rng, depth + 1) for _ in range(rng.randrange(2, 4))]
+    word = kind.upper()
+    return ('(%s)' % (' %s ' % word).join(t for t, p in parts),
+            '(%s)' % (' %s ' % kind).join(p for t, p in parts))
+
+
+class ExpressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(9)
+        self.index = LabelIndex()
+        self.files = {}
+        for fid in range(600):
+            labels = self.rng.sample(LABELS, self.rng.randrange(4))
+            self.index.add(fid, labels)
+            self.files[fid] = set(labels)
+
+    def test_evaluate_matches_python(self):
+        for _ in range(80):
+            text, py = _random_expr(self.rng)
+            expected = sorted(fid for fid, have in self.files.items() if eval(py, {'have': have}))
+            self.assertEqual(sorted(gExpr.evaluate(text, self.index)), expected, text)
+
+    def test_required_labels_hold_for_every_match(self):
+        for _ in range(80):
+            text, py = _random_expr(self.rng)
+            node = gExpr.parse(text)
+            required = gExpr.required(node)
+            for fid in gExpr.evaluate(node, self.index):
+                self.assertTrue(required <= self.files[fid], text)
+
+    def test_required(self):
+        cases = [('a', ['a']), ('a AND b', ['a', 'b']), ('a OR b', []), ('NOT a', []),
+                 ('(a AND b) OR (a AND c)', ['a']), ('a AND NOT b', ['a']), ('NOT NOT a', ['a'])]
+        for text, labels in cases:
+            self.assertEqual(gExpr.required(gExpr.parse(text)), frozenset(labels), text)
+
+    def test_evaluate_does_not_share_postings(self):
+        result = gExpr.evaluate('a', self.index)
+        result.add(10 ** 6)
+        self.assertFalse(10 ** 6 in self.index.postings['a'])
+
+    def test_bad_expressions(self):
+        for text in ['', 'a AND', '(a', 'a)', 'AND a', 'a b', 'NOT', '"open']:
+            self.assertRaises(ValueError, gExpr.parse, text)
+
+
+if __name__ == '__main__':
+    unittest.main()
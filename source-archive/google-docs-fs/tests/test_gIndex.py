@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   test_gIndex.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'googledocsfs'))
+
+from gBitmap import RoaringBitmap
+from gIndex import FileIds, LabelIndex, QueryPlanner, TimeIndex
+
+
+class FileIdsTest(unittest.TestCase):
+
+    def test_ids_are_reused_smallest_first(self):
+        ids = FileIds()
+        for name in 'abcde':
+            ids.assign('/' + name)
+        self.assertEqual(ids.assign('/c'), 2)
+        ids.release('/d')
+        ids.release('/b')
+        self.assertEqual(ids.get('/b'), None)
+        self.assertEqual(ids.path(3), None)
+        self.assertEqual(ids.assign('/x'), 1)
+        self.assertEqual(ids.assign('/y'), 3)
+        self.assertEqual(ids.assign('/z'), 5)
+        ids.rename('/x', '/w')
+        self.assertEqual((ids.get('/w'), ids.get('/x'), ids.path(1)), (1, None, '/w'))
+
+
+class TimeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(11)
+        self.index = TimeIndex()
+        self.model = {}
+        # Few distinct mtimes, as with one-second timestamps
+        for _ in range(6000):
+            fid = self.rng.randrange(800)
+            if self.rng.random() < 0.3:
+                self.index.remove(fid)
+                self.model.pop(fid, None)
+            else:
+                mtime = self.rng.randrange(15)
+                self.index.add(fid, mtime)
+                self.model[fid] = float(mtime)
+
+    def entries(self):
+        return sorted((mtime, fid) for fid, mtime in self.model.items())
+
+    def test_matches_model(self):
+        self.assertEqual(list(zip(self.index.times, self.index.ids)), self.entries())
+        for fid in range(800):
+            self.assertEqual(self.index.mtime(fid), self.model.get(fid))
+
+    def test_range_and_count(self):
+        for lo, hi in [(None, None), (3, 7), (7, 3), (None, 0), (14, None), (2.5, 2.5), (4, 4)]:
+            expected = [fid for mtime, fid in self.entries()
+                        if (lo is None or mtime >= lo) and (hi is None or mtime <= hi)]
+            self.assertEqual(list(self.index.range(lo, hi)), expected)
+            self.assertEqual(self.index.count(lo, hi), len(expected))
+
+    def test_scan_resumes_after_any_position(self):
+        entries = self.entries()
+        starts = self.rng.sample(entries, 30) + [(5.0, -1), (5.0, 10 ** 6), (-1.0, 0), (99.0, 0)]
+        for after in starts:
+            self.assertEqual(list(self.index.scan(None, None, after, chunk=7)),
+                             [e for e in entries if e > after])
+            self.assertEqual(list(self.index.scan(None, None, after, reverse=True, chunk=7)),
+                             [e for e in reversed(entries) if e < after])
+            self.assertEqual(list(self.index.scan(3, 9, after, chunk=5)),
+                             [e for e in entries if e > after and 3 <= e[0] <= 9])
+
+    def test_readding_same_mtime_is_a_no_op(self):
+        fid, mtime = next(iter(self.model.items()))
+        before = list(self.index.ids)
+        self.index.add(fid, str(mtime))
+        self.assertEqual(list(self.index.ids), before)
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(5)
+        self.labels = LabelIndex()
+        self.times = TimeIndex()
+        self.planner = QueryPlanner(self.labels, self.times)
+        self.files = {}
+        for fid in range(3000):
+            labels = rng.sample(['a', 'b', 'c', 'd', 'rare'], rng.randrange(3)) if fid % 97 else ['rare']
+            mtime = float(rng.randrange(1000))
+            self.labels.add(fid, labels)
+            self.times.add(fid, mtime)
+            self.files[fid] = (set(labels), mtime)
+        for fid in range(0, 3000, 13):
+            self.labels.remove(fid)
+            self.times.remove(fid)
+            del self.files[fid]
+
+    def test_execute_and_count_match_brute_force(self):
+        # Scopes come from the directory tree, so only hold indexed ids
+        scope = RoaringBitmap(fid for fid in range(0, 3000, 3) if fid in self.files)
+        cases = [([], None, None, None), (['a'], None, None, None), (['a', 'b'], 100, 400, None),
+                 (['rare'], None, None, None), (['rare'], 0, 999, None), ([], 10, 20, None),
+                 (['c'], None, 50, scope), (['missing'], None, None, None), ([], None, None, scope),
+                 (['a'], 200, 100, None)]
+        for labels, lo, hi, within in cases:
+            expected = sorted(fid for fid, (have, mtime) in self.files.items()
+                              if set(labels) <= have
+                              and (lo is None or mtime >= lo) and (hi is None or mtime <= hi)
+                              and (within is None or fid in within))
+            self.assertEqual(sorted(self.planner.execute(labels, lo, hi, within)), expected,
+                             (labels, lo, hi))
+            self.assertEqual(self.planner.count(labels, lo, hi, within), len(expected), (labels, lo, hi))
+
+    def test_lookup(self):
+        self.assertEqual(sorted(self.labels.lookup(['a', 'd'])),
+                         sorted(fid for fid, (have, mtime) in self.files.items() if set('ad') <= have))
+        self.assertEqual(self.labels.cardinality('missing'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
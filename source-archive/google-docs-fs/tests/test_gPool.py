@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   test_gPool.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'googledocsfs'))
+
+try:
+    import gPool
+except ImportError:
+    # gPool builds on atom.http from gdata
+    gPool = None
+
+
+class _Body(object):
+    """
+    httplib response stand-in serving a fixed body
+    """
+
+    def __init__(self, body, will_close=False):
+        self.body = body
+        self.length = len(body)
+        self.will_close = will_close
+        self.closed = False
+
+    def read(self, amt=None):
+        amt = self.length if amt is None else min(amt, self.length)
+        data, self.body = self.body[:amt], self.body[amt:]
+        self.length -= amt
+        return data
+
+    def isclosed(self):
+        return self.closed or self.length == 0
+
+    def close(self):
+        self.closed = True
+
+
+class _Connection(object):
+    """
+    httplib connection stand-in answering with the queued bodies
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.closed = False
+
+    def getresponse(self):
+        return self.responses.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipIf(gPool is None, 'atom.http is not installed')
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = gPool.ConnectionPool(size=2)
+        self.key = ('https', 'docs.google.com', 443)
+
+    def _checkout(self):
+        return self.pool.checkout(self.key, _Connection)
+
+    def test_released_connections_are_reused(self):
+        pc = self._checkout()
+        pc.conn.responses.append(_Body(b'abc'))
+        response = pc.getresponse()
+        self.assertEqual(response.read(), b'abc')
+        again = self._checkout()
+        self.assertTrue(again is pc)
+        self.assertEqual(again.checkout, 2)
+        stats = self.pool.stats()
+        self.assertEqual((stats['created'], stats['reused']), (1, 1))
+
+    def test_partial_read_keeps_the_connection(self):
+        pc = self._checkout()
+        pc.conn.responses.append(_Body(b'abcdef'))
+        response = pc.getresponse()
+        self.assertEqual(response.read(4), b'abcd')
+        self.assertFalse(pc.released)
+        self.assertEqual(response.read(4), b'ef')
+        self.assertTrue(pc.released)
+
+    def test_response_releases_once(self):
+        pc = self._checkout()
+        pc.conn.responses.append(_Body(b'abc'))
+        response = pc.getresponse()
+        response.read()
+        response.close()
+        response.read()
+        # Both slots are still free
+        a, b = self._checkout(), self.pool.checkout(('http', 'other', 80), _Connection)
+        self.assertTrue(a is pc)
+        self.assertFalse(self.pool.slots.acquire(False))
+
+    def test_stale_release_leaves_a_later_checkout_alone(self):
+        pc = self._checkout()
+        pc.conn.responses.extend([_Body(b'old'), _Body(b'new')])
+        old = pc.getresponse()
+        self.pool.release(pc)
+        again = self._checkout()
+        self.assertTrue(again is pc)
+        new = again.getresponse()
+        # The first response is closed late, after the reuse
+        old.close()
+        self.assertFalse(pc.released)
+        self.assertFalse(pc.conn.closed)
+        self.assertEqual(new.read(), b'new')
+        self.assertTrue(pc.released)
+
+    def test_unreusable_connections_are_closed(self):
+        pc = self._checkout()
+        pc.conn.responses.append(_Body(b'abc', will_close=True))
+        pc.getresponse().read()
+        self.assertTrue(pc.conn.closed)
+        self.assertFalse(self._checkout() is pc)
+        self.assertEqual(self.pool.stats()['retired'], 1)
+
+    def test_failed_getresponse_closes_the_connection(self):
+        pc = self._checkout()
+        self.assertRaises(IndexError, pc.getresponse)
+        self.assertTrue(pc.released)
+        self.assertTrue(pc.conn.closed)
+
+    def test_idle_connections_expire(self):
+        self.pool.idle_timeout = 0
+        pc = self._checkout()
+        self.pool.release(pc)
+        self.assertFalse(self._checkout() is pc)
+        self.assertTrue(pc.conn.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
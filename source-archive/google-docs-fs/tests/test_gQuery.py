@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   test_gQuery.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'googledocsfs'))
+
+import gExpr
+import gQuery
+from gIndex import FileIds, LabelIndex, QueryPlanner, TimeIndex
+from gTree import DirTree
+
+
+class _Stat(object):
+
+    def __init__(self, mtime, labels):
+        self.st_mtime = mtime
+        self.labels = labels
+
+
+class _Indexes(object):
+    """
+    The parts of gFile.GFile a query reads
+    """
+
+    def __init__(self):
+        self.ids = FileIds()
+        self.files = {}
+        self.label_index = LabelIndex()
+        self.time_index = TimeIndex()
+        self.planner = QueryPlanner(self.label_index, self.time_index)
+        self.tree = DirTree(64)
+
+    def add(self, path, mtime, labels):
+        fid = self.ids.assign(path)
+        self.files[path] = _Stat(mtime, labels)
+        self.label_index.add(fid, labels)
+        self.time_index.add(fid, mtime)
+        self.tree.add_file(path, fid, labels)
+
+    def remove(self, path):
+        fid = self.ids.get(path)
+        self.tree.remove_file(path, fid, self.label_index.labels(fid))
+        self.label_index.remove(fid)
+        self.time_index.remove(fid)
+        self.ids.release(path)
+        del self.files[path]
+
+
+class CursorTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(13)
+        self.fs = _Indexes()
+        for i in range(600):
+            # Labels c and d never occur under /r2, and mtimes collide
+            labels = rng.sample(['a', 'b', 'c', 'd'] if i % 3 != 2 else ['a', 'b'], rng.randrange(3))
+            self.fs.add('/r%d/s%d/f%d.doc' % (i % 3, i % 5, i), float(rng.randrange(300)), labels)
+        self.predicates = [gQuery.Predicate('/'), gQuery.Predicate('/', ['a']),
+                           gQuery.Predicate('/r1', ['a', 'b'], 50, 250), gQuery.Predicate('/', None, 10, 20),
+                           gQuery.Predicate('/r0/s3', expr='a OR NOT b'), gQuery.Predicate('/r2', ['c']),
+                           gQuery.Predicate('/r2', expr='c OR d'), gQuery.Predicate('/missing'),
+                           gQuery.Predicate('/r1', ['a'], expr='b AND NOT c')]
+
+    def expected(self, predicate, order):
+        matches = []
+        for path, st in self.fs.files.items():
+            fid = self.fs.ids.get(path)
+            if predicate.path != '/' and not path.startswith(predicate.path + '/'):
+                continue
+            if not set(predicate.labels) <= set(st.labels) or not predicate.in_time(st.st_mtime):
+                continue
+            if predicate.expr is not None and fid not in gExpr.evaluate(predicate.expr, self.fs.label_index):
+                continue
+            matches.append((st.st_mtime, fid, path))
+        if order == 'id':
+            matches.sort(key=lambda m: m[1])
+        else:
+            matches.sort(reverse=order == '-mtime')
+        return [path for mtime, fid, path in matches]
+
+    def test_full_stream(self):
+        for predicate in self.predicates:
+            for order in gQuery.ORDERS:
+                cursor = gQuery.Cursor(self.fs, predicate, order)
+                self.assertEqual([path for path, st in cursor], self.expected(predicate, order),
+                                 (predicate, order))
+                self.assertEqual(cursor.token, None)
+            self.assertEqual(gQuery.count(self.fs, predicate), len(self.expected(predicate, 'id')))
+
+    def test_pages_joined_by_tokens(self):
+        for predicate in self.predicates:
+            for order in gQuery.ORDERS:
+                for limit in (5, 64):
+                    paths = []
+                    token = None
+                    while True:
+                        cursor = gQuery.Cursor(self.fs, predicate, order, limit=limit, token=token)
+                        page = [path for path, st in cursor]
+                        self.assertTrue(len(page) <= limit)
+                        paths.extend(page)
+                        token = cursor.token
+                        if token is None:
+                            break
+                        self.assertEqual(len(page), limit)
+                    self.assertEqual(paths, self.expected(predicate, order), (predicate, order, limit))
+
+    def test_token_survives_changes_between_pages(self):
+        predicate = gQuery.Predicate('/', ['a'])
+        cursor = gQuery.Cursor(self.fs, predicate, 'mtime', limit=50)
+        first = [path for path, st in cursor]
+        for path in first[-5:]:
+            self.fs.remove(path)
+        self.fs.add('/r0/new.doc', 0.0, ['a'])
+        rest = [path for path, st in gQuery.Cursor(self.fs, predicate, 'mtime', token=cursor.token)]
+        self.assertEqual(rest, [p for p in self.expected(predicate, 'mtime') if p not in first and
+                                p != '/r0/new.doc'])
+
+    def test_offset(self):
+        predicate = gQuery.Predicate('/', ['b'])
+        expected = self.expected(predicate, '-mtime')
+        page = [path for path, st in gQuery.Cursor(self.fs, predicate, '-mtime', limit=10, offset=25)]
+        self.assertEqual(page, expected[25:35])
+
+    def test_top_k(self):
+        predicate = gQuery.Predicate('/r0', ['a'])
+        for order in ('mtime', '-mtime'):
+            top = [path for path, st in gQuery.top_k(self.fs, predicate, 12, order)]
+            self.assertEqual(top, self.expected(predicate, order)[:12])
+        self.assertEqual(gQuery.top_k(self.fs, predicate, 0), [])
+        self.assertRaises(ValueError, gQuery.top_k, self.fs, predicate, 3, 'id')
+
+    def test_tokens(self):
+        for order, mtime, fid in [('mtime', 12.5, 3), ('-mtime', 0.0, 0), ('id', None, 42)]:
+            token = gQuery.encode_token(order, mtime, fid)
+            self.assertEqual(gQuery.decode_token(order, token), (mtime, fid))
+        self.assertRaises(ValueError, gQuery.decode_token, 'mtime', gQuery.encode_token('-mtime', 1.0, 2))
+        self.assertRaises(ValueError, gQuery.Cursor, self.fs, gQuery.Predicate('/'), 'size')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   test_gSnapshot.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'googledocsfs'))
+
+import gSnapshot
+from gIndex import FileIds, LabelIndex, TimeIndex
+from gTree import DirTree
+
+FIELDS = ('st_mtime', 'st_ctime', 'st_atime', 'receiveTime', 'freshness_per', 'shelf_life',
+          'st_size', 'st_mode', 'st_nlink', 'service_type', 'labels')
+
+
+class _Stat(object):
+    """
+    Stand-in for gFile.GStat, which needs fuse
+    """
+
+    def __init__(self):
+        self.st_mode = stat.S_IFREG | 0o744
+        self.st_nlink = 1
+        self.st_size = 0
+        self.st_mtime = self.st_ctime = self.st_atime = self.receiveTime = 0.0
+        self.freshness_per = 0.1
+        self.shelf_life = 0
+        self.service_type = 'proc'
+        self.labels = []
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'snapshot')
+        rng = random.Random(3)
+        labels = ['temp', 'hum', u'caf\xe9', 'wind', 'rain']
+        self.ids = FileIds()
+        self.files = gSnapshot.StatTable()
+        self.label_index = LabelIndex()
+        self.time_index = TimeIndex()
+        self.tree = DirTree(64)
+        for i in range(500):
+            path = u'/s%d/d%d/f%d.doc' % (i % 3, i % 7, i)
+            st = _Stat()
+            st.st_size = rng.randrange(10000)
+            st.st_mtime = float(rng.randrange(1000))
+            st.st_ctime, st.st_atime = st.st_mtime - 5, st.st_mtime + 5
+            st.receiveTime = st.st_mtime + 0.5
+            st.shelf_life = rng.choice([0, 60])
+            st.service_type = rng.choice(['proc', 'store'])
+            st.labels = rng.sample(labels, rng.randrange(3))
+            self._add(path, st)
+        # Freed ids must stay free across a reload
+        for i in range(0, 500, 9):
+            self._remove(u'/s%d/d%d/f%d.doc' % (i % 3, i % 7, i))
+        self.directories = {'/': ['s0', 's1', 's2'], '/s0': ['d0', 'd3'], u'/s1/d1': [u'f1.doc']}
+        self.dirty = (['/s0/d0/f21.doc'], ['/s0/d0/f21.doc', '/s1/d1/f1.doc'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _add(self, path, st):
+        fid = self.ids.assign(path)
+        self.files[path] = st
+        self.label_index.add(fid, st.labels)
+        self.time_index.add(fid, st.st_mtime)
+        self.tree.add_file(path, fid, self.label_index.labels(fid))
+
+    def _remove(self, path):
+        fid = self.ids.get(path)
+        self.tree.remove_file(path, fid, self.label_index.labels(fid))
+        self.label_index.remove(fid)
+        self.time_index.remove(fid)
+        self.ids.release(path)
+        del self.files[path]
+
+    def _save(self):
+        return gSnapshot.save(self.path, self.ids, self.files, self.label_index, self.time_index,
+                              self.tree, self.directories, self.dirty)
+
+    def test_round_trip(self):
+        size = self._save()
+        self.assertEqual(size, os.path.getsize(self.path))
+        snap = gSnapshot.Snapshot(self.path)
+        try:
+            ids = snap.file_ids()
+            self.assertEqual(ids.paths, self.ids.paths)
+            self.assertEqual(ids.ids, self.ids.ids)
+            self.assertEqual(sorted(ids.free), sorted(self.ids.free))
+
+            files = gSnapshot.StatTable(snap, ids, _Stat)
+            self.assertEqual(len(files), len(self.files))
+            # Nothing is built until it is looked up
+            self.assertEqual(dict.__len__(files), 0)
+            for path, st in self.files.items():
+                loaded = files[path]
+                for name in FIELDS:
+                    self.assertEqual(getattr(loaded, name), getattr(st, name), (path, name))
+            self.assertFalse('/s0/d0/f0.doc' in files)
+
+            index = snap.label_index()
+            self.assertEqual(sorted(index.postings), sorted(self.label_index.postings))
+            for label, posting in self.label_index.postings.items():
+                self.assertEqual(list(index.postings[label]), list(posting))
+            self.assertEqual(list(index.all), list(self.label_index.all))
+            for fid in self.ids.ids.values():
+                self.assertEqual(index.labels(fid), self.label_index.labels(fid))
+
+            times = snap.time_index()
+            self.assertEqual(list(times.times), list(self.time_index.times))
+            self.assertEqual(list(times.ids), list(self.time_index.ids))
+            self.assertEqual(times.range(100, 200), self.time_index.range(100, 200))
+
+            tree = snap.tree()
+            self.assertEqual(sorted(tree.nodes), sorted(self.tree.nodes))
+            for path, node in self.tree.nodes.items():
+                other = tree.nodes[path]
+                self.assertEqual(list(other.files), list(node.files))
+                self.assertEqual(list(other.subtree), list(node.subtree))
+                self.assertEqual(list(other.labels.counts), list(node.labels.counts))
+                self.assertEqual(sorted(other.children), sorted(node.children))
+
+            self.assertEqual(snap.directories(), self.directories)
+            self.assertEqual(snap.dirty(), (list(self.dirty[0]), list(self.dirty[1])))
+            self.assertEqual(sum(snap.live_flags()), len(self.files))
+        finally:
+            snap.close()
+
+    def test_save_from_loaded_snapshot(self):
+        self._save()
+        snap = gSnapshot.Snapshot(self.path)
+        try:
+            ids = snap.file_ids()
+            files = gSnapshot.StatTable(snap, ids, _Stat)
+            label_index = snap.label_index()
+            # Saving reads entries still waiting in the old mapping
+            gSnapshot.save(self.path + '2', ids, files, label_index, snap.time_index(), snap.tree(),
+                           snap.directories(), snap.dirty())
+            self.assertEqual(dict.__len__(files), 0)
+        finally:
+            snap.close()
+        again = gSnapshot.Snapshot(self.path + '2')
+        try:
+            files = gSnapshot.StatTable(again, again.file_ids(), _Stat)
+            for path, st in self.files.items():
+                self.assertEqual(files[path].labels, st.labels)
+                self.assertEqual(files[path].st_mtime, st.st_mtime)
+        finally:
+            again.close()
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as fh:
+            fh.write(b'not a snapshot at all')
+        self.assertRaises(ValueError, gSnapshot.Snapshot, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
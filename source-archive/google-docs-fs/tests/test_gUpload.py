@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   test_gUpload.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'googledocsfs'))
+
+from gUpload import UploadQueue
+
+
+class _Recorder(object):
+    """
+    Upload function recording when each path was sent
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = []
+
+    def __call__(self, path):
+        with self.lock:
+            self.sent.append((path, time.time()))
+
+    def paths(self):
+        with self.lock:
+            return [path for path, when in self.sent]
+
+
+class UploadQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.stop()
+
+    def _queue(self, upload, **kw):
+        queue = UploadQueue(upload, **kw)
+        self.queues.append(queue)
+        return queue
+
+    def test_no_workers_uploads_in_the_caller(self):
+        sent = _Recorder()
+        queue = self._queue(sent, workers=0, delay=10)
+        self.assertTrue(queue.submit('/a'))
+        self.assertEqual(sent.paths(), ['/a'])
+
+    def test_delay_holds_a_path_back(self):
+        sent = _Recorder()
+        queue = self._queue(sent, workers=2, delay=0.3)
+        start = time.time()
+        queue.submit('/a')
+        time.sleep(0.1)
+        self.assertEqual(sent.paths(), [])
+        self.assertTrue('/a' in queue)
+        self.assertTrue(queue.drain(timeout=5))
+        self.assertEqual(sent.paths(), ['/a'])
+        self.assertFalse('/a' in queue)
+        # drain sends at once rather than waiting out the delay
+        self.assertTrue(sent.sent[0][1] - start < 0.3)
+
+    def test_resubmits_coalesce_and_restart_the_delay(self):
+        sent = _Recorder()
+        queue = self._queue(sent, workers=2, delay=0.4, max_delay=10)
+        start = time.time()
+        self.assertTrue(queue.submit('/a'))
+        for _ in range(3):
+            time.sleep(0.2)
+            self.assertFalse(queue.submit('/a'))
+        self.assertEqual(sent.paths(), [])
+        deadline = time.time() + 5
+        while not sent.paths() and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(sent.paths(), ['/a'])
+        # Sent delay after the last submit, not after the first
+        self.assertTrue(sent.sent[0][1] - start >= 0.6 + 0.4 - 0.05)
+        self.assertEqual(queue.coalesced, 3)
+        self.assertEqual(queue.submitted, 1)
+
+    def test_max_delay_bounds_the_wait(self):
+        sent = _Recorder()
+        queue = self._queue(sent, workers=1, delay=0.3, max_delay=0.5)
+        start = time.time()
+        queue.submit('/a')
+        while time.time() - start < 1.2:
+            queue.submit('/a')
+            time.sleep(0.05)
+        paths = sent.paths()
+        self.assertTrue(paths and paths[0] == '/a')
+        first = sent.sent[0][1] - start
+        self.assertTrue(0.45 <= first < 0.9, first)
+
+    def test_cancel_drops_a_queued_path(self):
+        sent = _Recorder()
+        queue = self._queue(sent, workers=1, delay=0.2)
+        queue.submit('/a')
+        queue.submit('/b')
+        self.assertTrue(queue.cancel('/a'))
+        self.assertFalse(queue.cancel('/a'))
+        self.assertFalse(queue.cancel('/never'))
+        self.assertTrue(queue.drain(timeout=5))
+        self.assertEqual(sent.paths(), ['/b'])
+
+    def test_cancel_waits_for_an_upload_in_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        done = []
+
+        def upload(path):
+            started.set()
+            release.wait(5)
+            done.append(path)
+        queue = self._queue(upload, workers=1)
+        queue.submit('/a')
+        self.assertTrue(started.wait(5))
+        self.assertEqual(queue.paths(), ['/a'])
+        result = []
+        canceller = threading.Thread(target=lambda: result.append(queue.cancel('/a')))
+        canceller.start()
+        time.sleep(0.1)
+        # Still blocked on the running upload
+        self.assertEqual(result, [])
+        release.set()
+        canceller.join(5)
+        self.assertEqual(result, [False])
+        self.assertEqual(done, ['/a'])
+        self.assertEqual(queue.paths(), [])
+
+    def test_one_path_is_never_uploaded_twice_at_once(self):
+        lock = threading.Lock()
+        active = set()
+        overlaps = []
+
+        def upload(path):
+            with lock:
+                if path in active:
+                    overlaps.append(path)
+                active.add(path)
+            time.sleep(0.02)
+            with lock:
+                active.discard(path)
+        queue = self._queue(upload, workers=4)
+        for i in range(40):
+            queue.submit('/p%d' % (i % 3))
+            time.sleep(0.005)
+        self.assertTrue(queue.drain(timeout=10))
+        self.assertEqual(overlaps, [])
+
+    def test_failures_are_recorded_not_raised(self):
+        def upload(path):
+            raise IOError('offline')
+        queue = self._queue(upload, workers=1)
+        stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+        try:
+            queue.submit('/a')
+            self.assertTrue(queue.drain(timeout=5))
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual(list(queue.errors), ['/a'])
+        self.assertEqual(queue.completed, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   test_gWal.py
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License (version 2), as
+#   published by the Free Software Foundation
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#   MA 02110-1301, USA.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'googledocsfs'))
+
+import gWal
+
+RECORDS = [['put', '/a.doc', {'size': 1, 'labels': ['x', u'\xe9']}],
+           ['move', '/a.doc', '/b/a.doc'],
+           ['dirty', '/b/a.doc', True, False],
+           ['del', '/b/a.doc'],
+           []]
+
+
+class _Quiet(object):
+    """
+    Swallow the torn record warnings replay writes to stderr
+    """
+
+    def __enter__(self):
+        self.stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+
+
+class WriteAheadLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, records):
+        wal = gWal.WriteAheadLog(self.path)
+        for record in records:
+            wal.append(record)
+        wal.close()
+        with open(self.path, 'rb') as fh:
+            return fh.read()
+
+    def test_round_trip(self):
+        self._write(RECORDS)
+        self.assertEqual(list(gWal.read(self.path)), RECORDS)
+
+    def test_missing_log_reads_empty(self):
+        self.assertEqual(list(gWal.read(self.path)), [])
+
+    def test_replay_after_truncation_at_every_offset(self):
+        data = self._write(RECORDS)
+        ends = [0]
+        for record in RECORDS:
+            ends.append(ends[-1] + len(gWal._frame(record)))
+        self.assertEqual(ends[-1], len(data))
+        with _Quiet():
+            for cut in range(len(data) + 1):
+                with open(self.path, 'wb') as fh:
+                    fh.write(data[:cut])
+                intact = len([end for end in ends[1:] if end <= cut])
+                self.assertEqual(list(gWal.read(self.path)), RECORDS[:intact], cut)
+
+    def test_reopen_drops_torn_tail_before_appending(self):
+        data = self._write(RECORDS)
+        with _Quiet():
+            for cut in range(len(data)):
+                with open(self.path, 'wb') as fh:
+                    fh.write(data[:cut])
+                intact = list(gWal.read(self.path))
+                wal = gWal.WriteAheadLog(self.path)
+                wal.append(['after', cut], durable=True)
+                wal.close()
+                self.assertEqual(list(gWal.read(self.path)), intact + [['after', cut]], cut)
+
+    def test_corrupt_record_stops_replay(self):
+        data = bytearray(self._write(RECORDS))
+        # Flip a byte inside the second record's payload
+        pos = len(gWal._frame(RECORDS[0])) + gWal.FRAME.size + 1
+        data[pos] ^= 0xff
+        with open(self.path, 'wb') as fh:
+            fh.write(bytes(data))
+        with _Quiet():
+            self.assertEqual(list(gWal.read(self.path)), RECORDS[:1])
+
+    def test_rotate_and_retire(self):
+        wal = gWal.WriteAheadLog(self.path)
+        wal.append(['one'])
+        wal.rotate()
+        wal.append(['two'])
+        wal.sync()
+        self.assertEqual(list(gWal.read(wal.old_path)), [['one']])
+        self.assertEqual(list(gWal.read(self.path)), [['two']])
+        # A checkpoint that failed leaves the old log; the next rotation
+        # keeps its records ahead of the newer ones
+        wal.rotate()
+        wal.append(['three'])
+        wal.sync()
+        self.assertEqual(list(gWal.read(wal.old_path)), [['one'], ['two']])
+        self.assertEqual(list(gWal.read(self.path)), [['three']])
+        wal.retire()
+        self.assertFalse(os.path.exists(wal.old_path))
+        wal.retire()
+        wal.close()
+        self.assertEqual(list(gWal.read(self.path)), [['three']])
+
+    def test_on_full_compacts_past_the_limit(self):
+        calls = []
+
+        def full():
+            calls.append(wal.size)
+            wal.rotate()
+            wal.retire()
+        wal = gWal.WriteAheadLog(self.path, interval=0.01, compact_bytes=100, on_full=full)
+        for i in range(20):
+            wal.append(['record', i], durable=True)
+        wal.close()
+        self.assertTrue(calls)
+        self.assertTrue(all(size > 100 for size in calls))
+        # One more record may land while the compaction is under way
+        self.assertTrue(os.path.getsize(self.path) <= 100 + 2 * len(gWal._frame(['record', 19])))
+
+
+if __name__ == '__main__':
+    unittest.main()